@@ -0,0 +1,327 @@
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+)
+
+from pydantic import BaseModel
+
+from cache import ResultCache, make_cache_key
+from image_processing import ProcessedImage
+from openai_client import AzureOpenAIClient
+from prompt import (
+    PROMPT_VERSION,
+    CloudOptimisationPrompt,
+    IdentifiedService,
+    IdentifiedServices,
+    ServiceIdentificationPrompt,
+)
+from store import service_key
+from telemetry import get_tracer, span
+
+if TYPE_CHECKING:
+    from estimator import CostEstimationResult, CostEstimator
+
+M = TypeVar("M", bound=BaseModel)
+PartialCallback = Callable[[List[Dict[str, Any]]], None]
+TILE_CONCURRENCY = 4
+
+
+def generate_structured_response(
+    openai_client: AzureOpenAIClient,
+    messages: List[Dict[str, Any]],
+    response_format: Type[M],
+    on_partial: Optional[Callable[[Dict[str, Any]], None]] = None,
+    stage: str = "chat",
+) -> M:
+    """
+    Generate a structured response, streaming it through on_partial if given.
+    """
+    if on_partial is None:
+        return openai_client.generate_response(
+            messages=messages, response_format=response_format, stage=stage
+        )
+    for partial in openai_client.stream_structured_response(
+        messages=messages, response_format=response_format, stage=stage
+    ):
+        if isinstance(partial, response_format):
+            return partial
+        on_partial(partial)
+
+
+def services_fingerprint(identified_services: IdentifiedServices) -> str:
+    """
+    Return a short hash identifying this exact set of identified services.
+    """
+    return hashlib.sha256(identified_services.model_dump_json().encode()).hexdigest()[
+        :16
+    ]
+
+
+def merge_identified_services(
+    results: List[IdentifiedServices],
+) -> IdentifiedServices:
+    """
+    Merge the services identified in each tile of a diagram.
+
+    Tiles overlap, so a service seen in several tiles is counted once, with
+    the largest quantity any tile found for it.
+    """
+    merged: Dict[Tuple[str, str, str], IdentifiedService] = {}
+    for result in results:
+        for service in result.services:
+            key = service_key(service)
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = service
+            elif service.quantity > existing.quantity:
+                merged[key] = existing.model_copy(update={"quantity": service.quantity})
+    return IdentifiedServices(services=list(merged.values()))
+
+
+def format_partial_services(services: List[Dict[str, Any]]) -> str:
+    """
+    Render partially streamed services as a markdown list.
+    """
+    lines = ["**Identified services**"]
+    for service in services:
+        if not service.get("name"):
+            continue
+        quantity = service.get("quantity")
+        prefix = f"{quantity:g} x " if isinstance(quantity, (int, float)) else ""
+        lines.append(f"- {prefix}{service['name']}")
+    return "\n".join(lines)
+
+
+class ArchitectureAnalyser:
+    def __init__(
+        self,
+        openai_client: AzureOpenAIClient,
+        result_cache: Optional[ResultCache] = None,
+    ) -> None:
+        """
+        Shared analysis stage: identifies the services in a diagram once and
+        runs the text-only follow-ups (cost estimation, optimisation) from it.
+
+        Identification results are cached by image alone, so the estimator and
+        optimiser pages reuse a single vision call for the same diagram.
+        """
+        self.openai_client = openai_client
+        self.result_cache = result_cache
+
+    def identify(
+        self,
+        image: ProcessedImage,
+        on_identified_services: Optional[PartialCallback] = None,
+    ) -> Tuple[IdentifiedServices, bool]:
+        """
+        Return the services in the diagram and whether they came from the cache.
+
+        A tiled diagram has each tile identified concurrently, and cached, on
+        its own before the results are merged.
+        """
+        if image.tiles:
+            return self.__identify_tiles(image, on_identified_services)
+        with span("identification") as identification_span:
+            cache_key = make_cache_key(
+                namespace="identification",
+                image_hash=image.content_hash,
+                provider="",
+                service_tier="",
+                prompt_version=PROMPT_VERSION,
+                deployment=self.openai_client.deployment,
+            )
+            cached_result = (
+                self.result_cache.get(cache_key) if self.result_cache else None
+            )
+            identification_span.set(cache_hit=cached_result is not None)
+            if cached_result is not None:
+                return IdentifiedServices.model_validate(cached_result), True
+
+            prompt_generator = ServiceIdentificationPrompt(
+                base64_image=image.base64, mime_type=image.mime_type
+            )
+            identify_service_prompt, identify_service_response_format = (
+                prompt_generator.generate_identify_service_prompt()
+            )
+            identified_services = generate_structured_response(
+                self.openai_client,
+                messages=identify_service_prompt,
+                response_format=identify_service_response_format,
+                stage="identification",
+                on_partial=(
+                    lambda partial: on_identified_services(partial.get("services", []))
+                )
+                if on_identified_services
+                else None,
+            )
+            if self.result_cache:
+                self.result_cache.set(cache_key, identified_services.model_dump())
+        return identified_services, False
+
+    def __identify_tiles(
+        self,
+        image: ProcessedImage,
+        on_identified_services: Optional[PartialCallback] = None,
+    ) -> Tuple[IdentifiedServices, bool]:
+        # tile index -> (services, cached), filled in as tiles finish
+        results: Dict[int, Tuple[IdentifiedServices, bool]] = {}
+        with span("tiled_identification", tiles=len(image.tiles)):
+            with ThreadPoolExecutor(
+                max_workers=min(TILE_CONCURRENCY, len(image.tiles))
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        contextvars.copy_context().run, self.identify, tile
+                    ): i
+                    for i, tile in enumerate(image.tiles)
+                }
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    if on_identified_services:
+                        # show what the finished tiles found so far
+                        partial = merge_identified_services(
+                            [results[i][0] for i in sorted(results)]
+                        )
+                        on_identified_services(
+                            [
+                                service.model_dump(mode="json")
+                                for service in partial.services
+                            ]
+                        )
+        return (
+            merge_identified_services([results[i][0] for i in sorted(results)]),
+            all(cached for _, cached in results.values()),
+        )
+
+    def optimisation_prompt(
+        self, identified_services: IdentifiedServices
+    ) -> List[Dict[str, Any]]:
+        return CloudOptimisationPrompt().synthesise_optimisation_prompt(
+            previous_response=identified_services.to_summary()
+        )
+
+    def optimise_stream(
+        self,
+        identified_services: IdentifiedServices,
+        image_hash: str,
+        provider: str,
+        service_tier: str,
+    ) -> Iterator[str]:
+        """
+        Stream alternative-provider recommendations for the identified services.
+
+        A cached response is yielded in one piece; a new one is cached once the
+        stream has been read to the end.
+        """
+        cache_key = make_cache_key(
+            namespace="optimisation",
+            image_hash=image_hash,
+            provider=provider,
+            service_tier=service_tier,
+            prompt_version=f"{PROMPT_VERSION}:{services_fingerprint(identified_services)}",
+            deployment=self.openai_client.deployment,
+        )
+        cached_result = self.result_cache.get(cache_key) if self.result_cache else None
+        # a generator cannot hold the current span across yields, so this one
+        # is started and finished by hand
+        optimisation_span = get_tracer().start_span(
+            "optimisation", cache_hit=cached_result is not None
+        )
+        error = None
+        try:
+            if cached_result is not None:
+                yield cached_result["optimisation_response"]
+                return
+
+            stream = self.openai_client.generate_response(
+                messages=self.optimisation_prompt(identified_services),
+                stage="optimisation",
+                stream=True,
+            )
+            chunks = []
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+            if self.result_cache:
+                self.result_cache.set(
+                    cache_key, {"optimisation_response": "".join(chunks)}
+                )
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            get_tracer().finish(optimisation_span, error=error)
+
+    def optimise(
+        self,
+        identified_services: IdentifiedServices,
+        image_hash: str,
+        provider: str,
+        service_tier: str,
+    ) -> str:
+        return "".join(
+            self.optimise_stream(
+                identified_services,
+                image_hash=image_hash,
+                provider=provider,
+                service_tier=service_tier,
+            )
+        )
+
+
+@dataclass
+class FullReport:
+    cost_estimation: "CostEstimationResult"
+    optimisation_response: str
+
+
+def run_full_report(
+    estimator: "CostEstimator",
+    image: ProcessedImage,
+    provider: str,
+    service_tier: str,
+    project: str = "",
+) -> FullReport:
+    """
+    Identify the services once, then run cost estimation and optimisation
+    concurrently from the shared result.
+    """
+    with span("full_report", provider=provider, service_tier=service_tier):
+        identified_services, _ = estimator.analyser.identify(image)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # each task runs in a copy of this context so its spans stay part
+            # of the same trace
+            cost_estimation = executor.submit(
+                contextvars.copy_context().run,
+                estimator.price,
+                identified_services,
+                image=image,
+                provider=provider,
+                service_tier=service_tier,
+                project=project,
+            )
+            optimisation = executor.submit(
+                contextvars.copy_context().run,
+                estimator.analyser.optimise,
+                identified_services,
+                image_hash=image.content_hash,
+                provider=provider,
+                service_tier=service_tier,
+            )
+            return FullReport(
+                cost_estimation=cost_estimation.result(),
+                optimisation_response=optimisation.result(),
+            )
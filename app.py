@@ -1,29 +1,97 @@
-import base64
 import os
-from typing import Any, Dict, List
+import time
+from functools import cached_property
+from typing import TYPE_CHECKING
 
 import streamlit as st
-from PIL import Image
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
+from config import load_config, warm_up
+from debug_panel import debug_panel
+from history import DEFAULT_TOKEN_BUDGET, ConversationHistory
+from jobs import FAILED, Job, get_job_queue
+from markdown_render import write_stream_with_tables
 from menu import menu
-from openai_client import AzureOpenAIClient
-from prompt import CostEstimationPrompt
+from telemetry import span
+
+# the pipeline modules pull in openai, pandas and PIL, so they are only
+# imported once a diagram is uploaded (or by the background warm-up)
+if TYPE_CHECKING:
+    from estimator import CostEstimationResult, CostEstimator
+    from image_processing import ProcessedImage
+    from openai_client import AzureOpenAIClient
+    from scenarios import ScenarioEngine
+    from semantic_cache import SemanticCache
+    from store import EstimateStore
+
+# how often a page waiting on an estimate checks its progress
+JOB_POLL_SECONDS = 0.5
+
+
+# reruns hand back the same upload, so only preprocess each file once
+@st.cache_data(max_entries=16, show_spinner=False)
+def _cached_preprocess_diagram(file_bytes: bytes) -> "ProcessedImage":
+    from image_processing import preprocess_diagram
+
+    return preprocess_diagram(file_bytes)
+
+
+# keyed on the newest estimate, so the export is only rebuilt once one is added
+@st.cache_data(max_entries=8, show_spinner=False)
+def _cached_line_items_csv(
+    _store: "EstimateStore", project: str, provider: str, latest_estimate_id: int
+) -> bytes:
+    from reports import export_bytes
+
+    return export_bytes(_store, "csv", project=project or None, provider=provider)
 
 
 class CostEstimatorApp:
     def __init__(self):
-        self.openai_client = AzureOpenAIClient(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
-            deployment=os.getenv("AZURE_OPENAI_API_DEPLOYMENT"),
+        load_config()
+        self.jobs = get_job_queue()
+        self.history = ConversationHistory(
+            token_budget=int(os.getenv("CHAT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+        )
+
+    # shared by every session, so reruns do not open new connections
+    @cached_property
+    def openai_client(self) -> "AzureOpenAIClient":
+        from resources import get_openai_client
+
+        return get_openai_client()
+
+    @cached_property
+    def estimator(self) -> "CostEstimator":
+        from cache import get_result_cache
+        from estimator import CostEstimator
+        from pricing import get_pricing_catalogue
+        from store import get_estimate_store
+
+        return CostEstimator(
+            openai_client=self.openai_client,
+            result_cache=get_result_cache(),
+            pricing_catalogue=get_pricing_catalogue(),
+            estimate_store=get_estimate_store(),
         )
 
+    @cached_property
+    def scenario_engine(self) -> "ScenarioEngine":
+        from scenarios import get_scenario_engine
+
+        return get_scenario_engine(self.estimator.pricing_catalogue)
+
+    @cached_property
+    def semantic_cache(self) -> "SemanticCache":
+        from semantic_cache import get_semantic_cache
+
+        return get_semantic_cache()
+
     def run(self):
         st.set_page_config(page_title="Cloud Architecture Cost Estimator")
         st.title("Cost Estimator")
         menu()
+        debug_panel()
         self.__show_sidebar()
 
         # initialise chat history
@@ -33,6 +101,9 @@ class CostEstimatorApp:
         uploaded_file_status = self.__upload_arch_diagram()
         if uploaded_file_status:
             self.__show_chat()
+        else:
+            # load the pipeline while the user picks a diagram
+            warm_up()
 
     def __show_sidebar(self):
         st.sidebar.header("Configure your architecture")
@@ -40,14 +111,21 @@ class CostEstimatorApp:
         self.service_tier = st.sidebar.selectbox(
             "Service Tier", ("Standard", "Developer", "Premium")
         )
-        self.price_range = st.sidebar.slider("Price Range (£)", 0, 1000000, 1000, 10)
+        self.price_range = st.sidebar.slider(
+            "Price Range (£)", 0, 1000000, (0, 1000000), 10
+        )
+        self.project = st.sidebar.text_input(
+            "Project",
+            help="Revisions of a diagram in the same project only reprice the "
+            "services that changed.",
+        ).strip()
 
     def __upload_arch_diagram(self):
         # Uploads image and displays image
         # st.sidebar.header("Upload your architecture")
         uploaded_file = st.file_uploader(
             "Upload your architecture diagram and I will estimate the implementation cost.",
-            type=["png", "jpg"],
+            type=["png", "jpg", "pdf"],
         )
         uploaded_file_status = uploaded_file is not None
         if uploaded_file_status:
@@ -55,7 +133,8 @@ class CostEstimatorApp:
                 "You uploaded the image below. Let's estimate the cost of this architecture."
             )
             self.__display_image(uploaded_file=uploaded_file)
-            self.__estimate_cost(image=uploaded_file)
+            # the chat only opens once the estimate it discusses is ready
+            uploaded_file_status = self.__estimate_cost(image=uploaded_file)
         else:
             st.warning(
                 "Upload an image to get started."
@@ -71,68 +150,240 @@ class CostEstimatorApp:
                 st.markdown(prompt)
 
             # Display assistant response in chat message container
+            from semantic_cache import stream_cached_answer
+
+            fingerprint = st.session_state.architecture_fingerprint
+            currency = st.session_state.get("estimate_currency", "GBP")
+            with span("follow_up") as follow_up_span:
+                hit = self.semantic_cache.get(fingerprint, prompt)
+                follow_up_span.set(cache_hit=hit is not None)
             with st.chat_message("assistant"):
-                stream = self.openai_client.generate_response(
-                    messages=[
-                        {"role": m["role"], "content": m["content"]}
-                        for m in st.session_state.messages
-                    ],
-                    stream=True,
-                )
-                response = st.write_stream(stream)
+                if hit is not None:
+                    # near-identical questions about the same architecture get
+                    # the earlier answer without another completion
+                    response = write_stream_with_tables(
+                        stream_cached_answer(hit.answer), currency=currency
+                    )
+                    st.caption(f'Answered earlier as "{hit.question}"')
+                else:
+                    stream = self.openai_client.generate_response(
+                        messages=self.history.build(st.session_state.messages),
+                        stream=True,
+                    )
+                    response = write_stream_with_tables(stream, currency=currency)
+                    self.semantic_cache.set(fingerprint, prompt, response)
             st.session_state.messages.append({"role": "assistant", "content": response})
 
     def __display_image(self, uploaded_file: UploadedFile):
-        display_image = Image.open(uploaded_file)
+        from PIL import Image
+
+        from image_processing import is_pdf
+
+        if is_pdf(uploaded_file.getvalue()):
+            # show the first page as the model sees it
+            display_image = self.__preprocess_image(image=uploaded_file).data
+        else:
+            display_image = Image.open(uploaded_file)
         st.image(display_image, use_container_width=True)
 
-    def __estimate_cost(self, image: UploadedFile):
-        base64_img = self.__convert_uploaded_img_to_base64(image=image)
+    def __estimate_cost(self, image: UploadedFile) -> bool:
+        """
+        Show the estimate for the diagram, or its progress while it runs in
+        the background. Returns whether the estimate is ready.
+        """
+        processed_image = self.__preprocess_image(image=image)
+        if processed_image.tiles:
+            st.caption(
+                f"Large diagram, read as {len(processed_image.tiles)} overlapping "
+                "sections and merged."
+            )
+        key = self.__estimate_key(processed_image)
+        # finished jobs are evicted from the queue, so the session keeps its
+        # own copy of the result and the chat stays open without a new job
+        finished = st.session_state.get("estimate_result")
+        if finished is not None and finished[0] == key:
+            result: "CostEstimationResult" = finished[1]
+        else:
+            job = self.__submit_estimate(key, processed_image)
+            if not job.done:
+                self.__show_progress(job.id)
+                return False
+            if job.status == FAILED:
+                st.error(f"Failed to estimate the cost: {job.error}")
+                # failed jobs stay in the queue so reruns do not call the model
+                # again, until the user asks for it
+                if st.button("Retry"):
+                    self.jobs.discard(job.id)
+                    st.rerun()
+                return False
+            result = job.result
+            st.session_state.estimate_result = (key, result)
 
-        prompt_generator = CostEstimationPrompt(base64_image=base64_img)
-        identify_service_prompt, identify_service_response_format = (
-            prompt_generator.generate_identify_service_prompt()
-        )
-        identify_service_response = self.__generate_response(
-            messages=identify_service_prompt,
-            response_format=identify_service_response_format,
-        )
-        cost_estimation_prompt, cost_estimation_response_format = (
-            prompt_generator.generate_cost_estimation_prompt(
-                previous_response=identify_service_response
+        # only start a new conversation when the diagram or settings change,
+        # otherwise every rerun would append the same prompt again
+        if st.session_state.get("cost_estimation_cache_key") != result.cache_key:
+            st.session_state.cost_estimation_cache_key = result.cache_key
+            st.session_state.estimate_currency = result.cost_estimate.currency
+            self.__update_architecture_fingerprint(result)
+            # the diagram is only needed for the first turn, follow-ups get a
+            # text summary of the identified services instead
+            st.session_state.messages = self.history.start(
+                messages=result.messages,
+                services_summary=result.identify_service_response,
             )
+        with st.chat_message("assistant"):
+            st.markdown(result.cost_estimation_response)
+            if result.reused_line_items:
+                estimated_at = time.localtime(result.previous_estimate.created_at)
+                st.caption(
+                    f"Reused the prices of {result.reused_line_items} unchanged "
+                    "services from the revision estimated on "
+                    f"{time.strftime('%d %b %Y %H:%M', estimated_at)}."
+                )
+        self.__show_scenarios(result=result)
+        self.__show_estimate_history()
+        return True
+
+    def __estimate_key(self, processed_image: "ProcessedImage") -> str:
+        # reruns and other sessions estimating the same diagram with the same
+        # settings attach to the job already running
+        return ":".join(
+            [
+                "estimate",
+                processed_image.content_hash,
+                self.provider,
+                self.service_tier,
+                self.project,
+                self.openai_client.deployment,
+            ]
         )
-        cost_estimation_response = self.__generate_response(
-            messages=cost_estimation_prompt,
-            response_format=cost_estimation_response_format,
+
+    def __submit_estimate(self, key: str, processed_image: "ProcessedImage") -> Job:
+        # runs on the job queue, so it must not touch st or self after submit
+        estimator = self.estimator
+        provider, service_tier, project = (
+            self.provider,
+            self.service_tier,
+            self.project,
         )
 
-        st.session_state.messages = st.session_state.messages + cost_estimation_prompt
-        st.session_state.messages.append(
-            {"role": "assistant", "content": cost_estimation_response}
+        def estimate(job: Job) -> "CostEstimationResult":
+            job.report(stage="Identifying services")
+            return estimator.estimate(
+                image=processed_image,
+                provider=provider,
+                service_tier=service_tier,
+                project=project,
+                on_identified_services=lambda services: job.report(services=services),
+                on_line_items=lambda line_items: job.report(
+                    stage="Pricing services", line_items=line_items
+                ),
+            )
+
+        return self.jobs.submit(key, estimate)
+
+    def __show_progress(self, job_id: str):
+        from analysis import format_partial_services
+
+        @st.fragment(run_every=JOB_POLL_SECONDS)
+        def progress():
+            job = self.jobs.get(job_id)
+            if job is None or job.done:
+                # render the finished estimate with the rest of the page
+                st.rerun()
+            st.info(f"{job.stage or 'Queued'}... {job.elapsed():.0f}s")
+            # stream both stages into the page while they run, the final
+            # estimate replaces them once it is complete
+            if job.progress.get("services"):
+                st.markdown(format_partial_services(job.progress["services"]))
+            if job.progress.get("line_items"):
+                st.dataframe(job.progress["line_items"], use_container_width=True)
+
+        progress()
+
+    def __update_architecture_fingerprint(self, result: "CostEstimationResult"):
+        from semantic_cache import architecture_fingerprint
+
+        fingerprint = architecture_fingerprint(
+            result.identified_services,
+            provider=self.provider,
+            service_tier=self.service_tier,
+            deployment=self.openai_client.deployment,
         )
-        with st.chat_message("assistant"):
-            st.markdown(cost_estimation_response)
+        # answers are scoped to the fingerprint, so those about a previous
+        # architecture are never served here and other sessions may still use them
+        st.session_state.architecture_fingerprint = fingerprint
 
-    def __generate_response(
-        self, messages: List[Dict[str, Any]], response_format=None
-    ) -> str:
-        return self.openai_client.generate_response(
-            messages=messages, response_format=response_format
+    def __show_scenarios(self, result: "CostEstimationResult"):
+        from scenarios import filter_by_price_range
+
+        # repricing is local, so the sidebar settings apply instantly
+        scenarios = self.scenario_engine.reprice(
+            services=result.identified_services, fallback=result.cost_estimate
+        )
+        scenarios = filter_by_price_range(scenarios, *self.price_range)
+        st.subheader("What-if scenarios")
+        if scenarios.empty:
+            st.info("No scenario falls within the selected price range.")
+            return
+        scenarios.insert(
+            0,
+            "selected",
+            (scenarios["provider"] == self.provider)
+            & (scenarios["service_tier"] == self.service_tier),
+        )
+        st.dataframe(
+            scenarios,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "selected": st.column_config.CheckboxColumn("Selected"),
+                "quantity_multiplier": st.column_config.NumberColumn(
+                    "Quantity x", format="%.1f"
+                ),
+                "monthly_cost": st.column_config.NumberColumn(
+                    "Monthly cost", format="£%.2f"
+                ),
+            },
         )
 
-    def __convert_uploaded_img_to_base64(self, image: UploadedFile) -> str:
+    def __show_estimate_history(self):
+        store = self.estimator.estimate_store
+        if store is None:
+            return
+        with st.expander("Estimate history"):
+            history = store.history(
+                project=self.project or None, provider=self.provider
+            )
+            st.dataframe(
+                history,
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    "total_monthly_cost": st.column_config.NumberColumn(
+                        "Monthly cost", format="%.2f"
+                    ),
+                    "created_at": st.column_config.DatetimeColumn("Estimated at"),
+                },
+            )
+            if not history.empty:
+                st.download_button(
+                    "Download line items (CSV)",
+                    _cached_line_items_csv(
+                        store, self.project, self.provider, int(history["id"].max())
+                    ),
+                    file_name=f"{self.project or 'estimates'}-{self.provider}.csv",
+                    mime="text/csv",
+                )
+
+    def __preprocess_image(self, image: UploadedFile) -> "ProcessedImage":
         """
-        Convert the uploaded file to a base64 string.
+        Downscale, crop and re-encode the uploaded file for the vision model,
+        rasterising PDFs and tiling diagrams too large to read in one piece.
         """
-        base64_image = base64.b64encode(image.getvalue()).decode()
-        return base64_image
+        return _cached_preprocess_diagram(image.getvalue())
 
 
 if __name__ == "__main__":
-    from dotenv import load_dotenv
-
-    load_dotenv(".env")
-
     app = CostEstimatorApp()
     app.run()
@@ -0,0 +1,346 @@
+"""
+Estimate the cost of many architecture diagrams without the Streamlit UI.
+
+Usage:
+    python batch.py diagrams/ --output results.jsonl --concurrency 8
+    python batch.py manifest.csv --output results.csv --provider Azure
+    python batch.py diagrams/ --include-optimisation
+    python batch.py revisions.txt --project checkout --concurrency 1
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from analysis import run_full_report
+from cache import get_result_cache
+from config import load_config
+from estimator import CostEstimator
+from image_processing import preprocess_diagram
+from openai_client import is_transient_error
+from pricing import get_pricing_catalogue
+from resources import get_openai_client
+from store import get_estimate_store
+from telemetry import span
+from token_usage import get_usage_tracker
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".pdf")
+RESULT_FIELDS = [
+    "id",
+    "path",
+    "status",
+    "error",
+    "attempts",
+    "elapsed_seconds",
+    "cached",
+    "estimate_id",
+    "reused_line_items",
+    "provider",
+    "service_tier",
+    "currency",
+    "total_monthly_cost",
+    "identify_service_response",
+    "cost_estimation_response",
+    "optimisation_response",
+]
+
+logger = logging.getLogger("batch")
+
+
+def load_items(source: Path) -> List[Dict[str, str]]:
+    """
+    Return the diagrams to process from a directory or a manifest file.
+
+    A manifest is either a text file with one image path per line or a CSV file
+    with a "path" column and an optional "id" column. Relative paths are
+    resolved against the manifest's directory.
+    """
+    if source.is_dir():
+        paths = sorted(
+            p for p in source.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES
+        )
+        return [{"id": str(p.relative_to(source)), "path": str(p)} for p in paths]
+
+    if source.suffix.lower() == ".csv":
+        manifest = pd.read_csv(source, dtype=str)
+        rows = manifest.to_dict(orient="records")
+    else:
+        rows = [
+            {"path": line.strip()}
+            for line in source.read_text().splitlines()
+            if line.strip() and not line.startswith("#")
+        ]
+    items = []
+    for row in rows:
+        path = Path(row["path"])
+        if not path.is_absolute():
+            path = source.parent / path
+        # a CSV manifest reads blank ids as NaN
+        item_id = (
+            row["id"] if pd.notna(row.get("id")) and row["id"].strip() else row["path"]
+        )
+        items.append({"id": item_id, "path": str(path)})
+    return items
+
+
+def load_checkpoint(checkpoint: Path) -> Dict[str, Dict[str, Any]]:
+    """
+    Return the results recorded by a previous run, keyed by item id.
+    """
+    results: Dict[str, Dict[str, Any]] = {}
+    if not checkpoint.exists():
+        return results
+    for line in checkpoint.read_text().splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # the previous run may have been killed mid-write
+            continue
+        results[record["id"]] = record
+    return results
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        estimator: CostEstimator,
+        provider: str,
+        service_tier: str,
+        concurrency: int = 4,
+        max_attempts: int = 3,
+        backoff_seconds: float = 2.0,
+        include_optimisation: bool = False,
+        project: str = "",
+    ) -> None:
+        """
+        Run the cost estimation pipeline over many diagrams with a bounded pool
+        of worker threads.
+
+        With include_optimisation, the optimisation recommendations are produced
+        alongside each estimate from the same service identification.
+        Estimates are stored under project, so with a concurrency of one a
+        manifest of diagram revisions only reprices what changed between them.
+        """
+        self.estimator = estimator
+        self.provider = provider
+        self.service_tier = service_tier
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.include_optimisation = include_optimisation
+        self.project = project
+        self._checkpoint_lock = threading.Lock()
+
+    def run(
+        self, items: List[Dict[str, str]], checkpoint: Path
+    ) -> List[Dict[str, Any]]:
+        """
+        Process every item not already completed in the checkpoint file and
+        return the results for all items in input order.
+        """
+        results = load_checkpoint(checkpoint)
+        pending = [
+            item
+            for item in items
+            if results.get(item["id"], {}).get("status") != "succeeded"
+        ]
+        logger.info(
+            "%d items, %d already done, %d to process with %d workers",
+            len(items),
+            len(items) - len(pending),
+            len(pending),
+            self.concurrency,
+        )
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.process, item) for item in pending]
+            for done, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                results[record["id"]] = record
+                self.__append_checkpoint(checkpoint, record)
+                logger.info(
+                    "[%d/%d] %s %s in %.1fs",
+                    done,
+                    len(pending),
+                    record["id"],
+                    record["status"],
+                    record["elapsed_seconds"],
+                )
+
+        return [results[item["id"]] for item in items if item["id"] in results]
+
+    def process(self, item: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Estimate a single diagram, retrying transient API failures with
+        jittered backoff.
+        """
+        record: Dict[str, Any] = {
+            "id": item["id"],
+            "path": item["path"],
+            "provider": self.provider,
+            "service_tier": self.service_tier,
+        }
+        with span("batch_item", item_id=item["id"]) as item_span:
+            start = time.perf_counter()
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    image = preprocess_diagram(Path(item["path"]).read_bytes())
+                    optimisation_response = None
+                    if self.include_optimisation:
+                        report = run_full_report(
+                            self.estimator,
+                            image=image,
+                            provider=self.provider,
+                            service_tier=self.service_tier,
+                            project=self.project,
+                        )
+                        result = report.cost_estimation
+                        optimisation_response = report.optimisation_response
+                    else:
+                        result = self.estimator.estimate(
+                            image=image,
+                            provider=self.provider,
+                            service_tier=self.service_tier,
+                            project=self.project,
+                        )
+                    record.update(
+                        status="succeeded",
+                        error=None,
+                        cached=result.cached,
+                        estimate_id=result.estimate_id,
+                        reused_line_items=result.reused_line_items,
+                        currency=result.cost_estimate.currency,
+                        total_monthly_cost=result.cost_estimate.total_monthly_cost,
+                        line_items=[
+                            item.model_dump() | {"monthly_cost": item.monthly_cost}
+                            for item in result.cost_estimate.line_items
+                        ],
+                        identify_service_response=result.identify_service_response,
+                        cost_estimation_response=result.cost_estimation_response,
+                        optimisation_response=optimisation_response,
+                    )
+                    break
+                except Exception as e:
+                    record.update(status="failed", error=str(e))
+                    # a missing or unreadable file, or a response that does not
+                    # validate, will fail the same way again
+                    if not is_transient_error(e):
+                        break
+                    if attempt < self.max_attempts:
+                        delay = self.backoff_seconds * 2 ** (attempt - 1)
+                        time.sleep(delay + random.uniform(0, delay))
+            item_span.set(retries=attempt - 1, status=record["status"])
+            item_span.error = record.get("error")
+        record["attempts"] = attempt
+        record["elapsed_seconds"] = round(time.perf_counter() - start, 3)
+        return record
+
+    def __append_checkpoint(self, checkpoint: Path, record: Dict[str, Any]) -> None:
+        with self._checkpoint_lock:
+            with checkpoint.open("a") as f:
+                f.write(json.dumps(record) + "\n")
+
+
+def write_results(results: List[Dict[str, Any]], output: Path) -> None:
+    """
+    Write the results as JSONL or CSV depending on the output file suffix.
+    """
+    if output.suffix.lower() == ".csv":
+        pd.DataFrame(results, columns=RESULT_FIELDS).to_csv(output, index=False)
+        return
+    with output.open("w") as f:
+        for record in results:
+            f.write(json.dumps(record) + "\n")
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument(
+        "source",
+        type=Path,
+        help="directory of diagrams, or a .txt/.csv manifest of image paths",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("results.jsonl"),
+        help="results file, .jsonl or .csv (default: results.jsonl)",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="file recording finished items so an interrupted run can resume "
+        "(default: <output>.checkpoint.jsonl)",
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--provider", default="GCP", choices=("GCP", "AWS", "Azure"))
+    parser.add_argument(
+        "--service-tier",
+        default="Standard",
+        choices=("Standard", "Developer", "Premium"),
+    )
+    parser.add_argument(
+        "--include-optimisation",
+        action="store_true",
+        help="also produce optimisation recommendations for each diagram",
+    )
+    parser.add_argument(
+        "--project",
+        default="",
+        help="project to store the estimates under, so revisions reuse the "
+        "prices of unchanged services",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    load_config()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = parse_args(argv)
+
+    runner = BatchRunner(
+        estimator=CostEstimator(
+            openai_client=get_openai_client(),
+            result_cache=get_result_cache(),
+            pricing_catalogue=get_pricing_catalogue(),
+            estimate_store=get_estimate_store(),
+        ),
+        provider=args.provider,
+        service_tier=args.service_tier,
+        concurrency=args.concurrency,
+        max_attempts=args.max_attempts,
+        include_optimisation=args.include_optimisation,
+        project=args.project,
+    )
+    checkpoint = args.checkpoint or args.output.with_name(
+        args.output.name + ".checkpoint.jsonl"
+    )
+    results = runner.run(items=load_items(args.source), checkpoint=checkpoint)
+    write_results(results, args.output)
+
+    failed = sum(record["status"] != "succeeded" for record in results)
+    logger.info("wrote %d results to %s, %d failed", len(results), args.output, failed)
+    for stage, usage in get_usage_tracker().summary().items():
+        logger.info(
+            "%s: %d calls, %d prompt tokens (%.0f%% cached), %d completion tokens",
+            stage,
+            usage["calls"],
+            usage["prompt_tokens"],
+            usage["cached_ratio"] * 100,
+            usage["completion_tokens"],
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
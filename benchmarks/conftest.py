@@ -0,0 +1,156 @@
+import io
+import random
+
+import pandas as pd
+import pytest
+from PIL import Image, ImageDraw
+
+from pricing import PricingCatalogue
+from replay import ReplayAzureOpenAIClient, ReplayTransport
+
+
+def draw_diagram(seed: int = 0, size=(2400, 1600)) -> bytes:
+    """
+    Draw a synthetic architecture diagram: labelled boxes joined by arrows on a
+    white page with a wide margin, saved as PNG.
+    """
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    boxes = []
+    for row in range(3):
+        for column in range(4):
+            left = 300 + column * 480 + rng.randint(-20, 20)
+            top = 250 + row * 400 + rng.randint(-20, 20)
+            boxes.append((left, top, left + 320, top + 180))
+            draw.rectangle(
+                boxes[-1], outline=(0, 90, 180), width=4, fill=(230, 240, 255)
+            )
+            draw.text((left + 20, top + 20), f"Service {row}-{column}", fill="black")
+    for start, end in zip(boxes, boxes[1:]):
+        draw.line(
+            [(start[2], (start[1] + start[3]) // 2), (end[0], (end[1] + end[3]) // 2)],
+            fill=(80, 80, 80),
+            width=3,
+        )
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope="session")
+def diagram_bytes() -> bytes:
+    return draw_diagram()
+
+
+@pytest.fixture(scope="session")
+def make_diagram():
+    return draw_diagram
+
+
+@pytest.fixture
+def replay_transport() -> ReplayTransport:
+    return ReplayTransport()
+
+
+@pytest.fixture
+def replay_client(replay_transport) -> ReplayAzureOpenAIClient:
+    return ReplayAzureOpenAIClient(replay_transport)
+
+
+@pytest.fixture(scope="session")
+def pricing_catalogue() -> PricingCatalogue:
+    rows = [
+        (
+            "Azure",
+            "App Service",
+            "P1v3",
+            "compute",
+            "Premium",
+            "uksouth",
+            "hour",
+            0.19,
+            730,
+        ),
+        (
+            "Azure",
+            "App Service",
+            "B1",
+            "compute",
+            "Standard",
+            "uksouth",
+            "hour",
+            0.01,
+            730,
+        ),
+        (
+            "Azure",
+            "SQL Database",
+            "S0",
+            "relational_database",
+            "Standard",
+            "uksouth",
+            "month",
+            11.2,
+            1,
+        ),
+        (
+            "AWS",
+            "EC2",
+            "m5.large",
+            "compute",
+            "Standard",
+            "eu-west-2",
+            "hour",
+            0.089,
+            730,
+        ),
+        (
+            "AWS",
+            "RDS",
+            "db.t3.medium",
+            "relational_database",
+            "Standard",
+            "eu-west-2",
+            "hour",
+            0.06,
+            730,
+        ),
+        (
+            "GCP",
+            "Compute Engine",
+            "e2-standard-2",
+            "compute",
+            "Standard",
+            "europe-west2",
+            "hour",
+            0.052,
+            730,
+        ),
+        (
+            "GCP",
+            "Cloud SQL",
+            "db-custom-2",
+            "relational_database",
+            "Standard",
+            "europe-west2",
+            "hour",
+            0.09,
+            730,
+        ),
+    ]
+    frame = pd.DataFrame(
+        rows,
+        columns=[
+            "provider",
+            "service",
+            "sku",
+            "category",
+            "tier",
+            "region",
+            "unit",
+            "unit_price",
+            "monthly_units",
+        ],
+    ).assign(currency="GBP")
+    return PricingCatalogue(frame, version="benchmark")
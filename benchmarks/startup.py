@@ -0,0 +1,131 @@
+"""
+Report the cold start and rerun cost of the Streamlit pages.
+
+Every measurement runs in a fresh interpreter, so imports are as cold as in a
+new container. Reported are the import time of each page script and of the
+pipeline it loads on the first upload (from python -X importtime), the first
+run of each page in a new process, and the median rerun once it is warm.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --reruns 20 --top 15
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+PAGES = ("app.py", "pages/optimiser.py")
+
+PAGE_RUN_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+# pages are run through the entrypoint so their page links resolve
+app_test = AppTest.from_file("app.py", default_timeout=60)
+app_test.switch_page(sys.argv[1]).run()
+first_run = time.perf_counter() - start
+reruns = []
+for _ in range(int(sys.argv[2])):
+    start = time.perf_counter()
+    app_test.run()
+    reruns.append(time.perf_counter() - start)
+print(json.dumps({
+    "first_run": first_run,
+    "reruns": reruns,
+    "errors": [str(e.value) for e in app_test.exception],
+}))
+"""
+
+
+def import_times(statement: str) -> List[Tuple[str, float]]:
+    """
+    Return (module, cumulative seconds) for each top-level import made by
+    statement in a fresh interpreter, leaving out interpreter startup.
+    """
+    startup = {name for name, _ in _import_times("pass")}
+    return [(name, t) for name, t in _import_times(statement) if name not in startup]
+
+
+def _import_times(statement: str) -> List[Tuple[str, float]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # nested imports are indented, only count what the statement imported
+        if not name.startswith("  "):
+            times.append((name.strip(), int(cumulative) / 1e6))
+    return times
+
+
+def page_timings(page: str, reruns: int) -> Dict[str, object]:
+    """
+    Run a page in a fresh interpreter and time its first run and reruns.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", PAGE_RUN_SCRIPT, page, str(reruns)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+        env=os.environ | {"PYTHONPATH": str(ROOT)},
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def page_module_statement(page: str) -> str:
+    # pages/ is not a package, so load the script by path like Streamlit does
+    return (
+        "import importlib.util; "
+        f"spec = importlib.util.spec_from_file_location('page', {page!r}); "
+        "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+    )
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+    sys.path.insert(0, str(ROOT))
+    from config import PIPELINE_MODULES
+
+    print("Import time (cold)")
+    for page in PAGES:
+        times = import_times(page_module_statement(page))
+        print(f"  {page:<28} {sum(t for _, t in times):7.3f}s")
+    pipeline = import_times("import " + ", ".join(PIPELINE_MODULES))
+    print(f"  {'pipeline (first upload)':<28} {sum(t for _, t in pipeline):7.3f}s")
+    for name, seconds in sorted(pipeline, key=lambda t: -t[1])[: args.top]:
+        print(f"    {name:<26} {seconds:7.3f}s")
+
+    print("Page runs")
+    for page in PAGES:
+        timings = page_timings(page, args.reruns)
+        reruns = timings["reruns"]
+        print(
+            f"  {page:<28} first run {timings['first_run']:.3f}s, "
+            f"rerun median {statistics.median(reruns) * 1000:.1f}ms, "
+            f"max {max(reruns) * 1000:.1f}ms"
+        )
+        for error in timings["errors"]:
+            print(f"    error: {error}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
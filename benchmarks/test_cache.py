@@ -0,0 +1,66 @@
+import pytest
+
+from cache import ResultCache, make_cache_key
+from semantic_cache import DEFAULT_MAX_ENTRIES, SemanticCache
+
+VALUE = {"model_estimate": {"line_items": [{"service_name": "VM"}] * 20}}
+
+
+def _key(i: int) -> str:
+    return make_cache_key("bench", f"{i:064x}", "Azure", "Standard", "1", "d")
+
+
+def test_memory_hit(benchmark):
+    cache = ResultCache(cache_dir=None)
+    cache.set(_key(0), VALUE)
+    assert benchmark(cache.get, _key(0)) == VALUE
+
+
+def test_disk_hit(benchmark, tmp_path):
+    ResultCache(cache_dir=str(tmp_path)).set(_key(0), VALUE)
+
+    def cold_get():
+        # a new instance has an empty memory tier, so this reads the file
+        return ResultCache(cache_dir=str(tmp_path)).get(_key(0))
+
+    assert benchmark(cold_get) == VALUE
+
+
+def test_miss(benchmark, tmp_path):
+    cache = ResultCache(cache_dir=str(tmp_path))
+    assert benchmark(cache.get, _key(1)) is None
+
+
+def test_set(benchmark, tmp_path):
+    cache = ResultCache(cache_dir=str(tmp_path))
+    keys = iter(range(10**9))
+    benchmark(lambda: cache.set(_key(next(keys)), VALUE))
+
+
+def test_semantic_hit_in_full_cache(benchmark):
+    cache = SemanticCache(max_entries=DEFAULT_MAX_ENTRIES)
+    for i in range(DEFAULT_MAX_ENTRIES - 1):
+        cache.set(f"{i % 8}", f"what would {i} extra nodes cost per month", "...")
+    cache.set("0", "What if we use reserved instances?", "Reserved answer")
+    hit = benchmark(cache.get, "0", "could we use reserved instance")
+    assert hit is not None and hit.answer == "Reserved answer"
+
+
+@pytest.mark.parametrize(
+    "cached, asked",
+    [
+        (
+            "What if we use reserved instances?",
+            "What if we do not use reserved instances?",
+        ),
+        ("What about a 1 year reservation?", "What about a 3 year reservation?"),
+        ("What would 3 VMs cost?", "What would 30 VMs cost?"),
+        ("What if we add two replicas?", "What if we add three replicas?"),
+    ],
+)
+def test_semantic_miss_on_different_meaning(cached, asked):
+    cache = SemanticCache()
+    cache.set("0", cached, "Cached answer")
+    assert cache.get("0", asked) is None
+    # the same question still hits
+    assert cache.get("0", cached).answer == "Cached answer"
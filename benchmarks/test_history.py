@@ -0,0 +1,30 @@
+import pytest
+
+from history import ConversationHistory, estimate_tokens
+from prompt import IdentifiedServices
+from replay import SYNTHETIC_CONTENT
+
+
+@pytest.mark.parametrize("turns", [10, 100, 1000])
+def test_history_build(benchmark, turns):
+    history = ConversationHistory(token_budget=6000)
+    summary = IdentifiedServices.model_validate(
+        SYNTHETIC_CONTENT["IdentifiedServices"]
+    ).to_summary()
+    messages = history.start(
+        messages=[
+            {"role": "system", "content": "You are a solution architect."},
+            {"role": "user", "content": "Estimate the cost of this architecture."},
+            {"role": "assistant", "content": "## Estimated Cost\n" * 20},
+        ],
+        services_summary=summary,
+    )
+    for turn in range(turns):
+        messages.append(
+            {"role": "user", "content": f"What if we double service {turn}?"}
+        )
+        messages.append({"role": "assistant", "content": "It would cost more. " * 40})
+
+    request = benchmark(history.build, messages)
+    # the request stays within budget however long the conversation gets
+    assert estimate_tokens(request) <= 6000 + 400
@@ -0,0 +1,40 @@
+import io
+
+from PIL import Image
+
+from image_processing import (
+    encode_smallest,
+    perceptual_hash,
+    preprocess_diagram,
+    preprocess_image,
+)
+
+
+def test_preprocess_image(benchmark, diagram_bytes):
+    processed = benchmark(preprocess_image, diagram_bytes)
+    assert max(processed.width, processed.height) <= 2048
+    assert min(processed.width, processed.height) <= 768
+
+
+def test_encode_smallest(benchmark, diagram_bytes):
+    image = Image.open(io.BytesIO(diagram_bytes)).convert("RGB")
+    image.thumbnail((1152, 768))
+    data, mime_type = benchmark(encode_smallest, image)
+    assert mime_type in ("image/png", "image/jpeg")
+
+
+def test_perceptual_hash(benchmark, diagram_bytes):
+    image = Image.open(io.BytesIO(diagram_bytes)).convert("RGB")
+    assert len(benchmark(perceptual_hash, image)) == 16
+
+
+def test_preprocess_large_diagram_into_tiles(benchmark, diagram_bytes):
+    # the same diagram at poster size, too large to read in one piece
+    image = Image.open(io.BytesIO(diagram_bytes))
+    buffer = io.BytesIO()
+    image.resize((image.width * 3, image.height * 3)).save(buffer, "PNG")
+    processed = benchmark.pedantic(
+        preprocess_diagram, args=(buffer.getvalue(),), rounds=3, iterations=1
+    )
+    assert len(processed.tiles) > 1
+    assert all(min(tile.width, tile.height) <= 768 for tile in processed.tiles)
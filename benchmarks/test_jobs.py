@@ -0,0 +1,42 @@
+import time
+
+from jobs import FAILED, SUCCEEDED, JobQueue
+
+
+def wait(job, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return job
+
+
+def test_failed_job_is_not_rerun():
+    queue = JobQueue(max_workers=1)
+    runs = []
+
+    def fail(job):
+        runs.append(job.id)
+        raise ValueError("bad image")
+
+    job = wait(queue.submit("estimate:bad", fail))
+    assert job.status == FAILED and job.error == "bad image"
+    assert job.finished_at is not None
+
+    # a rerun of the page gets the failed job back instead of a new run
+    again = wait(queue.submit("estimate:bad", fail))
+    assert again is job and again.status == FAILED
+    assert len(runs) == 1
+
+    # only an explicit retry runs the work again
+    queue.discard(job.id)
+    retried = wait(queue.submit("estimate:bad", lambda job: "ok"))
+    assert retried is not job and retried.status == SUCCEEDED
+    queue.shutdown()
+
+
+def test_submit_attached(benchmark):
+    queue = JobQueue(max_workers=1)
+    wait(queue.submit("estimate:cached", lambda job: "result"))
+    job = benchmark(queue.submit, "estimate:cached", lambda job: "result")
+    assert job.result == "result"
+    queue.shutdown()
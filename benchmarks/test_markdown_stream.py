@@ -0,0 +1,29 @@
+import pytest
+
+from markdown_stream import MarkdownStreamParser
+
+RESPONSE = (
+    "## Estimated Cost\n\nThe architecture uses the services below.\n\n"
+    "| Service | SKU | Monthly Cost |\n|---|---|---:|\n"
+    + "".join(f"| Service {i} | D4s v5 | £{i * 12.5:,.2f} |\n" for i in range(200))
+    + "\nTotal estimated monthly cost is £248,750.00\n"
+)
+
+
+@pytest.mark.parametrize("chunk_size", [4, 64])
+def test_parse_streamed_table(benchmark, chunk_size):
+    chunks = [RESPONSE[i : i + chunk_size] for i in range(0, len(RESPONSE), chunk_size)]
+
+    def parse():
+        parser = MarkdownStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+            # pages render the pending paragraph after every chunk
+            parser.pending_text
+        parser.close()
+        return parser
+
+    parser = benchmark(parse)
+    assert len(parser.rows) == 200
+    assert parser.rows[-1].values["Monthly Cost"] == 199 * 12.5
+    assert parser.total == 248750.0
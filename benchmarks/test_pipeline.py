@@ -0,0 +1,141 @@
+from analysis import run_full_report
+from batch import BatchRunner, load_items
+from cache import ResultCache
+from estimator import CostEstimator
+from image_processing import preprocess_image
+from replay import ReplayAzureOpenAIClient, ReplayTransport
+
+
+def test_estimate_uncached(benchmark, replay_client, diagram_bytes, pricing_catalogue):
+    image = preprocess_image(diagram_bytes)
+
+    def estimate():
+        estimator = CostEstimator(
+            openai_client=replay_client,
+            result_cache=ResultCache(cache_dir=None),
+            pricing_catalogue=pricing_catalogue,
+        )
+        return estimator.estimate(image, provider="Azure", service_tier="Standard")
+
+    result = benchmark(estimate)
+    assert not result.cached and result.cost_estimate.line_items
+
+
+def test_estimate_cache_hit(benchmark, replay_client, replay_transport, diagram_bytes):
+    image = preprocess_image(diagram_bytes)
+    estimator = CostEstimator(
+        openai_client=replay_client, result_cache=ResultCache(cache_dir=None)
+    )
+    estimator.estimate(image, provider="Azure", service_tier="Standard")
+    requests = replay_transport.requests
+
+    result = benchmark(
+        estimator.estimate, image, provider="Azure", service_tier="Standard"
+    )
+    assert result.cached
+    assert replay_transport.requests == requests
+
+
+def test_estimate_streamed(benchmark, diagram_bytes):
+    transport = ReplayTransport(latency_seconds=0.01, chunk_latency_seconds=0.001)
+    client = ReplayAzureOpenAIClient(transport)
+    image = preprocess_image(diagram_bytes)
+    updates = []
+
+    def estimate():
+        return CostEstimator(openai_client=client).estimate(
+            image,
+            provider="Azure",
+            service_tier="Standard",
+            on_identified_services=updates.append,
+            on_line_items=updates.append,
+        )
+
+    result = benchmark.pedantic(estimate, rounds=5)
+    assert updates and result.cost_estimate.line_items
+
+
+def test_full_report(benchmark, diagram_bytes):
+    client = ReplayAzureOpenAIClient(ReplayTransport(latency_seconds=0.02))
+    image = preprocess_image(diagram_bytes)
+
+    def report():
+        estimator = CostEstimator(openai_client=client)
+        return run_full_report(
+            estimator, image, provider="Azure", service_tier="Standard"
+        )
+
+    result = benchmark.pedantic(report, rounds=5)
+    assert result.optimisation_response
+
+
+def _diagram_items(tmp_path, make_diagram, count):
+    items = []
+    for i in range(count):
+        path = tmp_path / f"diagram-{i}.png"
+        path.write_bytes(make_diagram(seed=i, size=(1200, 800)))
+        items.append({"id": path.name, "path": str(path)})
+    return items
+
+
+def _run_batch(benchmark, tmp_path, transport, items):
+    runner = BatchRunner(
+        estimator=CostEstimator(openai_client=ReplayAzureOpenAIClient(transport)),
+        provider="Azure",
+        service_tier="Standard",
+        concurrency=8,
+        backoff_seconds=0.01,
+    )
+    checkpoint = tmp_path / "results.checkpoint.jsonl"
+
+    def run():
+        checkpoint.unlink(missing_ok=True)
+        return runner.run(items, checkpoint=checkpoint)
+
+    return benchmark.pedantic(run, rounds=3)
+
+
+def test_batch_pipeline(benchmark, tmp_path, make_diagram):
+    items = _diagram_items(tmp_path, make_diagram, 16)
+    results = _run_batch(
+        benchmark, tmp_path, ReplayTransport(latency_seconds=0.02), items
+    )
+    assert [r["status"] for r in results] == ["succeeded"] * len(items)
+
+
+def test_batch_pipeline_with_rate_limits(benchmark, tmp_path, make_diagram):
+    items = _diagram_items(tmp_path, make_diagram, 16)
+    transport = ReplayTransport(latency_seconds=0.02, rate_limit_every=5)
+    results = _run_batch(benchmark, tmp_path, transport, items)
+    assert transport.rate_limited
+    assert [r["status"] for r in results] == ["succeeded"] * len(items)
+
+
+def test_batch_retries_only_transient_errors(tmp_path, diagram_bytes):
+    (tmp_path / "notes.png").write_bytes(b"not an image")
+    (tmp_path / "diagram.png").write_bytes(diagram_bytes)
+    items = [
+        {"id": name, "path": str(tmp_path / name)}
+        for name in ("missing.png", "notes.png", "diagram.png")
+    ]
+    transport = ReplayTransport(rate_limit_every=1, retry_after_ms=1)
+    runner = BatchRunner(
+        estimator=CostEstimator(openai_client=ReplayAzureOpenAIClient(transport)),
+        provider="Azure",
+        service_tier="Standard",
+        backoff_seconds=0.01,
+    )
+    results = runner.run(items, checkpoint=tmp_path / "results.checkpoint.jsonl")
+    assert [r["status"] for r in results] == ["failed"] * 3
+    # bad files fail straight away, only the rate limited request is retried
+    assert [r["attempts"] for r in results] == [1, 1, 3]
+
+
+def test_load_items_blank_csv_id(tmp_path):
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("id,path\ncheckout,a.png\n,b.png\n  ,c.png\n")
+    assert [item["id"] for item in load_items(manifest)] == [
+        "checkout",
+        "b.png",
+        "c.png",
+    ]
@@ -0,0 +1,58 @@
+import pandas as pd
+
+import pricing
+from pricing import CATALOGUE_COLUMNS, PricingCatalogue, get_pricing_catalogue
+from prompt import IdentifiedService, IdentifiedServices
+
+
+def test_catalogue_ignores_other_currencies():
+    # the dollar row is cheaper, so it would be picked if it were kept
+    frame = pd.DataFrame(
+        [
+            (
+                "AWS",
+                "EC2",
+                "m5.large",
+                "compute",
+                "Standard",
+                "eu-west-2",
+                "hour",
+                0.089,
+                730,
+                "GBP",
+            ),
+            (
+                "AWS",
+                "EC2",
+                "m5.large",
+                "compute",
+                "Standard",
+                "eu-west-2",
+                "hour",
+                0.01,
+                730,
+                "usd",
+            ),
+        ],
+        columns=CATALOGUE_COLUMNS,
+    )
+    catalogue = PricingCatalogue(frame, version="test")
+    services = IdentifiedServices(
+        services=[
+            IdentifiedService(
+                name="EC2", provider="AWS", category="compute", sku="", quantity=1
+            )
+        ]
+    )
+    estimate, unpriced = catalogue.price(services, service_tier="Standard")
+    assert not unpriced
+    assert [item.currency for item in estimate.line_items] == ["GBP"]
+    assert estimate.line_items[0].unit_price == 0.089
+
+
+def test_invalid_catalogue_is_ignored(monkeypatch, tmp_path):
+    (tmp_path / "prices.csv").write_text("provider,service\nAzure,App Service\n")
+    monkeypatch.setenv("PRICING_CATALOGUE_DIR", str(tmp_path))
+    monkeypatch.setattr(pricing, "_catalogue", None)
+    monkeypatch.setattr(pricing, "_catalogue_loaded", False)
+    assert get_pricing_catalogue() is None
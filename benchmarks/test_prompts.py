@@ -0,0 +1,54 @@
+import pytest
+from pydantic import ValidationError
+
+from image_processing import preprocess_image
+from prompt import (
+    SYSTEM_PROMPT,
+    CloudOptimisationPrompt,
+    CostEstimate,
+    CostEstimationPrompt,
+    IdentifiedServices,
+    ServiceIdentificationPrompt,
+)
+from replay import SYNTHETIC_CONTENT
+
+IDENTIFIED = IdentifiedServices.model_validate(SYNTHETIC_CONTENT["IdentifiedServices"])
+ESTIMATE = CostEstimate.model_validate(SYNTHETIC_CONTENT["CostEstimate"])
+
+
+def test_identify_service_prompt(benchmark, diagram_bytes):
+    image = preprocess_image(diagram_bytes)
+
+    def build():
+        return ServiceIdentificationPrompt(
+            base64_image=image.base64, mime_type=image.mime_type
+        ).generate_identify_service_prompt()
+
+    messages, _ = benchmark(build)
+    assert messages[0] is SYSTEM_PROMPT
+
+
+def test_follow_up_prompts(benchmark):
+    summary = IDENTIFIED.to_summary()
+
+    def build():
+        cost_prompt, _ = CostEstimationPrompt().generate_cost_estimation_prompt(summary)
+        optimisation_prompt = CloudOptimisationPrompt().synthesise_optimisation_prompt(
+            summary
+        )
+        return cost_prompt, optimisation_prompt
+
+    cost_prompt, optimisation_prompt = benchmark(build)
+    # both follow-ups share everything but the final task
+    assert cost_prompt[:-1] == optimisation_prompt[:-1]
+
+
+def test_estimate_markdown(benchmark):
+    assert "Total estimated monthly cost" in benchmark(ESTIMATE.to_markdown)
+
+
+def test_estimate_rejects_mixed_currencies():
+    line_items = ESTIMATE.model_dump()["line_items"]
+    line_items[0]["currency"] = "USD"
+    with pytest.raises(ValidationError, match="more than one currency"):
+        CostEstimate(line_items=line_items)
@@ -0,0 +1,35 @@
+import time
+from email.utils import formatdate
+
+import pytest
+
+from rate_limit import TokenBucket, parse_retry_after
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"retry-after": "7"}, 7.0),
+        ({"retry-after": "soon"}, None),
+        ({"retry-after": "Mon, 99 Foo 2025 25:61:00"}, None),
+        ({}, None),
+    ],
+)
+def test_parse_retry_after(headers, expected):
+    assert parse_retry_after(headers) == expected
+
+
+def test_parse_retry_after_http_date():
+    # formatdate writes "-0000", which parses to a naive datetime read as UTC
+    header = formatdate(time.time() + 30)
+    assert 25 < parse_retry_after({"retry-after": header}) <= 30
+
+
+def test_bucket_available_is_read_only():
+    bucket = TokenBucket(capacity=100, refill_per_second=1000)
+    bucket.consume(60)
+    state = (bucket.tokens, bucket.updated_at)
+    time.sleep(0.01)
+    assert 40 < bucket.available() <= 100
+    assert (bucket.tokens, bucket.updated_at) == state
@@ -0,0 +1,59 @@
+import pytest
+
+from image_processing import preprocess_image
+from prompt import CostEstimate, CostLineItem, IdentifiedServices
+from reports import export_line_items, summarise
+from store import EstimateStore
+
+ESTIMATES = 2000
+LINE_ITEMS = 10
+
+
+@pytest.fixture(scope="module")
+def filled_store(tmp_path_factory, diagram_bytes):
+    store = EstimateStore(str(tmp_path_factory.mktemp("store") / "estimates.sqlite3"))
+    image = preprocess_image(diagram_bytes)
+    for i in range(ESTIMATES):
+        store.save(
+            project=f"project-{i % 20}",
+            image=image,
+            provider=("Azure", "AWS", "GCP")[i % 3],
+            service_tier="Standard",
+            identified_services=IdentifiedServices(services=[]),
+            cost_estimate=CostEstimate(
+                line_items=[
+                    CostLineItem(
+                        service_name=f"Service {j}",
+                        assumptions=["730 hours per month"],
+                        quantity=1 + i % 4,
+                        unit="hour",
+                        unit_price=0.05 * (j + 1),
+                        monthly_units=730,
+                        currency="GBP",
+                    )
+                    for j in range(LINE_ITEMS)
+                ]
+            ),
+        )
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("format", ["csv", "parquet"])
+def test_export_line_items(benchmark, filled_store, tmp_path, format):
+    rows = benchmark.pedantic(
+        export_line_items,
+        args=(filled_store, tmp_path / f"line_items.{format}"),
+        kwargs={"chunksize": 5000},
+        rounds=3,
+    )
+    assert rows == ESTIMATES * LINE_ITEMS
+
+
+def test_summarise(benchmark, filled_store):
+    totals = benchmark.pedantic(
+        summarise, args=(filled_store,), kwargs={"chunksize": 5000}, rounds=3
+    )
+    assert totals["line_items"].sum() == ESTIMATES * LINE_ITEMS
+    # 3 providers and 20 projects interleave to 60 combinations
+    assert len(totals) == 60 * LINE_ITEMS
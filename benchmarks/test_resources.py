@@ -0,0 +1,26 @@
+from resources import ClientRegistry
+
+KEY = ("https://example.openai.azure.com", "gpt-4o", "2024-10-21")
+
+
+def _registry() -> ClientRegistry:
+    # a long interval so get() does not start checks of its own
+    registry = ClientRegistry(health_check_interval=3600)
+    registry.get(*KEY, api_key="key")
+    return registry
+
+
+def test_failed_health_check_replaces_client(monkeypatch):
+    registry = _registry()
+    client = registry.get(*KEY, api_key="key")
+    monkeypatch.setattr(client, "health_check", lambda: False)
+    registry._ClientRegistry__check_health(KEY)
+    assert registry.get(*KEY, api_key="key") is not client
+
+
+def test_health_check_after_close():
+    registry = _registry()
+    registry.close()
+    # a check started before close() finds no client and does nothing
+    registry._ClientRegistry__check_health(KEY)
+    assert registry._clients == {}
@@ -0,0 +1,89 @@
+import time
+
+from replay import (
+    REPLAY_API_VERSION,
+    REPLAY_ENDPOINT,
+    ReplayAsyncAzureOpenAIClient,
+    ReplayAzureOpenAIClient,
+    ReplayTransport,
+)
+from router import TEXT, VISION, Deployment, DeploymentRouter
+
+MESSAGES = [{"role": "user", "content": "What would this cost in Premium?"}]
+IMAGE_MESSAGES = [
+    {
+        "role": "user",
+        "content": [
+            {"type": "text", "text": "Identify the services."},
+            {"type": "image_url", "image_url": {"url": "data:image/png;base64,"}},
+        ],
+    }
+]
+
+
+def make_router(latencies, costs, capabilities=None, **kwargs) -> DeploymentRouter:
+    deployments = [
+        Deployment(
+            deployment=name,
+            azure_endpoint=REPLAY_ENDPOINT,
+            api_version=REPLAY_API_VERSION,
+            capabilities=(capabilities or {}).get(name, (TEXT, VISION)),
+            cost=costs[name],
+        )
+        for name in latencies
+    ]
+    transports = {
+        name: ReplayTransport(latency_seconds=latency)
+        for name, latency in latencies.items()
+    }
+    clients = {
+        name: ReplayAzureOpenAIClient(transport, deployment=name)
+        for name, transport in transports.items()
+    }
+    async_clients = {
+        name: ReplayAsyncAzureOpenAIClient(transport, deployment=name)
+        for name, transport in transports.items()
+    }
+    return DeploymentRouter(
+        deployments,
+        client_for=lambda deployment: clients[deployment.deployment],
+        async_client_for=lambda deployment: async_clients[deployment.deployment],
+        **kwargs,
+    )
+
+
+def test_route_by_capability_and_cost(benchmark):
+    router = make_router(
+        latencies={"mini": 0.0, "vision": 0.0},
+        costs={"mini": 1, "vision": 15},
+        capabilities={"mini": (TEXT,)},
+    )
+
+    def route():
+        return router.candidates("chat"), router.candidates("identification", True)
+
+    text, vision = benchmark(route)
+    assert [d.deployment for d in text] == ["mini", "vision"]
+    assert [d.deployment for d in vision] == ["vision"]
+
+
+def test_hedged_request_under_load(benchmark):
+    # the cheap deployment is stuck behind a load spike, the spare one is not
+    router = make_router(
+        latencies={"busy": 0.3, "spare": 0.02},
+        costs={"busy": 1, "spare": 20},
+        hedge=True,
+        min_hedge_delay=0.05,
+        initial_hedge_delay=0.05,
+    )
+    durations = []
+
+    def generate(perf_counter=time.perf_counter):
+        start = perf_counter()
+        response = router.generate_response(messages=MESSAGES)
+        durations.append(perf_counter() - start)
+        return response
+
+    assert benchmark.pedantic(generate, rounds=10)
+    # every request was answered by the hedge long before the busy deployment
+    assert max(durations) < 0.3
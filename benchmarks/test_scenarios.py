@@ -0,0 +1,65 @@
+import pytest
+
+from prompt import IdentifiedService, IdentifiedServices
+from scenarios import ScenarioEngine
+
+SERVICES = IdentifiedServices(
+    services=[
+        IdentifiedService(
+            name="App Service", provider="Azure", category="compute", sku="", quantity=2
+        ),
+        IdentifiedService(
+            name="Azure SQL Database",
+            provider="Azure",
+            category="relational_database",
+            sku="",
+            quantity=1,
+        ),
+    ]
+)
+
+
+def test_reprice_totals(benchmark, pricing_catalogue):
+    engine = ScenarioEngine(pricing_catalogue)
+    scenarios = benchmark(engine.reprice, SERVICES)
+    totals = {
+        (row.provider, row.service_tier, row.quantity_multiplier): (
+            row.monthly_cost,
+            row.priced_services,
+        )
+        for row in scenarios.itertuples()
+    }
+    # Azure keeps its own services: B1 app service and S0 database
+    assert totals[("Azure", "Standard", 1.0)] == pytest.approx((2 * 7.3 + 11.2, 2))
+    # like the estimate, a service missing from the tier takes any tier's price
+    assert totals[("Azure", "Premium", 1.0)] == pytest.approx((2 * 138.7 + 11.2, 2))
+    # other providers use their cheapest service in the same category
+    assert totals[("AWS", "Standard", 1.0)] == pytest.approx((2 * 64.97 + 43.8, 2))
+    assert totals[("GCP", "Standard", 2.0)] == pytest.approx(
+        (2 * (2 * 37.96 + 65.7), 2)
+    )
+    # nothing is listed in the Developer tier: Azure's own services fall back
+    # to their cheapest SKU in any tier, other providers have no scenario
+    assert totals[("Azure", "Developer", 1.0)] == totals[("Azure", "Standard", 1.0)]
+    assert ("AWS", "Developer", 1.0) not in totals
+
+
+def test_selected_scenario_matches_estimate(pricing_catalogue):
+    services = IdentifiedServices(
+        services=[
+            service.model_copy(update={"sku": "P1v3"})
+            if service.name == "App Service"
+            else service
+            for service in SERVICES.services
+        ]
+    )
+    estimate, _ = pricing_catalogue.price(services, service_tier="Standard")
+    scenarios = ScenarioEngine(pricing_catalogue).reprice(services, fallback=estimate)
+    selected = scenarios[
+        (scenarios["provider"] == "Azure")
+        & (scenarios["service_tier"] == "Standard")
+        & (scenarios["quantity_multiplier"] == 1.0)
+    ]
+    # the premium SKU is priced as identified, not as the cheapest standard one
+    assert selected["monthly_cost"].item() == pytest.approx(estimate.total_monthly_cost)
+    assert estimate.total_monthly_cost == pytest.approx(2 * 138.7 + 11.2)
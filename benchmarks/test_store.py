@@ -0,0 +1,84 @@
+import json
+
+from cache import ResultCache
+from estimator import CostEstimator
+from image_processing import preprocess_image
+from prompt import IdentifiedService, IdentifiedServices
+from replay import ReplayAzureOpenAIClient, ReplayTransport
+from store import EstimateStore
+
+
+class PromptCapturingTransport(ReplayTransport):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.prompts = []
+
+    def reply_content(self, body):
+        self.prompts.append(json.dumps(body["messages"]))
+        return super().reply_content(body)
+
+
+def _services(blob_sku: str) -> IdentifiedServices:
+    return IdentifiedServices(
+        services=[
+            IdentifiedService(
+                name="Azure Cosmos DB",
+                provider="Azure",
+                category="nosql_database",
+                sku="",
+                quantity=1,
+            ),
+            IdentifiedService(
+                name="Azure Blob Storage",
+                provider="Azure",
+                category="object_storage",
+                sku=blob_sku,
+                quantity=1,
+            ),
+        ]
+    )
+
+
+def test_revision_reprices_only_changed_service(make_diagram):
+    transport = PromptCapturingTransport()
+    estimator = CostEstimator(
+        openai_client=ReplayAzureOpenAIClient(transport),
+        estimate_store=EstimateStore(":memory:"),
+    )
+
+    def price(seed, services):
+        return estimator.price(
+            services,
+            image=preprocess_image(make_diagram(seed)),
+            provider="Azure",
+            service_tier="Standard",
+            project="checkout",
+        )
+
+    first = price(0, _services(blob_sku=""))
+    assert first.reused_line_items == 0 and transport.requests == 1
+
+    second = price(1, _services(blob_sku="Cool"))
+    # cosmos db is carried over, only the changed blob storage goes to the model
+    assert second.previous_estimate.id == first.estimate_id
+    assert second.reused_line_items == 1 and transport.requests == 2
+    assert "Azure Blob Storage" in transport.prompts[-1]
+    assert "Azure Cosmos DB" not in transport.prompts[-1]
+
+
+def test_rerun_of_same_diagram_is_not_a_revision(diagram_bytes):
+    transport = ReplayTransport()
+    estimator = CostEstimator(
+        openai_client=ReplayAzureOpenAIClient(transport),
+        result_cache=ResultCache(cache_dir=None),
+        estimate_store=EstimateStore(":memory:"),
+    )
+    image = preprocess_image(diagram_bytes)
+    first = estimator.estimate(image, provider="Azure", service_tier="Standard")
+    second = estimator.estimate(image, provider="Azure", service_tier="Standard")
+    # identification and pricing once, then nothing
+    assert transport.requests == 2
+    assert second.cached and second.reused_line_items == 0
+    assert second.cache_key == first.cache_key
+    assert second.cost_estimate == first.cost_estimate
+    assert second.estimate_id == first.estimate_id
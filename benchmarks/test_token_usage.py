@@ -0,0 +1,21 @@
+from types import SimpleNamespace
+
+from token_usage import UsageTracker
+
+USAGE = SimpleNamespace(
+    prompt_tokens=2000,
+    completion_tokens=100,
+    prompt_tokens_details=SimpleNamespace(cached_tokens=1024),
+)
+
+
+def test_summary_counts_evicted_records(benchmark):
+    tracker = UsageTracker(max_records=10)
+    for _ in range(25):
+        tracker.record("cost_estimation", "d", USAGE)
+    summary = benchmark(tracker.summary)
+    # only the last 10 records are kept, but the totals cover all 25
+    assert len(tracker.records()) == 10
+    assert summary["cost_estimation"]["calls"] == 25
+    assert summary["cost_estimation"]["prompt_tokens"] == 25 * 2000
+    assert summary["cost_estimation"]["cached_ratio"] == 1024 / 2000
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+DEFAULT_CACHE_DIR = ".cache/results"
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 256
+
+
+def make_cache_key(
+    namespace: str,
+    image_hash: str,
+    provider: str,
+    service_tier: str,
+    prompt_version: str,
+    deployment: str,
+) -> str:
+    """
+    Build a content-addressed cache key for a pipeline result.
+
+    Every input that can change the model output is part of the key, so a cached
+    result is only reused when the same diagram is sent with the same settings.
+    """
+    payload = json.dumps(
+        [namespace, image_hash, provider, service_tier, prompt_version, deployment]
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(
+        self,
+        cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ) -> None:
+        """
+        Two-tier cache: an in-memory LRU in front of JSON files on disk.
+
+        Entries older than ttl_seconds are evicted from both tiers. Pass
+        cache_dir=None to keep the cache in memory only.
+        """
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self.evict_expired()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached value for key, or None on a miss or expired entry.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if not self._is_expired(created_at):
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+        entry = self._read_from_disk(key)
+        if entry is None:
+            return None
+        created_at, value = entry
+        with self._lock:
+            self._remember(key, created_at, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a JSON-serialisable value under key in both tiers.
+        """
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, value)
+        self._write_to_disk(key, created_at, value)
+
+    def evict_expired(self) -> int:
+        """
+        Remove expired entries from both tiers and return how many were removed.
+        """
+        removed = 0
+        with self._lock:
+            for key in [k for k, (t, _) in self._memory.items() if self._is_expired(t)]:
+                del self._memory[key]
+                removed += 1
+
+        if self.cache_dir is None:
+            return removed
+        for path in self.cache_dir.glob("*/*.json"):
+            try:
+                created_at = json.loads(path.read_text())["created_at"]
+            except (OSError, ValueError, KeyError):
+                created_at = 0
+            if self._is_expired(created_at):
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def clear(self) -> None:
+        """
+        Drop every entry from both tiers.
+        """
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir is not None:
+            for path in self.cache_dir.glob("*/*.json"):
+                path.unlink(missing_ok=True)
+
+    def _is_expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, key: str, created_at: float, value: Any) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _read_from_disk(self, key: str) -> Optional[tuple[float, Any]]:
+        if self.cache_dir is None:
+            return None
+        path = self._path_for(key)
+        try:
+            entry = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if self._is_expired(entry.get("created_at", 0)):
+            path.unlink(missing_ok=True)
+            return None
+        return entry["created_at"], entry["value"]
+
+    def _write_to_disk(self, key: str, created_at: float, value: Any) -> None:
+        if self.cache_dir is None:
+            return
+        path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"created_at": created_at, "value": value}, f)
+            os.replace(tmp_path, path)
+        except OSError:
+            Path(tmp_path).unlink(missing_ok=True)
+
+
+_result_cache: Optional[ResultCache] = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """
+    Return the process-wide result cache, creating it on first use.
+
+    Imported modules survive Streamlit reruns, so the cache is shared by every
+    session and page served by this process.
+    """
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(
+                cache_dir=os.getenv("RESULT_CACHE_DIR", DEFAULT_CACHE_DIR) or None,
+                ttl_seconds=float(
+                    os.getenv("RESULT_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)
+                ),
+                max_entries=int(
+                    os.getenv("RESULT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+                ),
+            )
+        return _result_cache
@@ -0,0 +1,72 @@
+import importlib
+import logging
+import os
+import threading
+from typing import Optional, Sequence
+
+DEFAULT_ENV_FILE = ".env"
+# what the pipeline needs once a diagram is uploaded; between them they pull
+# in openai, pydantic, pandas, numpy and PIL
+PIPELINE_MODULES = (
+    "resources",
+    "estimator",
+    "analysis",
+    "store",
+    "scenarios",
+    "semantic_cache",
+    "image_processing",
+)
+
+logger = logging.getLogger("config")
+
+_config_loaded = False
+_warm_up_thread: Optional[threading.Thread] = None
+_lock = threading.Lock()
+
+
+def load_config(env_file: Optional[str] = None) -> None:
+    """
+    Load the .env file into the environment, once per process.
+
+    Streamlit re-executes the page script on every interaction, so pages call
+    this on each run and only the first call reads the file. Variables that
+    are already set take precedence, as do container environments without
+    python-dotenv installed.
+    """
+    global _config_loaded
+    with _lock:
+        if _config_loaded:
+            return
+        _config_loaded = True
+        try:
+            from dotenv import load_dotenv
+        except ImportError:
+            return
+        load_dotenv(env_file or os.getenv("ENV_FILE", DEFAULT_ENV_FILE))
+
+
+def warm_up(modules: Sequence[str] = PIPELINE_MODULES) -> threading.Thread:
+    """
+    Import the pipeline modules on a background thread, once per process.
+
+    Pages only import them when a diagram is uploaded, so the first render of
+    a fresh container is not held up by them; warming up while the user picks
+    a file means the upload usually finds them loaded.
+    """
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(
+                target=_import_all, args=(modules,), name="warm-up", daemon=True
+            )
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+
+def _import_all(modules: Sequence[str]) -> None:
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            # the page imports it again on upload and reports the error there
+            logger.warning("Failed to warm up %s: %s", module, e)
@@ -0,0 +1,53 @@
+import os
+
+import streamlit as st
+
+from telemetry import get_tracer
+from token_usage import get_usage_tracker
+
+SPAN_COLUMNS = [
+    "span",
+    "stage",
+    "duration_ms",
+    "ttft_ms",
+    "prompt_tokens",
+    "cached_tokens",
+    "completion_tokens",
+    "cache_hit",
+    "retries",
+    "error",
+]
+
+
+def debug_panel():
+    # Show recent spans and metrics when DEBUG_PANEL is set or the page is
+    # opened with ?debug=1
+    if not (os.getenv("DEBUG_PANEL") or st.query_params.get("debug") == "1"):
+        return
+    import pandas as pd
+
+    tracer = get_tracer()
+    with st.sidebar.expander("Debug", expanded=False):
+        spans = pd.DataFrame(
+            [span.to_dict() for span in tracer.recent_spans()],
+            columns=SPAN_COLUMNS,
+        ).fillna({"stage": ""})
+        if spans.empty:
+            st.caption("No spans recorded yet.")
+        else:
+            st.markdown("**Span durations (ms)**")
+            st.dataframe(
+                spans.groupby(["span", "stage"])["duration_ms"]
+                .describe(percentiles=[0.5, 0.95])[["count", "mean", "50%", "95%"]]
+                .round(1)
+            )
+            st.markdown("**Recent spans**")
+            st.dataframe(spans.tail(50).iloc[::-1], hide_index=True)
+        usage = get_usage_tracker().summary()
+        if usage:
+            st.markdown("**Token usage**")
+            st.dataframe(pd.DataFrame(usage).T)
+        metrics = tracer.metrics.to_prometheus()
+        st.download_button(
+            "Download metrics", metrics, file_name="metrics.prom", mime="text/plain"
+        )
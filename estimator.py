@@ -0,0 +1,277 @@
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from analysis import (
+    ArchitectureAnalyser,
+    PartialCallback,
+    generate_structured_response,
+    services_fingerprint,
+)
+from cache import ResultCache, make_cache_key
+from image_processing import ProcessedImage
+from openai_client import AzureOpenAIClient
+from pricing import PricingCatalogue
+from prompt import (
+    PROMPT_VERSION,
+    CostEstimate,
+    CostEstimationPrompt,
+    CostLineItem,
+    IdentifiedServices,
+)
+from store import EstimateStore, StoredEstimate, reusable_line_items
+from telemetry import span
+
+
+@dataclass
+class CostEstimationResult:
+    cache_key: str
+    identified_services: IdentifiedServices
+    cost_estimate: CostEstimate
+    messages: List[Dict[str, Any]]
+    cached: bool
+    estimate_id: Optional[int] = None
+    # the stored revision this estimate was compared against, if any
+    previous_estimate: Optional[StoredEstimate] = None
+    reused_line_items: int = 0
+
+    @property
+    def identify_service_response(self) -> str:
+        return self.identified_services.to_summary()
+
+    @property
+    def cost_estimation_response(self) -> str:
+        return self.cost_estimate.to_markdown()
+
+
+class CostEstimator:
+    def __init__(
+        self,
+        openai_client: AzureOpenAIClient,
+        result_cache: Optional[ResultCache] = None,
+        pricing_catalogue: Optional[PricingCatalogue] = None,
+        analyser: Optional[ArchitectureAnalyser] = None,
+        estimate_store: Optional[EstimateStore] = None,
+    ) -> None:
+        """
+        Run the identify-services / estimate-cost pipeline for a diagram.
+
+        Services found in the pricing catalogue are priced locally; only the
+        remaining ones are sent to the model for pricing. With an estimate_store
+        every estimate is kept, and a revised diagram only reprices the
+        services that changed. This is shared by the Streamlit page and the
+        batch command line so both use the same prompts and the same caches.
+        """
+        self.openai_client = openai_client
+        self.result_cache = result_cache
+        self.pricing_catalogue = pricing_catalogue
+        self.estimate_store = estimate_store
+        self.analyser = analyser or ArchitectureAnalyser(
+            openai_client=openai_client, result_cache=result_cache
+        )
+
+    def estimate(
+        self,
+        image: ProcessedImage,
+        provider: str,
+        service_tier: str,
+        project: str = "",
+        on_identified_services: Optional[PartialCallback] = None,
+        on_line_items: Optional[PartialCallback] = None,
+    ) -> CostEstimationResult:
+        """
+        Estimate the monthly cost of the architecture in the image.
+
+        project groups revisions of a design in the estimate store; without
+        one the previous revision is found by how similar the diagrams look.
+
+        If on_identified_services or on_line_items are given, that stage is
+        streamed and the callback is called with the partially parsed services
+        or line items (as dicts) each time more of the response arrives.
+        """
+        with span("estimate", provider=provider, service_tier=service_tier):
+            identified_services, identification_cached = self.analyser.identify(
+                image, on_identified_services=on_identified_services
+            )
+            result = self.price(
+                identified_services,
+                image=image,
+                provider=provider,
+                service_tier=service_tier,
+                project=project,
+                on_line_items=on_line_items,
+            )
+            result.cached = result.cached and identification_cached
+            return result
+
+    def price(
+        self,
+        identified_services: IdentifiedServices,
+        image: ProcessedImage,
+        provider: str,
+        service_tier: str,
+        project: str = "",
+        on_line_items: Optional[PartialCallback] = None,
+    ) -> CostEstimationResult:
+        """
+        Price already identified services.
+
+        Services in the pricing catalogue are priced locally and the rest come
+        from the result cache if this diagram was priced before. Otherwise
+        services unchanged since the previous stored revision of the diagram
+        reuse their earlier price, and only what is left goes to the model.
+        The returned messages hold the text-only conversation so the caller can
+        continue the chat from it.
+        """
+        prompt_generator = CostEstimationPrompt()
+
+        with span("cost_estimation") as pricing_span:
+            if self.pricing_catalogue:
+                catalogue_estimate, unpriced_services = self.pricing_catalogue.price(
+                    identified_services, service_tier=service_tier
+                )
+            else:
+                catalogue_estimate = CostEstimate(line_items=[])
+                unpriced_services = identified_services.services
+
+            # keyed on everything the catalogue could not price, not on what
+            # the store happens to hold, so a rerun is always a cache hit
+            services_to_price = IdentifiedServices(services=unpriced_services)
+            catalogue_version = (
+                self.pricing_catalogue.version if self.pricing_catalogue else "none"
+            )
+            cache_key = make_cache_key(
+                namespace="cost_estimation",
+                image_hash=image.content_hash,
+                provider=provider,
+                service_tier=service_tier,
+                prompt_version=f"{PROMPT_VERSION}:{catalogue_version}:"
+                f"{services_fingerprint(services_to_price)}",
+                deployment=self.openai_client.deployment,
+            )
+            cached_result = (
+                self.result_cache.get(cache_key) if self.result_cache else None
+            )
+
+            previous = None
+            reused_line_items = []
+            model_estimate = CostEstimate(line_items=[])
+            if cached_result is not None:
+                model_estimate = CostEstimate.model_validate(
+                    cached_result["model_estimate"]
+                )
+            elif unpriced_services:
+                previous = (
+                    self.estimate_store.previous_revision(
+                        image,
+                        provider=provider,
+                        service_tier=service_tier,
+                        project=project,
+                    )
+                    if self.estimate_store
+                    else None
+                )
+                # an unchanged diagram is not a revision of itself
+                if previous is not None and previous.image_hash != image.content_hash:
+                    reused_line_items, unpriced_services = reusable_line_items(
+                        previous, unpriced_services
+                    )
+                else:
+                    previous = None
+                if unpriced_services:
+                    model_estimate = self.__price_with_model(
+                        prompt_generator,
+                        IdentifiedServices(services=unpriced_services),
+                        priced_items=catalogue_estimate.line_items + reused_line_items,
+                        on_line_items=on_line_items,
+                    )
+            pricing_span.set(
+                cache_hit=cached_result is not None,
+                catalogue_priced=len(catalogue_estimate.line_items),
+                reused=len(reused_line_items),
+                unpriced=len(unpriced_services) if cached_result is None else 0,
+            )
+            # carried over prices are cached with the model's, so a rerun
+            # needs neither the store nor the model
+            model_estimate = CostEstimate(
+                line_items=reused_line_items + model_estimate.line_items
+            )
+            if cached_result is None and self.result_cache:
+                self.result_cache.set(
+                    cache_key, {"model_estimate": model_estimate.model_dump()}
+                )
+
+        cost_estimate = CostEstimate(
+            line_items=catalogue_estimate.line_items + model_estimate.line_items
+        )
+        estimate_id = self.__store(
+            project, image, provider, service_tier, identified_services, cost_estimate
+        )
+        cost_estimation_prompt, _ = prompt_generator.generate_cost_estimation_prompt(
+            previous_response=identified_services.to_summary()
+        )
+        return CostEstimationResult(
+            cache_key=cache_key,
+            identified_services=identified_services,
+            cost_estimate=cost_estimate,
+            messages=cost_estimation_prompt
+            + [{"role": "assistant", "content": cost_estimate.to_markdown()}],
+            cached=cached_result is not None,
+            estimate_id=estimate_id,
+            previous_estimate=previous,
+            reused_line_items=len(reused_line_items),
+        )
+
+    def __price_with_model(
+        self,
+        prompt_generator: CostEstimationPrompt,
+        services: IdentifiedServices,
+        priced_items: List[CostLineItem],
+        on_line_items: Optional[PartialCallback],
+    ) -> CostEstimate:
+        cost_estimation_prompt, cost_estimation_response_format = (
+            prompt_generator.generate_cost_estimation_prompt(
+                previous_response=services.to_summary()
+            )
+        )
+        # show already priced items straight away, then the rest as they stream
+        priced = [item.model_dump() for item in priced_items]
+        return generate_structured_response(
+            self.openai_client,
+            messages=cost_estimation_prompt,
+            response_format=cost_estimation_response_format,
+            stage="cost_estimation",
+            on_partial=(
+                lambda partial: on_line_items(priced + partial.get("line_items", []))
+            )
+            if on_line_items
+            else None,
+        )
+
+    def __store(
+        self,
+        project: str,
+        image: ProcessedImage,
+        provider: str,
+        service_tier: str,
+        identified_services: IdentifiedServices,
+        cost_estimate: CostEstimate,
+    ) -> Optional[int]:
+        if self.estimate_store is None:
+            return None
+        latest = self.estimate_store.latest(project, provider, service_tier)
+        # reruns of the same estimate should not add a new revision each time
+        if (
+            latest is not None
+            and latest.image_hash == image.content_hash
+            and latest.identified_services == identified_services
+            and latest.cost_estimate == cost_estimate
+        ):
+            return latest.id
+        return self.estimate_store.save(
+            project,
+            image,
+            provider=provider,
+            service_tier=service_tier,
+            identified_services=identified_services,
+            cost_estimate=cost_estimate,
+        )
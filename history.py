@@ -0,0 +1,142 @@
+import re
+from typing import Any, Dict, List
+
+APPROX_CHARS_PER_TOKEN = 4
+# rough cost of a high detail image part, used only for budgeting
+IMAGE_PART_TOKENS = 1105
+DEFAULT_TOKEN_BUDGET = 6000
+DEFAULT_SUMMARY_CHARS = 1200
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """
+    Approximate the prompt tokens of a list of chat messages.
+    """
+    tokens = 0
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += len(content) // APPROX_CHARS_PER_TOKEN
+            continue
+        for part in content:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_PART_TOKENS
+            else:
+                tokens += len(part.get("text", "")) // APPROX_CHARS_PER_TOKEN
+    return tokens
+
+
+def message_text(message: Dict[str, Any]) -> str:
+    """
+    Return the text of a message whether its content is a string or a list of parts.
+    """
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return "\n".join(part["text"] for part in content if part.get("type") == "text")
+
+
+def shorten(text: str, max_chars: int) -> str:
+    """
+    Collapse whitespace and truncate text to max_chars.
+    """
+    text = re.sub(r"\s+", " ", text).strip()
+    if len(text) <= max_chars:
+        return text
+    return text[: max_chars - 3].rstrip() + "..."
+
+
+class ConversationHistory:
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        summary_chars: int = DEFAULT_SUMMARY_CHARS,
+        turn_summary_chars: int = 160,
+    ) -> None:
+        """
+        Keep the chat history sent to the model within a fixed token budget.
+
+        Messages that set up the conversation (system prompt, identified services
+        and the estimate) are pinned and always sent. Follow-up turns are sent
+        newest first until the budget is used up; older turns are folded into a
+        short summary of bounded size.
+        """
+        self.token_budget = token_budget
+        self.summary_chars = summary_chars
+        self.turn_summary_chars = turn_summary_chars
+
+    def start(
+        self, messages: List[Dict[str, Any]], services_summary: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Pin the initial messages and replace any image part with a text summary
+        of the identified services, so the diagram is only uploaded once.
+        """
+        return [
+            {
+                "role": message["role"],
+                "content": self.__replace_images(message["content"], services_summary),
+                "pinned": True,
+            }
+            for message in messages
+        ]
+
+    def build(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Return the messages to send for the next completion.
+        """
+        pinned = [m for m in messages if m.get("pinned")]
+        follow_ups = [m for m in messages if not m.get("pinned")]
+
+        # reserve room for the summary of dropped turns
+        remaining = (
+            self.token_budget
+            - estimate_tokens(pinned)
+            - self.summary_chars // APPROX_CHARS_PER_TOKEN
+        )
+        recent: List[Dict[str, Any]] = []
+        for message in reversed(follow_ups):
+            cost = estimate_tokens([message])
+            # always keep the latest message, it is the question being asked
+            if recent and cost > remaining:
+                break
+            recent.insert(0, message)
+            remaining -= cost
+
+        dropped = follow_ups[: len(follow_ups) - len(recent)]
+        request = [{"role": m["role"], "content": m["content"]} for m in pinned]
+        if dropped:
+            request.append({"role": "system", "content": self.__summarise(dropped)})
+        request += [{"role": m["role"], "content": m["content"]} for m in recent]
+        return request
+
+    def __replace_images(self, content: Any, services_summary: str) -> Any:
+        if isinstance(content, str):
+            return content
+        return [
+            {
+                "type": "text",
+                "text": "The architecture diagram was analysed earlier. "
+                f"Identified services:\n{services_summary}",
+            }
+            if part.get("type") == "image_url"
+            else part
+            for part in content
+        ]
+
+    def __summarise(self, messages: List[Dict[str, Any]]) -> str:
+        lines = []
+        for message in messages:
+            speaker = "User" if message["role"] == "user" else "Assistant"
+            lines.append(
+                f"- {speaker}: {shorten(message_text(message), self.turn_summary_chars)}"
+            )
+        # keep the most recent lines when the summary itself grows too long
+        summary: List[str] = []
+        length = 0
+        for line in reversed(lines):
+            length += len(line) + 1
+            if summary and length > self.summary_chars:
+                break
+            summary.insert(0, line)
+        return "Summary of the earlier follow-up discussion:\n" + "\n".join(summary)
@@ -0,0 +1,305 @@
+import base64
+import dataclasses
+import hashlib
+import io
+import math
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from PIL import Image, ImageChops, ImageOps
+
+from telemetry import span
+
+# the vision model fits images into 2048x2048 and then scales the shortest side
+# to 768px, so anything larger is sent over the wire only to be thrown away
+MAX_LONG_SIDE = 2048
+MAX_SHORT_SIDE = 768
+WHITESPACE_THRESHOLD = 16
+CROP_MARGIN = 12
+JPEG_QUALITY = 85
+# below this downscale small labels are no longer legible to the model, so
+# larger diagrams are split into tiles that are identified separately
+MIN_LEGIBLE_SCALE = 0.5
+TILE_SIZE = round(MAX_SHORT_SIDE / MIN_LEGIBLE_SCALE)
+TILE_OVERLAP = 0.15
+MAX_TILES = 16
+PDF_RENDER_DPI = 150
+MAX_PDF_PAGES = 20
+
+
+@dataclass(frozen=True)
+class ProcessedImage:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    original_size: int
+    content_hash: str
+    perceptual_hash: str
+    # sections of a large or multi-page diagram, identified one by one; the
+    # image itself is then an overview of the first page
+    tiles: Tuple["ProcessedImage", ...] = ()
+
+    @property
+    def base64(self) -> str:
+        return base64.b64encode(self.data).decode()
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    max_long_side: int = MAX_LONG_SIDE,
+    max_short_side: int = MAX_SHORT_SIDE,
+) -> ProcessedImage:
+    """
+    Prepare an uploaded diagram for the vision model.
+
+    The image is flattened onto white, cropped to its content, downscaled to the
+    model's effective resolution and re-encoded in whichever supported format is
+    smallest for this image.
+    """
+    with span("preprocess", original_bytes=len(image_bytes)) as preprocess_span:
+        image = crop_whitespace(_open_image(image_bytes))
+        processed = _prepare(image, len(image_bytes), max_long_side, max_short_side)
+        preprocess_span.set(bytes=len(processed.data), mime_type=processed.mime_type)
+        return processed
+
+
+def preprocess_diagram(file_bytes: bytes) -> ProcessedImage:
+    """
+    Prepare an uploaded diagram, which may be a multi-page PDF or an image too
+    large to read in one piece.
+
+    PDFs are rasterised page by page, and pages that would be downscaled past
+    legibility are split into overlapping tiles. A diagram that fits in one
+    image is processed exactly like preprocess_image().
+    """
+    with span("ingest", original_bytes=len(file_bytes)) as ingest_span:
+        if is_pdf(file_bytes):
+            pages = rasterise_pdf(file_bytes)
+        else:
+            pages = [_open_image(file_bytes)]
+        pages = [crop_whitespace(page) for page in pages]
+        tiles = [tile for page in pages for tile in split_into_tiles(page)]
+        ingest_span.set(pages=len(pages), tiles=len(tiles))
+        if len(tiles) == 1:
+            return _prepare(tiles[0], len(file_bytes))
+
+        processed_tiles = tuple(_prepare(tile, len(file_bytes)) for tile in tiles)
+        overview = _prepare(pages[0], len(file_bytes))
+        return dataclasses.replace(
+            overview,
+            content_hash=hashlib.sha256(
+                "".join(tile.content_hash for tile in processed_tiles).encode()
+            ).hexdigest(),
+            tiles=processed_tiles,
+        )
+
+
+def is_pdf(file_bytes: bytes) -> bool:
+    return file_bytes[:5] == b"%PDF-"
+
+
+def rasterise_pdf(
+    pdf_bytes: bytes, dpi: int = PDF_RENDER_DPI, max_pages: int = MAX_PDF_PAGES
+) -> List[Image.Image]:
+    """
+    Render the first max_pages pages of a PDF to RGB images.
+    """
+    try:
+        import pypdfium2 as pdfium
+    except ImportError as e:
+        raise RuntimeError(
+            "Failed to read PDF: install pypdfium2 to upload PDF diagrams"
+        ) from e
+    with span("rasterise", dpi=dpi):
+        try:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+        except pdfium.PdfiumError as e:
+            raise RuntimeError(f"Failed to read PDF: {e}")
+        try:
+            return [
+                _flatten(pdf[i].render(scale=dpi / 72).to_pil())
+                for i in range(min(len(pdf), max_pages))
+            ]
+        finally:
+            pdf.close()
+
+
+def split_into_tiles(
+    image: Image.Image,
+    tile_size: int = TILE_SIZE,
+    overlap: float = TILE_OVERLAP,
+    max_tiles: int = MAX_TILES,
+) -> List[Image.Image]:
+    """
+    Split an image the model would shrink past legibility into overlapping
+    tiles, row by row. Smaller images are returned whole.
+
+    The overlap keeps services on a tile boundary whole in at least one tile.
+    Diagrams that would need more than max_tiles get proportionally larger
+    tiles instead.
+    """
+    long_side, short_side = max(image.size), min(image.size)
+    scale = min(1.0, MAX_LONG_SIDE / long_side, MAX_SHORT_SIDE / short_side)
+    if scale >= MIN_LEGIBLE_SCALE:
+        return [image]
+    while True:
+        columns = _tile_offsets(image.width, tile_size, overlap)
+        rows = _tile_offsets(image.height, tile_size, overlap)
+        if len(columns) * len(rows) <= max_tiles:
+            break
+        tile_size = math.ceil(tile_size * 1.25)
+    return [
+        image.crop(
+            (x, y, min(x + tile_size, image.width), min(y + tile_size, image.height))
+        )
+        for y in rows
+        for x in columns
+    ]
+
+
+def _prepare(
+    image: Image.Image,
+    original_size: int,
+    max_long_side: int = MAX_LONG_SIDE,
+    max_short_side: int = MAX_SHORT_SIDE,
+) -> ProcessedImage:
+    image = resize_to_fit(image, max_long_side, max_short_side)
+    with span("encode"):
+        data, mime_type = encode_smallest(image)
+    return ProcessedImage(
+        data=data,
+        mime_type=mime_type,
+        width=image.width,
+        height=image.height,
+        original_size=original_size,
+        # hash the pixels rather than the file so re-exports of the same
+        # diagram with different metadata or container format share a key
+        content_hash=hashlib.sha256(
+            f"{image.width}x{image.height}".encode() + image.tobytes()
+        ).hexdigest(),
+        perceptual_hash=perceptual_hash(image),
+    )
+
+
+def crop_whitespace(
+    image: Image.Image,
+    threshold: int = WHITESPACE_THRESHOLD,
+    margin: int = CROP_MARGIN,
+) -> Image.Image:
+    """
+    Crop the near-white border around the diagram, keeping a small margin.
+    """
+    background = Image.new("RGB", image.size, (255, 255, 255))
+    diff = ImageChops.difference(image, background).convert("L")
+    mask = diff.point(lambda p: 255 if p > threshold else 0)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop(
+        (
+            max(left - margin, 0),
+            max(top - margin, 0),
+            min(right + margin, image.width),
+            min(bottom + margin, image.height),
+        )
+    )
+
+
+def resize_to_fit(
+    image: Image.Image,
+    max_long_side: int = MAX_LONG_SIDE,
+    max_short_side: int = MAX_SHORT_SIDE,
+) -> Image.Image:
+    """
+    Downscale the image so it is no larger than the model will use.
+    """
+    long_side, short_side = max(image.size), min(image.size)
+    scale = min(1.0, max_long_side / long_side, max_short_side / short_side)
+    if scale == 1.0:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+def encode_smallest(image: Image.Image) -> Tuple[bytes, str]:
+    """
+    Encode the image as PNG and JPEG and return the smaller one with its MIME type.
+
+    Diagrams with few colours are also tried as a lossless palette PNG, which
+    usually wins for flat-coloured exports.
+    """
+    candidates: List[Tuple[bytes, str]] = []
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    candidates.append((buffer.getvalue(), "image/png"))
+
+    if image.getcolors(maxcolors=256) is not None:
+        buffer = io.BytesIO()
+        image.quantize(colors=256, method=Image.Quantize.MEDIANCUT).save(
+            buffer, format="PNG", optimize=True
+        )
+        candidates.append((buffer.getvalue(), "image/png"))
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    candidates.append((buffer.getvalue(), "image/jpeg"))
+
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+def perceptual_hash(image: Image.Image, hash_size: int = 8) -> str:
+    """
+    Return a difference hash (dHash) of the image as a hex string.
+
+    Visually similar images produce hashes with a small Hamming distance.
+    """
+    grey = image.convert("L").resize(
+        (hash_size + 1, hash_size), Image.Resampling.LANCZOS
+    )
+    pixels = list(grey.getdata())
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            bits = (bits << 1) | int(left > right)
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(hash_a: str, hash_b: str) -> int:
+    """
+    Return the number of differing bits between two perceptual hashes.
+    """
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+
+def _open_image(image_bytes: bytes) -> Image.Image:
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        return _flatten(ImageOps.exif_transpose(original))
+
+
+def _tile_offsets(length: int, tile_size: int, overlap: float) -> List[int]:
+    if length <= tile_size:
+        return [0]
+    step = tile_size * (1 - overlap)
+    count = math.ceil((length - tile_size) / step) + 1
+    # spread the tiles evenly so the last one ends on the edge
+    return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    if image.mode in ("RGBA", "LA") or (
+        image.mode == "P" and "transparency" in image.info
+    ):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
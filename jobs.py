@@ -0,0 +1,185 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from telemetry import span
+
+DEFAULT_WORKERS = 4
+# finished jobs are kept this long so reruns and other sessions can pick up
+# the result instead of submitting the same work again
+DEFAULT_RESULT_TTL_SECONDS = 10 * 60
+DEFAULT_MAX_FINISHED = 256
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+logger = logging.getLogger("jobs")
+
+
+@dataclass
+class Job:
+    id: str
+    key: str
+    status: str = QUEUED
+    # latest progress reported by the work, for pages to render while polling
+    stage: str = ""
+    progress: Dict[str, Any] = field(default_factory=dict)
+    result: Any = None
+    error: Optional[str] = None
+    # how many submissions were attached to this job
+    submissions: int = 1
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED)
+
+    def report(self, stage: Optional[str] = None, **progress: Any) -> None:
+        """
+        Record progress from the worker thread.
+
+        Values are replaced rather than mutated, so pages can read them
+        without locking.
+        """
+        if stage is not None:
+            self.stage = stage
+        if progress:
+            self.progress = self.progress | progress
+
+    def elapsed(self) -> float:
+        return (self.finished_at or time.time()) - self.created_at
+
+
+class JobQueue:
+    def __init__(
+        self,
+        max_workers: int = DEFAULT_WORKERS,
+        result_ttl_seconds: float = DEFAULT_RESULT_TTL_SECONDS,
+        max_finished: int = DEFAULT_MAX_FINISHED,
+    ) -> None:
+        """
+        Run long pipeline calls on a thread pool, off the Streamlit script
+        thread, keyed by what they compute.
+
+        Submitting work for a key that already has a job returns that job
+        instead, so reruns and concurrent sessions share one run. That
+        includes failed jobs, so a page rerunning after a failure shows the
+        error rather than calling the model again; discard() the job to retry.
+        """
+        self.result_ttl_seconds = result_ttl_seconds
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job"
+        )
+        self._jobs: Dict[str, Job] = {}
+        self._jobs_by_key: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, work: Callable[[Job], Any]) -> Job:
+        """
+        Return the job computing key, starting work(job) if there is none.
+        """
+        with self._lock:
+            self.__evict_finished()
+            job = self._jobs_by_key.get(key)
+            if job is not None:
+                job.submissions += 1
+                return job
+            job = Job(id=uuid.uuid4().hex, key=key)
+            self._jobs[job.id] = job
+            self._jobs_by_key[key] = job
+        self._executor.submit(self.__run, job, work)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def find(self, key: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs_by_key.get(key)
+
+    def discard(self, job_id: str) -> None:
+        """
+        Forget a finished job, so the next submit for its key runs the work
+        again, e.g. when the user retries a failed estimate.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.done:
+                return
+            del self._jobs[job.id]
+            if self._jobs_by_key.get(job.key) is job:
+                del self._jobs_by_key[job.key]
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def __run(self, job: Job, work: Callable[[Job], Any]) -> None:
+        job.started_at = time.time()
+        job.status = RUNNING
+        with span(
+            "job",
+            queued_ms=round((job.started_at - job.created_at) * 1000, 2),
+        ) as job_span:
+            result, error, status = None, None, SUCCEEDED
+            try:
+                result = work(job)
+            except Exception as e:
+                logger.exception("Job %s failed", job.id)
+                error, status = str(e), FAILED
+            # finished_at is set before the status, so a job that looks done
+            # always has it for eviction
+            with self._lock:
+                job.result, job.error = result, error
+                job.finished_at = time.time()
+                job.status = status
+            job_span.set(status=job.status, submissions=job.submissions)
+            job_span.error = job.error
+
+    def __evict_finished(self) -> None:
+        finished = sorted(
+            (
+                job
+                for job in self._jobs.values()
+                if job.done and job.finished_at is not None
+            ),
+            key=lambda job: job.finished_at,
+        )
+        expired_before = time.time() - self.result_ttl_seconds
+        excess = len(finished) - self.max_finished
+        for i, job in enumerate(finished):
+            if i >= excess and job.finished_at >= expired_before:
+                continue
+            del self._jobs[job.id]
+            if self._jobs_by_key.get(job.key) is job:
+                del self._jobs_by_key[job.key]
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    Return the process-wide job queue, shared by every session and page.
+    """
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(
+                max_workers=int(os.getenv("JOB_WORKERS", DEFAULT_WORKERS)),
+                result_ttl_seconds=float(
+                    os.getenv("JOB_RESULT_TTL_SECONDS", DEFAULT_RESULT_TTL_SECONDS)
+                ),
+            )
+        return _job_queue
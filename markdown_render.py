@@ -0,0 +1,43 @@
+from typing import Any, Dict, Iterable
+
+import streamlit as st
+
+from markdown_stream import MarkdownStreamParser, TableRow, stream_text
+
+
+def write_stream_with_tables(stream: Iterable[Any], currency: str = "GBP") -> str:
+    # Write a streamed markdown response, rendering each table in it as a
+    # dataframe that grows as rows complete. Finished paragraphs are written
+    # once, so each chunk only re-renders the paragraph it belongs to.
+    import pandas as pd
+
+    parser = MarkdownStreamParser()
+    tables: Dict[int, Any] = {}
+    paragraph = st.empty()
+
+    def render(events):
+        nonlocal paragraph
+        for event in events:
+            if not isinstance(event, TableRow):
+                paragraph.markdown(event.text)
+                paragraph = st.empty()
+                continue
+            row = pd.DataFrame([event.values])
+            if event.table in tables:
+                tables[event.table].add_rows(row)
+            else:
+                tables[event.table] = st.dataframe(
+                    row, hide_index=True, use_container_width=True
+                )
+                paragraph = st.empty()
+
+    for chunk in stream_text(stream):
+        render(parser.feed(chunk))
+        if parser.pending_text:
+            paragraph.markdown(parser.pending_text)
+    render(parser.close())
+    if parser.total is not None:
+        from prompt import format_price
+
+        st.metric("Total estimated monthly cost", format_price(parser.total, currency))
+    return parser.text
@@ -0,0 +1,146 @@
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+SEPARATOR_CELL = re.compile(r"^:?-{3,}:?$")
+NUMBER_CELL = re.compile(r"^[£$€]?\s*(-?[\d,]*\.?\d+)$")
+TOTAL_LINE = re.compile(
+    r"total estimated monthly cost is\W*[£$€]?\s*(-?[\d,]*\.?\d+)", re.IGNORECASE
+)
+
+
+@dataclass
+class TextBlock:
+    text: str
+
+
+@dataclass
+class TableRow:
+    # index of the table in the response, starting at 0
+    table: int
+    values: Dict[str, Any]
+
+
+StreamEvent = Union[TextBlock, TableRow]
+
+
+def parse_cell(cell: str) -> Any:
+    """
+    Return a table cell as a float if it holds a number or an amount of money,
+    e.g. "£1,234.50" -> 1234.5, otherwise as plain text.
+    """
+    text = cell.replace("**", "").replace("`", "").replace("<br>", "\n").strip()
+    match = NUMBER_CELL.match(text)
+    return float(match.group(1).replace(",", "")) if match else text
+
+
+def stream_text(stream: Iterable[Any]) -> Iterator[str]:
+    """
+    Yield the text of a stream of strings or chat completion chunks.
+    """
+    for chunk in stream:
+        if isinstance(chunk, str):
+            yield chunk
+            continue
+        # the usage chunk at the end of a stream has no choices
+        text = "".join(choice.delta.content or "" for choice in chunk.choices)
+        if text:
+            yield text
+
+
+class MarkdownStreamParser:
+    def __init__(self) -> None:
+        """
+        Parse a streamed markdown response as it arrives.
+
+        Each chunk is fed once, and only completed lines are parsed. Completed
+        paragraphs come out as TextBlocks and completed table rows as
+        TableRows with typed values, so a page can render each once instead of
+        re-rendering the whole response on every chunk.
+        """
+        self.tables = 0
+        self.rows: List[TableRow] = []
+        # the "Total estimated monthly cost is ..." figure, if the text has one
+        self.total: Optional[float] = None
+        self._chunks: List[str] = []
+        self._line = ""
+        self._block: List[str] = []
+        self._columns: Optional[List[str]] = None
+        self._expect_separator = False
+        self._in_code = False
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    @property
+    def pending_text(self) -> str:
+        """
+        The paragraph still being written, without any half-written table row.
+        """
+        lines = list(self._block)
+        if self._line and not self._line.lstrip().startswith("|"):
+            lines.append(self._line)
+        return "\n".join(lines)
+
+    def feed(self, chunk: str) -> List[StreamEvent]:
+        """
+        Consume the next chunk and return the blocks and rows it completed.
+        """
+        self._chunks.append(chunk)
+        *lines, self._line = (self._line + chunk).split("\n")
+        events: List[StreamEvent] = []
+        for line in lines:
+            events.extend(self.__parse_line(line))
+        return events
+
+    def close(self) -> List[StreamEvent]:
+        """
+        Finish the response and return whatever it left incomplete.
+        """
+        events = self.__parse_line(self._line) if self._line else []
+        self._line = ""
+        return events + self.__flush_block()
+
+    def __parse_line(self, line: str) -> List[StreamEvent]:
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            self._in_code = not self._in_code
+        total = TOTAL_LINE.search(line)
+        if total:
+            self.total = float(total.group(1).replace(",", ""))
+
+        if stripped.startswith("|") and not self._in_code:
+            cells = [cell.strip() for cell in stripped.strip("|").split("|")]
+            if self._columns is None:
+                # a table header ends the paragraph before it
+                events = self.__flush_block()
+                self._columns = [
+                    cell.replace("**", "") or f"column {i}"
+                    for i, cell in enumerate(cells)
+                ]
+                self._expect_separator = True
+                self.tables += 1
+                return events
+            if self._expect_separator and all(SEPARATOR_CELL.match(c) for c in cells):
+                self._expect_separator = False
+                return []
+            row = TableRow(
+                table=self.tables - 1,
+                values=dict(zip(self._columns, map(parse_cell, cells))),
+            )
+            self.rows.append(row)
+            return [row]
+
+        self._columns = None
+        if not stripped and not self._in_code:
+            return self.__flush_block()
+        self._block.append(line)
+        return []
+
+    def __flush_block(self) -> List[StreamEvent]:
+        if not self._block:
+            return []
+        block = TextBlock(text="\n".join(self._block))
+        self._block = []
+        return [block]
@@ -1,11 +1,67 @@
-from typing import Any, Dict, List
+import asyncio
+import threading
+from typing import (
+    Any,
+    AsyncIterator,
+    Coroutine,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
-from openai import AzureOpenAI, Stream
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    AsyncAzureOpenAI,
+    AsyncStream,
+    AzureOpenAI,
+    DefaultAsyncHttpxClient,
+    RateLimitError,
+    Stream,
+)
+from openai.types.chat import ChatCompletionChunk
+from pydantic import BaseModel
+
+from history import estimate_tokens
+from rate_limit import RateLimiter, backoff_delay, parse_retry_after
+from telemetry import Span, get_tracer
+from token_usage import get_usage_tracker
+
+T = TypeVar("T")
+M = TypeVar("M", bound=BaseModel)
+
+# Azure only reports usage on streamed responses from this API version on
+STREAM_USAGE_API_VERSION = "2024-09-01-preview"
+
+
+def supports_stream_usage(api_version: Optional[str]) -> bool:
+    """
+    Return True if streamed responses can include a final usage chunk.
+    """
+    return bool(api_version) and api_version >= STREAM_USAGE_API_VERSION
+
+
+def is_structured_output(response_format: Any) -> bool:
+    """
+    Return True if response_format is a pydantic model to parse the reply into.
+    """
+    return isinstance(response_format, type) and issubclass(response_format, BaseModel)
 
 
 class AzureOpenAIClient:
     def __init__(
-        self, api_key: str, api_version: str, azure_endpoint: str, deployment: str
+        self,
+        api_key: str,
+        api_version: str,
+        azure_endpoint: str,
+        deployment: str,
+        http_client: Optional[httpx.Client] = None,
     ) -> None:
         """
         Initialize the AzureOpenAIClient with the given parameters.
@@ -14,6 +70,7 @@ class AzureOpenAIClient:
         self.api_version = api_version
         self.azure_endpoint = azure_endpoint
         self.deployment = deployment
+        self.http_client = http_client
         self.client = self._create_azure_openai_client()
 
     def _create_azure_openai_client(self) -> AzureOpenAI:
@@ -25,28 +82,399 @@ class AzureOpenAIClient:
                 api_key=self.api_key,
                 api_version=self.api_version,
                 azure_endpoint=self.azure_endpoint,
+                http_client=self.http_client,
             )
             return client
         except Exception as e:
             raise RuntimeError(f"Failed to create AzureOpenAI client: {e}")
 
-    def generate_response(
-        self, messages: List[Dict[str, Any]], response_format=None, *args, **kwargs
-    ) -> str:
+    def stream_structured_response(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Type[M],
+        stage: str = "chat",
+        **kwargs,
+    ) -> Iterator[Union[Dict[str, Any], M]]:
         """
-        Generate a response from the Azure OpenAI model based on the given prompt.
+        Stream a structured output response. Yields the partially parsed JSON as
+        a dict each time more content arrives, then the parsed model last.
         """
+        if supports_stream_usage(self.api_version):
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        request_span = self.__start_request_span(stage, stream=True)
+        error = None
         try:
-            response = self.client.chat.completions.create(
+            with self.client.beta.chat.completions.stream(
                 model=self.deployment,
                 messages=messages,
                 response_format=response_format,
                 **kwargs,
-            )
-            if isinstance(response, Stream):
-                response_content = response
+            ) as stream:
+                for event in stream:
+                    if event.type == "content.delta" and event.parsed is not None:
+                        request_span.mark_first_token()
+                        yield event.parsed
+                completion = stream.get_final_completion()
+                _record_usage(request_span, completion.usage)
+                yield _parsed_content(completion)
+        except Exception as e:
+            error = str(e)
+            raise RuntimeError(f"Failed to generate response: {e}")
+        finally:
+            get_tracer().finish(request_span, error=error)
+
+    def refresh_credentials(self, api_key: str) -> None:
+        """
+        Swap in a new API key, keeping the existing connection pool.
+        """
+        self.api_key = api_key
+        self.client = self._create_azure_openai_client()
+
+    def health_check(self, timeout: float = 5.0) -> bool:
+        """
+        Return True if the endpoint answers an authenticated request.
+        """
+        try:
+            self.client.with_options(timeout=timeout, max_retries=0).models.list()
+            return True
+        except Exception:
+            return False
+
+    def generate_response(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format=None,
+        *args,
+        stage: str = "chat",
+        **kwargs,
+    ) -> str:
+        """
+        Generate a response from the Azure OpenAI model based on the given prompt.
+        If response_format is a pydantic model the parsed model is returned.
+
+        The call is traced under stage. A streamed response is returned as an
+        iterator of chunks whose span ends once it has been read.
+        """
+        request_span = self.__start_request_span(stage, stream=kwargs.get("stream"))
+        try:
+            if is_structured_output(response_format):
+                # structured outputs are parsed into the pydantic model
+                response = self.client.beta.chat.completions.parse(
+                    model=self.deployment,
+                    messages=messages,
+                    response_format=response_format,
+                    **kwargs,
+                )
+                _record_usage(request_span, response.usage)
+                response_content = _parsed_content(response)
             else:
+                if kwargs.get("stream") and supports_stream_usage(self.api_version):
+                    kwargs.setdefault("stream_options", {"include_usage": True})
+                response = self.client.chat.completions.create(
+                    model=self.deployment,
+                    messages=messages,
+                    response_format=response_format,
+                    **kwargs,
+                )
+                if isinstance(response, Stream):
+                    return self.__trace_stream(request_span, response)
+                _record_usage(request_span, response.usage)
                 response_content = response.choices[0].message.content
+            get_tracer().finish(request_span)
             return response_content
         except Exception as e:
+            get_tracer().finish(request_span, error=str(e))
             raise RuntimeError(f"Failed to generate response: {e}")
+
+    def __start_request_span(self, stage: str, stream: Any) -> Span:
+        return get_tracer().start_span(
+            "request", stage=stage, deployment=self.deployment, stream=bool(stream)
+        )
+
+    def __trace_stream(
+        self, request_span: Span, stream: Stream
+    ) -> Iterator[ChatCompletionChunk]:
+        # the usage arrives on the last chunk, which has no choices
+        error = None
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    request_span.mark_first_token()
+                if chunk.usage is not None:
+                    _record_usage(request_span, chunk.usage)
+                yield chunk
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            get_tracer().finish(request_span, error=error)
+
+
+DEFAULT_COMPLETION_TOKENS = 1000
+MAX_CONNECTIONS = 100
+
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_rate_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_shared_lock = threading.Lock()
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """
+    Return the process-wide event loop, started on a daemon thread on first use.
+
+    Streamlit runs every script on its own thread with no event loop, so async
+    clients are driven from this single loop to share one connection pool and
+    one rate limiter across all sessions.
+    """
+    global _background_loop
+    with _shared_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="openai-event-loop", daemon=True
+            ).start()
+            _background_loop = loop
+        return _background_loop
+
+
+def run_in_background_loop(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on the process-wide event loop and block until it finishes.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_background_loop()).result()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Return the pooled HTTP client shared by every AsyncAzureOpenAIClient.
+
+    httpx ties pooled connections to the event loop that opened them, so all
+    async clients in the process should run on the same loop, typically the
+    one from get_background_loop().
+    """
+    global _async_http_client
+    with _shared_lock:
+        if _async_http_client is None:
+            _async_http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_CONNECTIONS,
+                )
+            )
+        return _async_http_client
+
+
+def get_rate_limiter(
+    azure_endpoint: str,
+    deployment: str,
+    tokens_per_minute: int,
+    requests_per_minute: Optional[int] = None,
+) -> RateLimiter:
+    """
+    Return the rate limiter for a deployment, shared by every client using it.
+    """
+    with _shared_lock:
+        key = (azure_endpoint, deployment)
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(
+                tokens_per_minute=tokens_per_minute,
+                requests_per_minute=requests_per_minute,
+            )
+        return _rate_limiters[key]
+
+
+class AsyncAzureOpenAIClient:
+    def __init__(
+        self,
+        api_key: str,
+        api_version: str,
+        azure_endpoint: str,
+        deployment: str,
+        tokens_per_minute: Optional[int] = None,
+        requests_per_minute: Optional[int] = None,
+        max_attempts: int = 6,
+        http_client: Optional[httpx.AsyncClient] = None,
+    ) -> None:
+        """
+        Initialize the async client. Without a tokens_per_minute quota requests
+        are not rate limited locally but are still retried on 429s.
+        """
+        self.api_key = api_key
+        self.api_version = api_version
+        self.azure_endpoint = azure_endpoint
+        self.deployment = deployment
+        self.max_attempts = max_attempts
+        self.http_client = http_client
+        self.rate_limiter = (
+            get_rate_limiter(
+                azure_endpoint=azure_endpoint,
+                deployment=deployment,
+                tokens_per_minute=tokens_per_minute,
+                requests_per_minute=requests_per_minute,
+            )
+            if tokens_per_minute
+            else None
+        )
+        self.client = self._create_azure_openai_client()
+
+    def _create_azure_openai_client(self) -> AsyncAzureOpenAI:
+        """
+        Create and return an AsyncAzureOpenAI client, on the shared connection
+        pool unless an http_client was given.
+        """
+        try:
+            client = AsyncAzureOpenAI(
+                api_key=self.api_key,
+                api_version=self.api_version,
+                azure_endpoint=self.azure_endpoint,
+                http_client=self.http_client or get_async_http_client(),
+                # retries are handled here so they go through the rate limiter
+                max_retries=0,
+            )
+            return client
+        except Exception as e:
+            raise RuntimeError(f"Failed to create AsyncAzureOpenAI client: {e}")
+
+    async def generate_response(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format=None,
+        *args,
+        stage: str = "chat",
+        **kwargs,
+    ) -> str:
+        """
+        Generate a response from the Azure OpenAI model based on the given prompt,
+        retrying rate limits, timeouts and server errors with backoff.
+        """
+        if kwargs.get("stream") and supports_stream_usage(self.api_version):
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        estimated_tokens = estimate_tokens(messages) + kwargs.get(
+            "max_tokens", DEFAULT_COMPLETION_TOKENS
+        )
+        request_span = get_tracer().start_span(
+            "request",
+            stage=stage,
+            deployment=self.deployment,
+            stream=bool(kwargs.get("stream")),
+        )
+        try:
+            return await self.__generate_response(
+                request_span, messages, response_format, estimated_tokens, **kwargs
+            )
+        except asyncio.CancelledError:
+            # e.g. the slower of two hedged requests
+            get_tracer().finish(request_span, error="cancelled")
+            raise
+        except Exception as e:
+            get_tracer().finish(request_span, error=str(e))
+            raise
+
+    async def __generate_response(
+        self,
+        request_span: Span,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        estimated_tokens: int,
+        **kwargs,
+    ) -> Any:
+        for attempt in range(1, self.max_attempts + 1):
+            request_span.set(retries=attempt - 1)
+            if self.rate_limiter:
+                await self.rate_limiter.acquire(estimated_tokens)
+            try:
+                if is_structured_output(response_format):
+                    response = await self.client.beta.chat.completions.parse(
+                        model=self.deployment,
+                        messages=messages,
+                        response_format=response_format,
+                        **kwargs,
+                    )
+                    _record_usage(request_span, response.usage)
+                    parsed = _parsed_content(response)
+                    get_tracer().finish(request_span)
+                    return parsed
+                response = await self.client.chat.completions.create(
+                    model=self.deployment,
+                    messages=messages,
+                    response_format=response_format,
+                    **kwargs,
+                )
+                if isinstance(response, AsyncStream):
+                    return self.__trace_stream(request_span, response)
+                _record_usage(request_span, response.usage)
+                get_tracer().finish(request_span)
+                return response.choices[0].message.content
+            except (APIConnectionError, APIStatusError) as e:
+                if not _is_retryable(e) or attempt == self.max_attempts:
+                    raise RuntimeError(f"Failed to generate response: {e}")
+                retry_after = (
+                    parse_retry_after(e.response.headers)
+                    if isinstance(e, APIStatusError)
+                    else None
+                )
+                delay = backoff_delay(attempt, retry_after=retry_after)
+                if isinstance(e, RateLimitError) and self.rate_limiter:
+                    # hold back every request to this deployment, not just this one
+                    self.rate_limiter.pause(delay)
+                await asyncio.sleep(delay)
+            except Exception as e:
+                raise RuntimeError(f"Failed to generate response: {e}")
+
+    async def __trace_stream(
+        self, request_span: Span, stream: AsyncStream
+    ) -> AsyncIterator[ChatCompletionChunk]:
+        error = None
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    request_span.mark_first_token()
+                if chunk.usage is not None:
+                    _record_usage(request_span, chunk.usage)
+                yield chunk
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            get_tracer().finish(request_span, error=error)
+
+
+def _record_usage(request_span: Span, usage: Any) -> None:
+    record = get_usage_tracker().record(
+        stage=request_span.attributes["stage"],
+        deployment=request_span.attributes["deployment"],
+        usage=usage,
+    )
+    if record is not None:
+        request_span.set(
+            prompt_tokens=record.prompt_tokens,
+            cached_tokens=record.cached_tokens,
+            completion_tokens=record.completion_tokens,
+        )
+
+
+def _parsed_content(response: Any) -> BaseModel:
+    message = response.choices[0].message
+    if message.parsed is None:
+        raise RuntimeError(f"Model did not return structured output: {message.refusal}")
+    return message.parsed
+
+
+def is_transient_error(error: BaseException) -> bool:
+    """
+    Return True if error was caused by a connection failure or a retryable
+    API status (timeouts, conflicts, rate limits and server errors), so the
+    same request may succeed later.
+    """
+    while error is not None:
+        if isinstance(error, (APIConnectionError, APIStatusError)):
+            return _is_retryable(error)
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, APIConnectionError):
+        return True
+    return error.status_code in (408, 409, 429) or error.status_code >= 500
@@ -1,29 +1,60 @@
-import base64
 import os
-from typing import Any, Dict, List
+from functools import cached_property
+from typing import TYPE_CHECKING
 
 import streamlit as st
-from PIL import Image
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
+from config import load_config, warm_up
+from debug_panel import debug_panel
+from history import DEFAULT_TOKEN_BUDGET, ConversationHistory
+from markdown_render import write_stream_with_tables
 from menu import menu
-from openai_client import AzureOpenAIClient
-from prompt import CloudOptimisationPrompt
+
+# the pipeline modules pull in openai, pandas and PIL, so they are only
+# imported once a diagram is uploaded (or by the background warm-up)
+if TYPE_CHECKING:
+    from analysis import ArchitectureAnalyser
+    from image_processing import ProcessedImage
+    from openai_client import AzureOpenAIClient
+
+
+# reruns hand back the same upload, so only preprocess each file once
+@st.cache_data(max_entries=16, show_spinner=False)
+def _cached_preprocess_diagram(file_bytes: bytes) -> "ProcessedImage":
+    from image_processing import preprocess_diagram
+
+    return preprocess_diagram(file_bytes)
 
 
 class OptimiserApp:
     def __init__(self):
-        self.openai_client = AzureOpenAIClient(
-            api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-            azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
-            deployment=os.getenv("AZURE_OPENAI_API_DEPLOYMENT"),
+        load_config()
+        self.history = ConversationHistory(
+            token_budget=int(os.getenv("CHAT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+        )
+
+    # shared by every session, so reruns do not open new connections
+    @cached_property
+    def openai_client(self) -> "AzureOpenAIClient":
+        from resources import get_openai_client
+
+        return get_openai_client()
+
+    @cached_property
+    def analyser(self) -> "ArchitectureAnalyser":
+        from analysis import ArchitectureAnalyser
+        from cache import get_result_cache
+
+        return ArchitectureAnalyser(
+            openai_client=self.openai_client, result_cache=get_result_cache()
         )
 
     def run(self):
         st.set_page_config(page_title="Cloud Architecture Optimiser")
         st.title("Cloud Architecture Optimiser")
         menu()
+        debug_panel()
         self.__show_sidebar()
 
         # initialise chat history
@@ -33,6 +64,9 @@ class OptimiserApp:
         uploaded_file_status = self.__upload_arch_diagram()
         if uploaded_file_status:
             self.__show_chat()
+        else:
+            # load the pipeline while the user picks a diagram
+            warm_up()
 
     def __show_sidebar(self):
         st.sidebar.header("Configure your architecture")
@@ -47,7 +81,7 @@ class OptimiserApp:
         # st.sidebar.header("Upload your architecture")
         uploaded_file = st.file_uploader(
             "Upload your architecture diagram and I will give optimisation recommendations.",
-            type=["png", "jpg"],
+            type=["png", "jpg", "pdf"],
         )
         uploaded_file_status = uploaded_file is not None
         if uploaded_file_status:
@@ -69,56 +103,79 @@ class OptimiserApp:
             # Display assistant response in chat message container
             with st.chat_message("assistant"):
                 stream = self.openai_client.generate_response(
-                    messages=[
-                        {"role": m["role"], "content": m["content"]}
-                        for m in st.session_state.messages
-                    ],
+                    messages=self.history.build(st.session_state.messages),
                     stream=True,
                 )
-                response = st.write_stream(stream)
+                response = write_stream_with_tables(stream)
             st.session_state.messages.append({"role": "assistant", "content": response})
 
     def __display_image(self, uploaded_file: UploadedFile):
-        display_image = Image.open(uploaded_file)
+        from PIL import Image
+
+        from image_processing import is_pdf
+
+        if is_pdf(uploaded_file.getvalue()):
+            # show the first page as the model sees it
+            display_image = self.__preprocess_image(image=uploaded_file).data
+        else:
+            display_image = Image.open(uploaded_file)
         st.image(display_image, use_container_width=True)
 
     def __identify_services(self, image: UploadedFile):
-        base64_img = self.__convert_uploaded_img_to_base64(image=image)
+        from analysis import format_partial_services
 
-        prompt_generator = CloudOptimisationPrompt(base64_image=base64_img)
-        identify_service_prompt = prompt_generator.generate_identify_service_prompt()
-        identify_service_response = self.__generate_response(
-            messages=identify_service_prompt
-        )
-        optimisation_prompt = prompt_generator.synthesise_optimisation_prompt(
-            previous_response=identify_service_response
-        )
-        optimisation_response = self.__generate_response(messages=optimisation_prompt)
+        processed_image = self.__preprocess_image(image=image)
+        if processed_image.tiles:
+            st.caption(
+                f"Large diagram, read as {len(processed_image.tiles)} overlapping "
+                "sections and merged."
+            )
 
-        st.session_state.messages = st.session_state.messages + optimisation_prompt
-        st.session_state.messages.append(
-            {"role": "assistant", "content": optimisation_response}
-        )
         with st.chat_message("assistant"):
             st.markdown("Azure OpenAI Response")
-            st.markdown(optimisation_response)
-
-    def __generate_response(self, messages: List[Dict[str, Any]]) -> str:
-        return self.openai_client.generate_response(messages=messages)
-
-    def __convert_uploaded_img_to_base64(self, image: UploadedFile) -> str:
+            # show the services while they stream in, then replace them with the
+            # optimisation as soon as that starts streaming
+            services_placeholder = st.empty()
+            identified_services, _ = self.analyser.identify(
+                processed_image,
+                on_identified_services=lambda services: services_placeholder.markdown(
+                    format_partial_services(services)
+                ),
+            )
+            services_placeholder.empty()
+            optimisation_response = write_stream_with_tables(
+                self.analyser.optimise_stream(
+                    identified_services,
+                    image_hash=processed_image.content_hash,
+                    provider=self.provider,
+                    service_tier=self.service_tier,
+                )
+            )
+
+        # only start a new conversation when the diagram or settings change,
+        # otherwise every rerun would append the same prompt again
+        conversation_key = (
+            processed_image.content_hash,
+            self.provider,
+            self.service_tier,
+        )
+        if st.session_state.get("optimisation_conversation_key") != conversation_key:
+            st.session_state.optimisation_conversation_key = conversation_key
+            st.session_state.messages = self.history.start(
+                messages=self.analyser.optimisation_prompt(identified_services)
+                + [{"role": "assistant", "content": optimisation_response}],
+                services_summary=identified_services.to_summary(),
+            )
+
+    def __preprocess_image(self, image: UploadedFile) -> "ProcessedImage":
         """
-        Convert the uploaded file to a base64 string.
+        Downscale, crop and re-encode the uploaded file for the vision model,
+        rasterising PDFs and tiling diagrams too large to read in one piece.
         """
-        base64_image = base64.b64encode(image.getvalue()).decode()
-        return base64_image
+        return _cached_preprocess_diagram(image.getvalue())
 
 
 if __name__ == "__main__":
-    from dotenv import load_dotenv
-
-    load_dotenv(".env")
-
     app = OptimiserApp()
     app.run()
 
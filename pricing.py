@@ -0,0 +1,215 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from prompt import (
+    ESTIMATE_CURRENCY,
+    CostEstimate,
+    CostLineItem,
+    IdentifiedService,
+    IdentifiedServices,
+)
+
+DEFAULT_CATALOGUE_DIR = "data/pricing"
+CATALOGUE_COLUMNS = [
+    "provider",
+    "service",
+    "sku",
+    "category",
+    "tier",
+    "region",
+    "unit",
+    "unit_price",
+    "monthly_units",
+    "currency",
+]
+# region codes treated as "UK" for each provider
+UK_REGIONS = {
+    "Azure": ("uk", "uksouth", "ukwest"),
+    "AWS": ("uk", "eu-west-2"),
+    "GCP": ("uk", "europe-west2"),
+}
+PROVIDER_PREFIXES = re.compile(
+    r"^(microsoft azure|azure|amazon web services|amazon|aws|google cloud platform|"
+    r"google cloud|google|gcp)\s+"
+)
+
+logger = logging.getLogger("pricing")
+
+
+def normalise_service_name(name: str) -> str:
+    """
+    Reduce a service name to a lookup key, e.g. "Amazon S3" -> "s3".
+    """
+    name = re.sub(r"[^a-z0-9]+", " ", name.lower()).strip()
+    return PROVIDER_PREFIXES.sub("", name)
+
+
+class PricingCatalogue:
+    def __init__(self, prices: pd.DataFrame, version: str = "") -> None:
+        """
+        In-memory price list indexed by provider, service, region and SKU.
+
+        prices needs the CATALOGUE_COLUMNS columns, one row per SKU. An optional
+        "aliases" column holds other names for the service, separated by ";".
+        Rows not priced in ESTIMATE_CURRENCY are left out, since estimates
+        add catalogue and model prices together and there are no exchange
+        rates to convert them with.
+        """
+        missing = set(CATALOGUE_COLUMNS) - set(prices.columns)
+        if missing:
+            raise ValueError(f"Price sheet is missing columns: {sorted(missing)}")
+        prices = prices.copy()
+        prices["currency"] = prices["currency"].str.upper()
+        other_currency = prices["currency"] != ESTIMATE_CURRENCY
+        if other_currency.any():
+            logger.warning(
+                "Ignoring %d price rows not in %s: %s",
+                other_currency.sum(),
+                ESTIMATE_CURRENCY,
+                sorted(prices.loc[other_currency, "currency"].dropna().unique()),
+            )
+            prices = prices[~other_currency]
+        prices["service_key"] = prices["service"].map(normalise_service_name)
+        prices["region"] = prices["region"].str.lower()
+        prices["sku_key"] = prices["sku"].fillna("").str.lower()
+        self.prices = prices.set_index(
+            ["provider", "service_key", "region", "sku_key"]
+        ).sort_index()
+        self.version = version
+        self._index = self.__build_index(prices)
+
+    @classmethod
+    def from_directory(cls, directory: str) -> "PricingCatalogue":
+        """
+        Load every .csv and .parquet price sheet in the directory.
+        """
+        paths = sorted(
+            p for p in Path(directory).glob("*") if p.suffix in (".csv", ".parquet")
+        )
+        if not paths:
+            raise FileNotFoundError(f"No price sheets found in {directory}")
+        try:
+            frames = [
+                pd.read_parquet(p) if p.suffix == ".parquet" else pd.read_csv(p)
+                for p in paths
+            ]
+        except ImportError as e:
+            raise RuntimeError(
+                "Failed to load price sheets: Parquet needs pyarrow "
+                f"(poetry install --extras parquet): {e}"
+            )
+        # the version changes whenever a price sheet does, invalidating cached prices
+        fingerprint = hashlib.sha256()
+        for p in paths:
+            stat = p.stat()
+            fingerprint.update(f"{p.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return cls(pd.concat(frames, ignore_index=True), fingerprint.hexdigest()[:16])
+
+    def lookup(
+        self, service: IdentifiedService, service_tier: str, region: str = "UK"
+    ) -> Optional[Dict]:
+        """
+        Return the price row for an identified service, or None if it is not listed.
+
+        An exact SKU match wins. Otherwise the cheapest SKU in the requested tier
+        is used, falling back to the cheapest SKU in any tier.
+        """
+        rows = None
+        for region_code in self.__region_codes(service.provider, region):
+            rows = self._index.get(
+                (service.provider, normalise_service_name(service.name), region_code)
+            )
+            if rows:
+                break
+        if not rows:
+            return None
+
+        sku = service.sku.lower()
+        by_sku = [row for row in rows if sku and row["sku_key"] == sku]
+        in_tier = [row for row in rows if row["tier"] == service_tier]
+        return (by_sku or in_tier or rows)[0]
+
+    def price(
+        self, services: IdentifiedServices, service_tier: str, region: str = "UK"
+    ) -> Tuple[CostEstimate, List[IdentifiedService]]:
+        """
+        Price the identified services from the catalogue.
+
+        Returns the estimate for every service found and the list of services
+        that are not in the catalogue.
+        """
+        line_items = []
+        unmatched = []
+        for service in services.services:
+            row = self.lookup(service, service_tier=service_tier, region=region)
+            if row is None:
+                unmatched.append(service)
+                continue
+            line_items.append(
+                CostLineItem(
+                    service_name=service.name,
+                    assumptions=[
+                        f"{row['sku']} ({row['tier']} tier) in {row['region']}",
+                        f"{row['monthly_units']:g} {row['unit']} per month per instance",
+                        "Priced from the local pricing catalogue",
+                    ],
+                    quantity=service.quantity,
+                    unit=row["unit"],
+                    unit_price=float(row["unit_price"]),
+                    monthly_units=float(row["monthly_units"]),
+                    currency=row["currency"],
+                )
+            )
+        return CostEstimate(line_items=line_items), unmatched
+
+    def __build_index(
+        self, prices: pd.DataFrame
+    ) -> Dict[Tuple[str, str, str], List[Dict]]:
+        # plain dict of rows sorted by price so a lookup is a single hash probe
+        index: Dict[Tuple[str, str, str], List[Dict]] = {}
+        for row in prices.sort_values("unit_price").to_dict(orient="records"):
+            keys = [row["service_key"]]
+            aliases = row.get("aliases")
+            if isinstance(aliases, str):
+                keys += [normalise_service_name(a) for a in aliases.split(";") if a]
+            for key in keys:
+                index.setdefault((row["provider"], key, row["region"]), []).append(row)
+        return index
+
+    def __region_codes(self, provider: str, region: str) -> Tuple[str, ...]:
+        if region.upper() == "UK":
+            return UK_REGIONS.get(provider, ("uk",))
+        return (region.lower(),)
+
+
+_catalogue: Optional[PricingCatalogue] = None
+_catalogue_loaded = False
+_catalogue_lock = threading.Lock()
+
+
+def get_pricing_catalogue() -> Optional[PricingCatalogue]:
+    """
+    Return the catalogue from PRICING_CATALOGUE_DIR, or None if there is none
+    or it cannot be read, in which case every service is priced by the model.
+    """
+    global _catalogue, _catalogue_loaded
+    with _catalogue_lock:
+        if not _catalogue_loaded:
+            directory = os.getenv("PRICING_CATALOGUE_DIR", DEFAULT_CATALOGUE_DIR)
+            try:
+                _catalogue = PricingCatalogue.from_directory(directory)
+            except FileNotFoundError:
+                _catalogue = None
+            except (ValueError, RuntimeError) as e:
+                # a broken price sheet should not take the estimator down
+                logger.error("Ignoring the pricing catalogue in %s: %s", directory, e)
+                _catalogue = None
+            _catalogue_loaded = True
+        return _catalogue
@@ -1,33 +1,193 @@
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Literal, Tuple, Type
+
+from pydantic import BaseModel, Field, model_validator
+
+# bump whenever prompt wording changes so cached results are not reused
+PROMPT_VERSION = "5"
+
+CURRENCY_SYMBOLS = {"GBP": "£", "USD": "$", "EUR": "€"}
+# the currency the prompts ask for, and the only one the catalogue prices in
+ESTIMATE_CURRENCY = "GBP"
+
+# shared vocabulary so equivalent services can be matched across providers
+ServiceCategory = Literal[
+    "compute",
+    "kubernetes",
+    "serverless",
+    "object_storage",
+    "block_storage",
+    "file_storage",
+    "relational_database",
+    "nosql_database",
+    "data_warehouse",
+    "cache",
+    "messaging",
+    "streaming",
+    "etl",
+    "analytics",
+    "ai_ml",
+    "llm",
+    "search",
+    "api_gateway",
+    "load_balancer",
+    "cdn",
+    "networking",
+    "dns",
+    "identity",
+    "security",
+    "monitoring",
+    "other",
+]
+
+
+def format_price(amount: float, currency: str = "GBP") -> str:
+    text = f"{amount:,.2f}"
+    if 0 < abs(amount) < 1:
+        # unit prices are often fractions of a penny
+        text = f"{amount:.6f}".rstrip("0")
+        text = text if len(text.split(".")[1]) >= 2 else f"{amount:.2f}"
+    symbol = CURRENCY_SYMBOLS.get(currency)
+    if symbol is None:
+        return f"{text} {currency}"
+    return f"{symbol}{text}"
+
+
+class IdentifiedService(BaseModel):
+    name: str = Field(description="Service name as the provider calls it")
+    provider: Literal["Azure", "AWS", "GCP", "Other"]
+    category: ServiceCategory
+    sku: str = Field(description="SKU, size or tier if shown, otherwise empty")
+    quantity: float = Field(description="Number of instances, 1 if not specified")
+
+
+class IdentifiedServices(BaseModel):
+    services: list[IdentifiedService]
+
+    def to_summary(self) -> str:
+        """
+        Render the services as a compact list, one line per service.
+        """
+        return "\n".join(
+            f"- {service.quantity:g} x {service.name} ({service.provider}, "
+            f"{service.category}{', ' + service.sku if service.sku else ''})"
+            for service in self.services
+        )
+
+
+class CostLineItem(BaseModel):
+    service_name: str
+    assumptions: list[str]
+    quantity: float = Field(description="Number of instances of the service")
+    unit: str = Field(description="Billing unit, e.g. hour, GB-month, 1M tokens")
+    unit_price: float = Field(description="Price of one billing unit")
+    monthly_units: float = Field(
+        description="Billing units used per month by one instance, e.g. 730 hours"
+    )
+    currency: str = Field(description="ISO 4217 currency code, e.g. GBP")
 
-from pydantic import BaseModel
+    @property
+    def monthly_cost(self) -> float:
+        return self.quantity * self.monthly_units * self.unit_price
 
 
 class CostEstimate(BaseModel):
-    services: str
-    assumptions: list[str]
-    price_rate: str
-    monthly_cost_estimate: str
+    line_items: list[CostLineItem]
+
+    @model_validator(mode="after")
+    def check_single_currency(self) -> "CostEstimate":
+        # the total adds line items up, which only makes sense in one currency
+        currencies = sorted({item.currency.upper() for item in self.line_items})
+        if len(currencies) > 1:
+            raise ValueError(
+                f"Line items are priced in more than one currency: {currencies}"
+            )
+        return self
+
+    @property
+    def currency(self) -> str:
+        return self.line_items[0].currency if self.line_items else ESTIMATE_CURRENCY
+
+    @property
+    def total_monthly_cost(self) -> float:
+        # totals are computed here rather than by the model so they always add up
+        return sum(item.monthly_cost for item in self.line_items)
+
+    def to_markdown(self) -> str:
+        """
+        Render the estimate as the "Estimated Cost" markdown table and total.
+        """
+        rows = [
+            "## Estimated Cost",
+            "",
+            "| Service Name | Assumptions | Quantity | Price Rate | Estimated Monthly Cost |",
+            "|--------------|-------------|----------|------------|------------------------|",
+        ]
+        for item in self.line_items:
+            service_name = item.service_name.replace("|", "\\|")
+            assumptions = "<br>".join(a.replace("|", "\\|") for a in item.assumptions)
+            rows.append(
+                f"| {service_name} | {assumptions} "
+                f"| {item.quantity:g} "
+                f"| {format_price(item.unit_price, item.currency)} per {item.unit} "
+                f"| {format_price(item.monthly_cost, item.currency)} |"
+            )
+        rows += [
+            "",
+            "Total estimated monthly cost is "
+            f"{format_price(self.total_monthly_cost, self.currency)}",
+        ]
+        return "\n".join(rows)
+
+
+# Everything up to the first variable part of a request is identical across
+# every stage. At about 250 tokens this prefix is below the 1024 tokens Azure
+# needs before it caches a prompt, so it is not cached on its own; only when a
+# request repeats a long enough prefix, e.g. the same diagram image, is it
+# served from the prompt cache. Keep this text stable all the same: any edit
+# changes the prefix of every call.
+SYSTEM_PROMPT: Dict[str, Any] = {
+    "role": "system",
+    "content": [
+        {
+            "type": "text",
+            "text": "You are a solution architect. Your goal is to analyze cloud architecture diagrams, estimate the cost of the cloud services they use and consider substitutes for them. Assume that all resources are created in UK and currency is in British Pound. When displaying any price, always include the British pound symbol along with the number. Depending on the request, your tasks include: \n1. Identifying the cloud services used in the diagram.\n2. Determining the quantity of each service if specified.\n3. Making sensible assumptions for each service such as compute options, data volume, token estimation, models etc.\n4. Based on the latest pricing information from cloud service providers, providing a cost estimation based on the identified services and quantities, including any assumptions made for each service.\n5. Identifying potential substitutes for the identified services from other cloud providers and providing a cost estimation based on the substitutes.",
+        }
+    ],
+}
 
+IDENTIFY_SERVICE_TEXT = "Identify the cloud services used in the diagram and determine the quantity of each service if specified."
 
-class CostEstimationPrompt:
-    def __init__(self, base64_image: str) -> None:
+COST_ESTIMATION_TEXT = "Based on the cloud services identified, use latest pricing information from cloud service providers to price each identified service per month. Return one line item per service with the service name, the assumptions made in detail (such as compute options, data volume, token estimation and models), the quantity, the billing unit, the price of one unit in British Pound, the number of units one instance uses per month and the currency code GBP. Do not calculate monthly costs or totals, they are calculated from these fields."
+
+OPTIMISATION_TEXT = "Based on the cloud services identified, use latest pricing information from alternate cloud service providers, provide a monthly cost estimation based on the alternatives of identified services from other cloud providers. Include any assumptions made for each services. For each service, format the output as '**Assumptions** \n**Pricing Rate**\n**3. Monthly Cost**.' Aggregate the total monthly cost for the cheapest alternative services in the end."
+
+
+def _text_message(role: str, text: str) -> Dict[str, Any]:
+    return {"role": role, "content": [{"type": "text", "text": text}]}
+
+
+def _follow_up_prompt(previous_response: str, task: str) -> List[Dict[str, Any]]:
+    # follow-up stages see the identification as an earlier text-only exchange,
+    # so only the identification call has to send the diagram. The services
+    # summary is the only part that varies, and it precedes the stage's task so
+    # the cost and optimisation calls for one diagram share the longest prefix.
+    return [
+        SYSTEM_PROMPT,
+        _text_message("user", IDENTIFY_SERVICE_TEXT),
+        _text_message("assistant", previous_response),
+        _text_message("user", task),
+    ]
+
+
+class ServiceIdentificationPrompt:
+    def __init__(self, base64_image: str, mime_type: str = "image/jpeg") -> None:
         self.base64_image = base64_image
-        self.system_prompt = self.__generate_system_prompt()
-
-    def __generate_system_prompt(self) -> Dict[str, Any]:
-        system_prompt = {
-            "role": "system",
-            "content": [
-                {
-                    "type": "text",
-                    "text": "You are a solution architect. Your goal is to analyze architecture diagrams and estimate the cost of cloud services. Assume that all resources are created in UK and currency is in British Pound. When displaying any price, always include the British pound symbol along with the number. Your tasks include: \n1. Identifying the cloud services used in the diagram.\n2. Determining the quantity of each service if specified. \n3. Make any sensible assumptions for each services such as compute options, data volume, token estimation, models etc. \n4. Based on the latest pricing information from cloud service providers, provide a cost estimation based on the identified services and quantities, include any assumptions made for each services.",
-                }
-            ],
-        }
-        return system_prompt
+        self.mime_type = mime_type
+        self.system_prompt = SYSTEM_PROMPT
 
-    def generate_identify_service_prompt(self) -> Tuple[List[Dict[str, Any]], None]:
+    def generate_identify_service_prompt(
+        self,
+    ) -> Tuple[List[Dict[str, Any]], Type[IdentifiedServices]]:
         identify_service_prompt = [
             self.system_prompt,
             {
@@ -35,143 +195,45 @@ class CostEstimationPrompt:
                 "content": [
                     {
                         "type": "text",
-                        "text": """
-                                    Identify the cloud services used in the diagram and determine the quantity of each service if specified.
-                                """,
+                        "text": IDENTIFY_SERVICE_TEXT,
                     },
+                    # the image varies per request, so it goes last
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/jpeg;base64,{self.base64_image}"
+                            "url": f"data:{self.mime_type};base64,{self.base64_image}"
                         },
                     },
                 ],
             },
         ]
         self.identify_service_prompt = identify_service_prompt
-        response_format = None
+        response_format = IdentifiedServices
         return self.identify_service_prompt, response_format
 
+
+class CostEstimationPrompt:
+    def __init__(self) -> None:
+        self.system_prompt = SYSTEM_PROMPT
+
     def generate_cost_estimation_prompt(
         self, previous_response: str
-    ) -> Tuple[List[Dict[str, Any]], CostEstimate]:
-        assistant_response = {
-            "role": "assistant",
-            "content": [
-                {
-                    "type": "text",
-                    "text": f"{previous_response}",
-                },
-            ],
-        }
-
-        cost_estimation_prompt = (
-            self.identify_service_prompt
-            + [assistant_response]
-            + [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Based on the cloud services identified, use latest pricing information from cloud service providers, provide a monthly cost estimation based on the identified services and quantities, include any assumptions made for each services in details such as compute options, data volume, token estimation and models. 
-                            
-                            Generate a markdown structure with the following elements: 
-                            1. A markdown table titled "Estimated Cost" with the properties: Service Name, Assumptions, Quantity, Price Rate and Estimated Monthly Cost. The assumptions property is a string separated by \n for each assumption. The 'Estimated Monthly Cost' property should only include numbers and the british pound symbol. The Price Rate should be clearly stated as how much cost per unit/duration.
-                            2. A text that states "Total estimated monthly cost is total_estimated_cost", where total_estimated_cost is the total of the Estimated Monthly Cost for all the services.
-
-                            The output should only contain the items from markdown structure and should not deviate from the structure. The markdown should look like this:
-
-                            ## Estimated Cost
-
-                            | Service Name | Assumptions | Quantity | Price Rate | Estimated Monthly Cost |
-                            |--------------|-------------|----------|------------|------------------------|
-
-                            Total estimated monthly cost is total_estimated_cost
-                            """,
-                        }
-                    ],
-                },
-            ]
+    ) -> Tuple[List[Dict[str, Any]], Type[CostEstimate]]:
+        self.cost_estimation_prompt = _follow_up_prompt(
+            previous_response, COST_ESTIMATION_TEXT
         )
-        self.cost_estimation_prompt = cost_estimation_prompt
-        response_format = None
+        response_format = CostEstimate
         return self.cost_estimation_prompt, response_format
 
 
 class CloudOptimisationPrompt:
-    def __init__(self, base64_image: str) -> None:
-        self.base64_image = base64_image
-        self.system_prompt = self.__generate_system_prompt()
-
-    def __generate_system_prompt(self) -> Dict[str, Any]:
-        system_prompt = {
-            "role": "system",
-            "content": [
-                {
-                    "type": "text",
-                    "text": """You are a solution architect. Your goal is to analyze architecture diagrams and consider substitutes of listed cloud resources. Assume that all resources are created in UK and currency is in British Pound. Your tasks include: 
-                    1. Identifying the cloud services used in the diagram.
-                    2. Determining the quantity of each service if specified. 
-                    3. Based on the latest pricing information from cloud service providers, provide a cost estimation based on the identified services and quantities, include any assumptions made for each services.
-                    4. Make any sensible assumptions for each services such as compute options, data volume, token estimation, models etc. 
-                    5. Identify the potential substitutes for the identified services and provide a cost estimation based on the substitutes.""",
-                }
-            ],
-        }
-        return system_prompt
-
-    def generate_identify_service_prompt(self) -> List[Dict[str, Any]]:
-        identify_service_prompt = [
-            self.system_prompt,
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": """
-                                    Identify the cloud services used in the diagram and determine the quantity of each service if specified.
-                                """,
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{self.base64_image}"
-                        },
-                    },
-                ],
-            },
-        ]
-        self.identify_service_prompt = identify_service_prompt
-        return self.identify_service_prompt
+    def __init__(self) -> None:
+        self.system_prompt = SYSTEM_PROMPT
 
     def synthesise_optimisation_prompt(
         self, previous_response: str
     ) -> List[Dict[str, Any]]:
-        assistant_response = {
-            "role": "assistant",
-            "content": [
-                {
-                    "type": "text",
-                    "text": f"{previous_response}",
-                },
-            ],
-        }
-
-        optimisation_prompt = (
-            self.identify_service_prompt
-            + [assistant_response]
-            + [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Based on the cloud services identified, use latest pricing information from alternate cloud service providers, provide a monthly cost estimation based on the alternatives of identified services from other cloud providers. Include any assumptions made for each services. For each service, format the output as '**Assumptions** \n**Pricing Rate**\n**3. Monthly Cost**.' Aggregate the total monthly cost for the cheapest alternative services in the end.",
-                        }
-                    ],
-                },
-            ]
+        self.optimisation_prompt = _follow_up_prompt(
+            previous_response, OPTIMISATION_TEXT
         )
-        self.optimisation_prompt = optimisation_prompt
         return self.optimisation_prompt
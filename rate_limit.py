@@ -0,0 +1,141 @@
+import asyncio
+import datetime
+import email.utils
+import random
+import time
+from typing import Mapping, Optional
+
+# Azure OpenAI grants 6 requests per minute for every 1000 tokens per minute
+REQUESTS_PER_1000_TOKENS = 6
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        """
+        Classic token bucket: holds at most capacity tokens and refills
+        continuously at refill_per_second.
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated_at) * self.refill_per_second,
+        )
+        self.updated_at = now
+
+    def available(self) -> float:
+        """
+        Tokens the bucket would hold if refilled now, without changing it, so
+        other threads can read it while the owning event loop consumes from it.
+        """
+        return min(
+            self.capacity,
+            self.tokens + (time.monotonic() - self.updated_at) * self.refill_per_second,
+        )
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Seconds until amount tokens are available, 0 if they are available now.
+        """
+        self.refill()
+        # a request larger than the bucket would never fit, let it through once full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    def __init__(
+        self, tokens_per_minute: int, requests_per_minute: Optional[int] = None
+    ) -> None:
+        """
+        Schedule requests so they stay within a deployment's TPM and RPM quota.
+
+        Requests wait their turn in FIFO order. pause() holds every caller back,
+        which is used when the service answers 429 so concurrent requests back
+        off together rather than each hitting the limit again.
+        """
+        if requests_per_minute is None:
+            requests_per_minute = max(
+                1, tokens_per_minute * REQUESTS_PER_1000_TOKENS // 1000
+            )
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: int) -> None:
+        """
+        Wait until a request of the given token cost fits in the quota.
+        """
+        async with self._lock:
+            while True:
+                wait = max(
+                    self.paused_until - time.monotonic(),
+                    self.tokens.wait_time(tokens),
+                    self.requests.wait_time(1),
+                )
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            self.tokens.consume(tokens)
+            self.requests.consume(1)
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """
+    Return the delay requested by the retry-after-ms or Retry-After headers.
+    """
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        # HTTP dates are always in GMT
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(
+    attempt: int,
+    base_seconds: float = 1.0,
+    max_seconds: float = 60.0,
+    retry_after: Optional[float] = None,
+) -> float:
+    """
+    Delay before retry number attempt (starting at 1).
+
+    A server supplied Retry-After is honoured with a little jitter added so
+    waiting clients do not all retry at the same instant. Otherwise full
+    jitter exponential backoff is used.
+    """
+    if retry_after is not None:
+        return retry_after + random.uniform(0, base_seconds)
+    return random.uniform(0, min(max_seconds, base_seconds * 2 ** (attempt - 1)))
@@ -0,0 +1,356 @@
+"""
+Offline stand-in for Azure OpenAI, for benchmarks and demos without a network.
+
+ReplayTransport answers chat completion requests with recorded responses,
+falling back to synthetic ones, and can add latency and inject 429s.
+RecordingTransport forwards requests to a live endpoint and saves the
+responses for later replay.
+
+Usage:
+    client = ReplayAzureOpenAIClient(ReplayTransport(latency_seconds=0.2))
+    client = ReplayAzureOpenAIClient(
+        ReplayTransport.from_file("recordings.json", rate_limit_every=10)
+    )
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+
+from openai_client import AsyncAzureOpenAIClient, AzureOpenAIClient
+
+REPLAY_ENDPOINT = "https://replay.openai.azure.com"
+REPLAY_API_VERSION = "2024-10-21"
+
+# synthetic replies for the structured outputs used by the pipeline
+SYNTHETIC_CONTENT: Dict[str, Dict[str, Any]] = {
+    "IdentifiedServices": {
+        "services": [
+            {
+                "name": "Azure App Service",
+                "provider": "Azure",
+                "category": "compute",
+                "sku": "P1v3",
+                "quantity": 2,
+            },
+            {
+                "name": "Azure SQL Database",
+                "provider": "Azure",
+                "category": "relational_database",
+                "sku": "",
+                "quantity": 1,
+            },
+            {
+                "name": "Azure Blob Storage",
+                "provider": "Azure",
+                "category": "object_storage",
+                "sku": "",
+                "quantity": 1,
+            },
+            {
+                "name": "Azure Cosmos DB",
+                "provider": "Azure",
+                "category": "nosql_database",
+                "sku": "",
+                "quantity": 1,
+            },
+        ]
+    },
+    "CostEstimate": {
+        "line_items": [
+            {
+                "service_name": "Azure Cosmos DB",
+                "assumptions": ["400 RU/s provisioned throughput", "UK South"],
+                "quantity": 1,
+                "unit": "100 RU/s hour",
+                "unit_price": 0.006,
+                "monthly_units": 2920,
+                "currency": "GBP",
+            },
+            {
+                "service_name": "Azure Blob Storage",
+                "assumptions": ["1 TB hot tier, LRS"],
+                "quantity": 1,
+                "unit": "GB-month",
+                "unit_price": 0.0152,
+                "monthly_units": 1024,
+                "currency": "GBP",
+            },
+        ]
+    },
+}
+SYNTHETIC_TEXT = (
+    "**Azure App Service** could be replaced by Google Cloud Run.\n"
+    "**Assumptions** 2 instances running all month\n"
+    "**Pricing Rate** £0.05 per vCPU hour\n"
+    "**3. Monthly Cost** £73.00\n\n"
+    "The cheapest alternatives total £412.50 per month."
+)
+
+
+def request_key(body: Dict[str, Any]) -> str:
+    """
+    Return the key a chat completion request is recorded under.
+    """
+    relevant = {
+        "messages": body.get("messages"),
+        "response_format": body.get("response_format"),
+    }
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        recordings: Optional[Dict[str, str]] = None,
+        latency_seconds: float = 0.0,
+        chunk_latency_seconds: float = 0.0,
+        chunk_size: int = 16,
+        rate_limit_every: int = 0,
+        retry_after_ms: int = 10,
+        prompt_tokens_cached_ratio: float = 0.5,
+    ) -> None:
+        """
+        Serve chat completions without a network.
+
+        recordings maps request_key() to the reply content. Requests that were
+        not recorded get a synthetic reply chosen by their response format.
+        latency_seconds is added before the first byte and
+        chunk_latency_seconds between streamed chunks. With rate_limit_every
+        set to N, every Nth request is answered with a 429.
+        """
+        self.recordings = recordings or {}
+        self.latency_seconds = latency_seconds
+        self.chunk_latency_seconds = chunk_latency_seconds
+        self.chunk_size = chunk_size
+        self.rate_limit_every = rate_limit_every
+        self.retry_after_ms = retry_after_ms
+        self.prompt_tokens_cached_ratio = prompt_tokens_cached_ratio
+        self.requests = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs: Any) -> "ReplayTransport":
+        return cls(recordings=json.loads(Path(path).read_text()), **kwargs)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = self.__respond(request)
+        if response.status_code == 200:
+            time.sleep(self.latency_seconds)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = self.__respond(request, is_async=True)
+        if response.status_code == 200:
+            await asyncio.sleep(self.latency_seconds)
+        return response
+
+    def reply_content(self, body: Dict[str, Any]) -> str:
+        """
+        Return the recorded reply for a request, or a synthetic one.
+        """
+        recorded = self.recordings.get(request_key(body))
+        if recorded is not None:
+            return recorded
+        response_format = body.get("response_format") or {}
+        schema_name = response_format.get("json_schema", {}).get("name")
+        if schema_name in SYNTHETIC_CONTENT:
+            return json.dumps(SYNTHETIC_CONTENT[schema_name])
+        return SYNTHETIC_TEXT
+
+    def __respond(
+        self, request: httpx.Request, is_async: bool = False
+    ) -> httpx.Response:
+        if not request.url.path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": "Not replayed"}})
+        with self._lock:
+            self.requests += 1
+            rate_limited = (
+                self.rate_limit_every and self.requests % self.rate_limit_every == 0
+            )
+            self.rate_limited += bool(rate_limited)
+        if rate_limited:
+            return httpx.Response(
+                429,
+                headers={"retry-after-ms": str(self.retry_after_ms)},
+                json={"error": {"code": "429", "message": "Rate limit is exceeded."}},
+            )
+
+        body = json.loads(request.content)
+        content = self.reply_content(body)
+        usage = self.__usage(body, content)
+        if not body.get("stream"):
+            return httpx.Response(200, json=_completion(content, usage))
+        chunks = [
+            content[i : i + self.chunk_size]
+            for i in range(0, len(content), self.chunk_size)
+        ]
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        events = [_chunk({"content": piece}, None) for piece in chunks]
+        events.append(_chunk({}, "stop"))
+        if include_usage:
+            events.append(_usage_chunk(usage))
+        stream = self.__async_events(events) if is_async else self.__sync_events(events)
+        return httpx.Response(
+            200, headers={"content-type": "text/event-stream"}, content=stream
+        )
+
+    def __sync_events(self, events: list) -> Iterator[bytes]:
+        for event in events:
+            yield f"data: {json.dumps(event)}\n\n".encode()
+            time.sleep(self.chunk_latency_seconds)
+        yield b"data: [DONE]\n\n"
+
+    async def __async_events(self, events: list):
+        for event in events:
+            yield f"data: {json.dumps(event)}\n\n".encode()
+            await asyncio.sleep(self.chunk_latency_seconds)
+        yield b"data: [DONE]\n\n"
+
+    def __usage(self, body: Dict[str, Any], content: str) -> Dict[str, Any]:
+        # roughly four characters per token, like history.estimate_tokens
+        prompt_tokens = len(json.dumps(body.get("messages"))) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+            "prompt_tokens_details": {
+                "cached_tokens": int(prompt_tokens * self.prompt_tokens_cached_ratio)
+            },
+        }
+
+
+class RecordingTransport(httpx.BaseTransport):
+    def __init__(self, path: str, transport: Optional[httpx.BaseTransport] = None):
+        """
+        Forward requests to the real endpoint and save each reply to path so
+        the session can be replayed with ReplayTransport.from_file().
+        """
+        self.path = Path(path)
+        self.transport = transport or httpx.HTTPTransport()
+        self.recordings: Dict[str, str] = (
+            json.loads(self.path.read_text()) if self.path.exists() else {}
+        )
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        response = self.transport.handle_request(request)
+        if response.status_code != 200 or not request.url.path.endswith(
+            "/chat/completions"
+        ):
+            return response
+        raw = response.read()
+        body = json.loads(request.content)
+        content = (
+            _streamed_content(raw)
+            if body.get("stream")
+            else json.loads(raw)["choices"][0]["message"]["content"]
+        )
+        with self._lock:
+            self.recordings[request_key(body)] = content
+            self.path.write_text(json.dumps(self.recordings, indent=2))
+        return httpx.Response(
+            response.status_code, headers=response.headers, content=raw
+        )
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class ReplayAzureOpenAIClient(AzureOpenAIClient):
+    def __init__(
+        self,
+        transport: Optional[httpx.BaseTransport] = None,
+        deployment: str = "replay",
+        api_version: str = REPLAY_API_VERSION,
+    ) -> None:
+        """
+        An AzureOpenAIClient whose requests are served by a ReplayTransport, so
+        everything above the HTTP layer runs exactly as it does in production.
+        """
+        self.transport = transport or ReplayTransport()
+        super().__init__(
+            api_key="replay",
+            api_version=api_version,
+            azure_endpoint=REPLAY_ENDPOINT,
+            deployment=deployment,
+            http_client=httpx.Client(transport=self.transport),
+        )
+
+
+class ReplayAsyncAzureOpenAIClient(AsyncAzureOpenAIClient):
+    def __init__(
+        self,
+        transport: Optional[ReplayTransport] = None,
+        deployment: str = "replay",
+        api_version: str = REPLAY_API_VERSION,
+        **kwargs: Any,
+    ) -> None:
+        """
+        The async counterpart of ReplayAzureOpenAIClient. Like every async
+        client it should only be used on the background event loop.
+        """
+        self.transport = transport or ReplayTransport()
+        super().__init__(
+            api_key="replay",
+            api_version=api_version,
+            azure_endpoint=REPLAY_ENDPOINT,
+            deployment=deployment,
+            http_client=httpx.AsyncClient(transport=self.transport),
+            **kwargs,
+        )
+
+
+def _completion(content: str, usage: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": "replay",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "replay",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": content},
+            }
+        ],
+        "usage": usage,
+    }
+
+
+def _chunk(delta: Dict[str, Any], finish_reason: Optional[str]) -> Dict[str, Any]:
+    return {
+        "id": "replay",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "replay",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def _usage_chunk(usage: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": "replay",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "replay",
+        "choices": [],
+        "usage": usage,
+    }
+
+
+def _streamed_content(raw: bytes) -> str:
+    content = []
+    for line in raw.decode().splitlines():
+        if not line.startswith("data: ") or line == "data: [DONE]":
+            continue
+        for choice in json.loads(line[len("data: ") :]).get("choices", []):
+            content.append((choice.get("delta") or {}).get("content") or "")
+    return "".join(content)
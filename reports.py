@@ -0,0 +1,264 @@
+"""
+Export stored estimates as cost reports for finance, without the Streamlit UI.
+
+Line items are read from the estimate store in chunks and written out as they
+arrive, so memory stays flat however many estimates are exported. Summaries
+are aggregated chunk by chunk the same way.
+
+Usage:
+    python reports.py export line_items.parquet
+    python reports.py export checkout.xlsx --project checkout --since 2025-01-01
+    python reports.py summary --by provider service_name --output summary.csv
+"""
+
+import argparse
+import io
+import logging
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional, Sequence, Union
+
+import pandas as pd
+
+from config import load_config
+from store import DEFAULT_CHUNK_ROWS, EstimateStore, get_estimate_store
+
+EXPORT_FORMATS = ("csv", "parquet", "xlsx")
+DEFAULT_GROUP_BY = ("provider", "project", "service_name")
+# amounts in different currencies are never added together
+SUMMARY_KEYS = ("currency",)
+# the most rows an Excel sheet can hold, header included
+XLSX_MAX_ROWS = 1_048_576
+
+logger = logging.getLogger("reports")
+
+Destination = Union[str, Path, BinaryIO]
+
+
+def export_format(destination: Destination, format: Optional[str] = None) -> str:
+    """
+    Return the export format, taken from the file suffix unless given.
+    """
+    if format is None and isinstance(destination, (str, Path)):
+        format = Path(destination).suffix.lstrip(".").lower()
+    if format not in EXPORT_FORMATS:
+        raise RuntimeError(
+            f"Failed to export report: unknown format {format!r}, "
+            f"use one of {', '.join(EXPORT_FORMATS)}"
+        )
+    return format
+
+
+def export_line_items(
+    store: EstimateStore,
+    destination: Destination,
+    format: Optional[str] = None,
+    chunksize: int = DEFAULT_CHUNK_ROWS,
+    project: Optional[str] = None,
+    provider: Optional[str] = None,
+    since: Optional[float] = None,
+) -> int:
+    """
+    Write every matching line item to a CSV, Parquet or XLSX file, or to a
+    binary file object, one chunk at a time. Returns the number of rows.
+    """
+    return write_frames(
+        store.iter_line_items(
+            project=project, provider=provider, since=since, chunksize=chunksize
+        ),
+        destination,
+        format=format,
+    )
+
+
+def summarise(
+    store: EstimateStore,
+    by: Sequence[str] = DEFAULT_GROUP_BY,
+    chunksize: int = DEFAULT_CHUNK_ROWS,
+    project: Optional[str] = None,
+    provider: Optional[str] = None,
+    since: Optional[float] = None,
+) -> pd.DataFrame:
+    """
+    Return the monthly cost, quantity and number of line items per group,
+    most expensive first.
+
+    Each chunk is grouped on its own and folded into the running totals, so
+    memory grows with the number of groups rather than of line items.
+    """
+    keys = list(dict.fromkeys([*by, *SUMMARY_KEYS]))
+    totals: Optional[pd.DataFrame] = None
+    for chunk in store.iter_line_items(
+        project=project, provider=provider, since=since, chunksize=chunksize
+    ):
+        partial = chunk.groupby(keys, sort=False, dropna=False).agg(
+            monthly_cost=("monthly_cost", "sum"),
+            quantity=("quantity", "sum"),
+            line_items=("monthly_cost", "size"),
+        )
+        totals = (
+            partial
+            if totals is None
+            else pd.concat([totals, partial])
+            .groupby(level=keys, sort=False, dropna=False)
+            .sum()
+        )
+    if totals is None:
+        return pd.DataFrame(columns=keys + ["monthly_cost", "quantity", "line_items"])
+    return totals.sort_values("monthly_cost", ascending=False).reset_index()
+
+
+def write_frames(
+    frames: Iterable[pd.DataFrame],
+    destination: Destination,
+    format: Optional[str] = None,
+) -> int:
+    """
+    Write frames with the same columns one after another to a CSV, Parquet
+    or XLSX file, or to a binary file object. Returns the number of rows.
+    """
+    writer = _WRITERS[export_format(destination, format)]
+    if not isinstance(destination, (str, Path)):
+        return writer(frames, destination)
+    with open(destination, "wb") as f:
+        return writer(frames, f)
+
+
+def _write_csv(chunks: Iterable[pd.DataFrame], f: BinaryIO) -> int:
+    rows = 0
+    for chunk in chunks:
+        f.write(chunk.to_csv(index=False, header=rows == 0).encode())
+        rows += len(chunk)
+    return rows
+
+
+def _write_parquet(chunks: Iterable[pd.DataFrame], f: BinaryIO) -> int:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError(
+            "Failed to export report: Parquet needs pyarrow "
+            f"(poetry install --extras parquet): {e}"
+        )
+    rows = 0
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(
+                chunk, schema=writer.schema if writer else None, preserve_index=False
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(f, table.schema)
+            # each chunk becomes a row group
+            writer.write_table(table)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _write_xlsx(chunks: Iterable[pd.DataFrame], f: BinaryIO) -> int:
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise RuntimeError(
+            "Failed to export report: XLSX needs openpyxl "
+            f"(poetry install --extras xlsx): {e}"
+        )
+    # write-only workbooks stream rows to a temporary file instead of
+    # keeping every cell in memory
+    workbook = Workbook(write_only=True)
+    sheet, sheet_rows, rows = None, 0, 0
+    for chunk in chunks:
+        # Excel cannot store timezones or pandas' missing values
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for values in chunk.itertuples(index=False, name=None):
+            if sheet is None or sheet_rows == XLSX_MAX_ROWS:
+                suffix = f" {len(workbook.worksheets) + 1}" if sheet else ""
+                sheet = workbook.create_sheet(f"Report{suffix}")
+                sheet.append(list(chunk.columns))
+                sheet_rows = 1
+            sheet.append(values)
+            sheet_rows += 1
+            rows += 1
+    if sheet is None:
+        workbook.create_sheet("Report")
+    workbook.save(f)
+    return rows
+
+
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "xlsx": _write_xlsx}
+
+
+def export_bytes(store: EstimateStore, format: str, **filters) -> bytes:
+    """
+    Return the export as bytes, e.g. for a download button.
+    """
+    buffer = io.BytesIO()
+    export_line_items(store, buffer, format=format, **filters)
+    return buffer.getvalue()
+
+
+def parse_args(argv: List[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write every line item")
+    export.add_argument(
+        "output", type=Path, help="report file, .csv, .parquet or .xlsx"
+    )
+    summary = commands.add_parser("summary", help="write cost totals per group")
+    summary.add_argument(
+        "--by",
+        nargs="+",
+        default=list(DEFAULT_GROUP_BY),
+        help="columns to group by (default: provider project service_name)",
+    )
+    summary.add_argument(
+        "--output", type=Path, help="summary file, .csv, .parquet or .xlsx"
+    )
+    for command in (export, summary):
+        command.add_argument("--project", help="only estimates of this project")
+        command.add_argument("--provider", choices=("GCP", "AWS", "Azure"))
+        command.add_argument(
+            "--since",
+            type=datetime.fromisoformat,
+            help="only estimates made on or after this date, e.g. 2025-01-31",
+        )
+        command.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    return parser.parse_args(argv)
+
+
+def main(argv: List[str]) -> int:
+    load_config()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    args = parse_args(argv)
+    store = get_estimate_store()
+    if store is None:
+        logger.error("ESTIMATE_STORE_PATH is empty, there are no estimates to export")
+        return 1
+
+    filters = dict(
+        project=args.project,
+        provider=args.provider,
+        since=args.since.timestamp() if args.since else None,
+        chunksize=args.chunk_rows,
+    )
+    if args.command == "export":
+        rows = export_line_items(store, args.output, **filters)
+        logger.info("wrote %d line items to %s", rows, args.output)
+        return 0
+
+    totals = summarise(store, by=args.by, **filters)
+    if args.output is None:
+        print(totals.to_string(index=False))
+        return 0
+    write_frames([totals], args.output)
+    logger.info("wrote %d groups to %s", len(totals), args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,233 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+from openai import DefaultHttpxClient
+
+from openai_client import AsyncAzureOpenAIClient, AzureOpenAIClient
+from router import (
+    DEFAULT_HEDGE_QUANTILE,
+    DEFAULT_MIN_HEDGE_DELAY_SECONDS,
+    Deployment,
+    DeploymentRouter,
+    parse_deployments,
+)
+
+DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS = 300
+
+ClientKey = Tuple[str, str, str]
+
+
+def load_api_key() -> Optional[str]:
+    """
+    Return the current Azure OpenAI API key.
+
+    If AZURE_OPENAI_API_KEY_FILE is set the key is read from that file on every
+    call, so a rotated secret mounted into the container is picked up without a
+    restart. Otherwise AZURE_OPENAI_API_KEY is used.
+    """
+    key_file = os.getenv("AZURE_OPENAI_API_KEY_FILE")
+    if key_file:
+        try:
+            return Path(key_file).read_text().strip()
+        except OSError:
+            pass
+    return os.getenv("AZURE_OPENAI_API_KEY")
+
+
+class ClientRegistry:
+    def __init__(
+        self, health_check_interval: float = DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS
+    ) -> None:
+        """
+        Hold one AzureOpenAIClient per (endpoint, deployment, api_version), so
+        every session and page reuses the same connection pool.
+
+        Clients are health checked at most once per health_check_interval and
+        rebuilt on a fresh connection pool if the check fails.
+        """
+        self.health_check_interval = health_check_interval
+        self._clients: Dict[ClientKey, AzureOpenAIClient] = {}
+        self._async_clients: Dict[ClientKey, AsyncAzureOpenAIClient] = {}
+        self._checked_at: Dict[ClientKey, float] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self, azure_endpoint: str, deployment: str, api_version: str, api_key: str
+    ) -> AzureOpenAIClient:
+        """
+        Return the shared client for the deployment, creating it on first use.
+        """
+        key = (azure_endpoint, deployment, api_version)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self.__create_client(key, api_key)
+            elif client.api_key != api_key:
+                client.refresh_credentials(api_key)
+            self._clients[key] = client
+
+            if time.monotonic() - self._checked_at[key] > self.health_check_interval:
+                self._checked_at[key] = time.monotonic()
+                # check off the request path, callers keep the current client
+                threading.Thread(
+                    target=self.__check_health, args=(key,), daemon=True
+                ).start()
+        return client
+
+    def get_async(
+        self,
+        azure_endpoint: str,
+        deployment: str,
+        api_version: str,
+        api_key: str,
+        tokens_per_minute: Optional[int] = None,
+    ) -> AsyncAzureOpenAIClient:
+        """
+        Return the shared async client for the deployment, creating it on first use.
+        """
+        key = (azure_endpoint, deployment, api_version)
+        with self._lock:
+            client = self._async_clients.get(key)
+            if client is None or client.api_key != api_key:
+                client = AsyncAzureOpenAIClient(
+                    api_key=api_key,
+                    api_version=api_version,
+                    azure_endpoint=azure_endpoint,
+                    deployment=deployment,
+                    tokens_per_minute=tokens_per_minute,
+                )
+                self._async_clients[key] = client
+            return client
+
+    def close(self) -> None:
+        """
+        Close every pooled connection and forget all clients.
+        """
+        with self._lock:
+            for client in self._clients.values():
+                client.http_client.close()
+            self._clients.clear()
+            self._async_clients.clear()
+            self._checked_at.clear()
+
+    def __check_health(self, key: ClientKey) -> None:
+        with self._lock:
+            previous = self._clients.get(key)
+        # the registry may have been closed since the check was started
+        if previous is None or previous.health_check():
+            return
+        with self._lock:
+            # only replace the client that was checked, not one swapped in since
+            if self._clients.get(key) is not previous:
+                return
+            self._clients[key] = self.__create_client(key, previous.api_key)
+        # requests already in flight on the old pool are left to finish
+        close_later = threading.Timer(60, previous.http_client.close)
+        close_later.daemon = True
+        close_later.start()
+
+    def __create_client(self, key: ClientKey, api_key: str) -> AzureOpenAIClient:
+        azure_endpoint, deployment, api_version = key
+        self._checked_at[key] = time.monotonic()
+        return AzureOpenAIClient(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=azure_endpoint,
+            deployment=deployment,
+            http_client=DefaultHttpxClient(),
+        )
+
+
+_registry = ClientRegistry(
+    health_check_interval=float(
+        os.getenv(
+            "HEALTH_CHECK_INTERVAL_SECONDS", DEFAULT_HEALTH_CHECK_INTERVAL_SECONDS
+        )
+    )
+)
+
+
+def get_registry() -> ClientRegistry:
+    return _registry
+
+
+def get_openai_client() -> Union[AzureOpenAIClient, DeploymentRouter]:
+    """
+    Return the process-wide client for the deployment configured in the
+    environment, or the router over the pool in AZURE_OPENAI_DEPLOYMENTS.
+    """
+    router = get_router()
+    if router is not None:
+        return router
+    return _registry.get(
+        azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
+        deployment=os.getenv("AZURE_OPENAI_API_DEPLOYMENT"),
+        api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+        api_key=load_api_key(),
+    )
+
+
+_router: Optional[DeploymentRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> Optional[DeploymentRouter]:
+    """
+    Return the process-wide router over the deployments listed in
+    AZURE_OPENAI_DEPLOYMENTS, or None if it is not set.
+
+    The list is JSON, inline or in a file (see router.parse_deployments).
+    Set AZURE_OPENAI_HEDGE to hedge slow requests on a second deployment.
+    """
+    global _router
+    with _router_lock:
+        config = os.getenv("AZURE_OPENAI_DEPLOYMENTS")
+        if _router is None and config:
+            _router = DeploymentRouter(
+                parse_deployments(
+                    config,
+                    azure_endpoint=os.getenv("AZURE_OPENAI_API_ENDPOINT"),
+                    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+                ),
+                client_for=_deployment_client,
+                async_client_for=_deployment_async_client,
+                hedge=bool(os.getenv("AZURE_OPENAI_HEDGE")),
+                hedge_quantile=float(
+                    os.getenv("AZURE_OPENAI_HEDGE_QUANTILE", DEFAULT_HEDGE_QUANTILE)
+                ),
+                min_hedge_delay=float(
+                    os.getenv(
+                        "AZURE_OPENAI_HEDGE_MIN_DELAY_SECONDS",
+                        DEFAULT_MIN_HEDGE_DELAY_SECONDS,
+                    )
+                ),
+            )
+        return _router
+
+
+def _deployment_api_key(deployment: Deployment) -> Optional[str]:
+    if deployment.api_key_env:
+        return os.getenv(deployment.api_key_env)
+    return load_api_key()
+
+
+def _deployment_client(deployment: Deployment) -> AzureOpenAIClient:
+    return _registry.get(
+        azure_endpoint=deployment.azure_endpoint,
+        deployment=deployment.deployment,
+        api_version=deployment.api_version,
+        api_key=_deployment_api_key(deployment),
+    )
+
+
+def _deployment_async_client(deployment: Deployment) -> AsyncAzureOpenAIClient:
+    return _registry.get_async(
+        azure_endpoint=deployment.azure_endpoint,
+        deployment=deployment.deployment,
+        api_version=deployment.api_version,
+        api_key=_deployment_api_key(deployment),
+        tokens_per_minute=deployment.tokens_per_minute,
+    )
@@ -0,0 +1,439 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+from urllib.parse import urlparse
+
+from pydantic import BaseModel
+
+from openai_client import (
+    AsyncAzureOpenAIClient,
+    AzureOpenAIClient,
+    run_in_background_loop,
+)
+from telemetry import Span, get_tracer
+
+TEXT = "text"
+VISION = "vision"
+
+DEFAULT_HEDGE_QUANTILE = 0.95
+# never hedge sooner than this, so fast stages do not double their load
+DEFAULT_MIN_HEDGE_DELAY_SECONDS = 1.0
+# used until a deployment has enough latency samples for the stage
+DEFAULT_INITIAL_HEDGE_DELAY_SECONDS = 20.0
+MIN_LATENCY_SAMPLES = 10
+LATENCY_WINDOW = 200
+LATENCY_SMOOTHING = 0.2
+FAILURE_COOLDOWN_SECONDS = 30.0
+# a nearly exhausted quota still scores, just badly
+MIN_QUOTA_FRACTION = 0.05
+
+M = TypeVar("M", bound=BaseModel)
+LatencyKey = Tuple[str, str, bool]
+
+
+@dataclass(frozen=True)
+class Deployment:
+    deployment: str
+    azure_endpoint: str
+    api_version: str
+    capabilities: Tuple[str, ...] = (TEXT, VISION)
+    # relative price per token, e.g. 1 for a mini model and 15 for a large
+    # one, traded off against observed latency when routing
+    cost: float = 1.0
+    tokens_per_minute: Optional[int] = None
+    # environment variable holding the key for this endpoint, if it is not
+    # the default key
+    api_key_env: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        host = urlparse(self.azure_endpoint).hostname or self.azure_endpoint
+        return f"{self.deployment}@{host.split('.')[0]}"
+
+
+def parse_deployments(
+    config: str,
+    azure_endpoint: Optional[str] = None,
+    api_version: Optional[str] = None,
+) -> List[Deployment]:
+    """
+    Parse a JSON list of deployments, given inline or as the path to a file.
+
+    Each entry needs a "deployment" and can set "azure_endpoint",
+    "api_version", "capabilities", "cost", "tokens_per_minute" and
+    "api_key_env". The endpoint and API version default to the given ones.
+    """
+    try:
+        text = config if config.lstrip().startswith("[") else Path(config).read_text()
+        deployments = [
+            Deployment(
+                deployment=entry["deployment"],
+                azure_endpoint=entry.get("azure_endpoint", azure_endpoint),
+                api_version=entry.get("api_version", api_version),
+                capabilities=tuple(entry.get("capabilities", (TEXT, VISION))),
+                cost=float(entry.get("cost", 1.0)),
+                tokens_per_minute=entry.get("tokens_per_minute"),
+                api_key_env=entry.get("api_key_env"),
+            )
+            for entry in json.loads(text)
+        ]
+    except Exception as e:
+        raise RuntimeError(f"Failed to parse deployments: {e}")
+    if not deployments:
+        raise RuntimeError("Failed to parse deployments: the list is empty")
+    return deployments
+
+
+def needs_vision(messages: List[Dict[str, Any]]) -> bool:
+    """
+    Return True if any message has an image in it.
+    """
+    return any(
+        isinstance(message.get("content"), list)
+        and any(part.get("type") == "image_url" for part in message["content"])
+        for message in messages
+    )
+
+
+class LatencyWindow:
+    def __init__(self, size: int = LATENCY_WINDOW) -> None:
+        """
+        Recent latencies of one deployment for one stage, with a smoothed
+        average for routing and quantiles for hedging.
+        """
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.average: Optional[float] = None
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.average = (
+            seconds
+            if self.average is None
+            else LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * self.average
+        )
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class DeploymentRouter:
+    def __init__(
+        self,
+        deployments: Sequence[Deployment],
+        client_for: Callable[[Deployment], AzureOpenAIClient],
+        async_client_for: Callable[[Deployment], AsyncAzureOpenAIClient],
+        hedge: bool = False,
+        hedge_quantile: float = DEFAULT_HEDGE_QUANTILE,
+        min_hedge_delay: float = DEFAULT_MIN_HEDGE_DELAY_SECONDS,
+        initial_hedge_delay: float = DEFAULT_INITIAL_HEDGE_DELAY_SECONDS,
+    ) -> None:
+        """
+        Spread requests over a pool of deployments, on one or more endpoints,
+        behind the same interface as AzureOpenAIClient.
+
+        Requests with an image only go to deployments with the vision
+        capability. Among those able to serve a request, the one with the
+        lowest recent latency for the stage times its cost, divided by the
+        share of its local quota left, is tried first. A deployment that
+        fails is avoided for FAILURE_COOLDOWN_SECONDS and the request moves
+        on to the next one.
+
+        With hedge set, a non-streamed request still running after the
+        hedge_quantile latency of its deployment is sent to the next
+        deployment as well. The first answer wins and the other request is
+        cancelled. Streams are not hedged, but they fail over if they error
+        before the first token.
+        """
+        self.deployments = list(deployments)
+        # stands in for the deployment name in cache keys and fingerprints
+        self.deployment = "+".join(d.name for d in self.deployments)
+        self.client_for = client_for
+        self.async_client_for = async_client_for
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.initial_hedge_delay = initial_hedge_delay
+        self._latency: Dict[LatencyKey, LatencyWindow] = {}
+        self._cooling_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def candidates(
+        self, stage: str, vision: bool = False, streamed: bool = False
+    ) -> List[Deployment]:
+        """
+        Return the deployments able to serve a request, best first.
+        """
+        capability = VISION if vision else TEXT
+        capable = [d for d in self.deployments if capability in d.capabilities]
+        if not capable:
+            raise RuntimeError(
+                f"Failed to route request: no deployment has the {capability} "
+                "capability"
+            )
+        now = time.monotonic()
+        with self._lock:
+            averages = {
+                d.name: window.average
+                for d in capable
+                if (window := self._latency.get((d.name, stage, streamed)))
+            }
+            cooling_until = dict(self._cooling_until)
+        # untried deployments are assumed to be average, so they get tried
+        default = statistics.fmean(averages.values()) if averages else 0.0
+
+        def rank(deployment: Deployment) -> Tuple[bool, float, float]:
+            limiter = self.async_client_for(deployment).rate_limiter
+            cooling = cooling_until.get(deployment.name, 0.0) > now or bool(
+                limiter and limiter.paused_until > now
+            )
+            latency = averages.get(deployment.name, default)
+            return (
+                cooling,
+                latency * deployment.cost / self.__quota_left(deployment),
+                deployment.cost,
+            )
+
+        return sorted(capable, key=rank)
+
+    def hedge_delay(self, deployment: Deployment, stage: str) -> float:
+        """
+        Seconds to wait for a request before hedging it on another deployment.
+        """
+        with self._lock:
+            window = self._latency.get((deployment.name, stage, False))
+            delay = window.quantile(self.hedge_quantile) if window else None
+        if delay is None:
+            delay = self.initial_hedge_delay
+        return max(self.min_hedge_delay, delay)
+
+    def record_latency(
+        self, deployment: Deployment, stage: str, streamed: bool, seconds: float
+    ) -> None:
+        with self._lock:
+            key = (deployment.name, stage, streamed)
+            self._latency.setdefault(key, LatencyWindow()).add(seconds)
+
+    def record_failure(self, deployment: Deployment) -> None:
+        with self._lock:
+            self._cooling_until[deployment.name] = (
+                time.monotonic() + FAILURE_COOLDOWN_SECONDS
+            )
+
+    def generate_response(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format=None,
+        *args,
+        stage: str = "chat",
+        **kwargs,
+    ) -> Any:
+        """
+        Generate a response on the best deployment for it. Takes and returns
+        the same as AzureOpenAIClient.generate_response.
+        """
+        if kwargs.get("stream"):
+            return self.__generate_stream(messages, response_format, stage, **kwargs)
+        with get_tracer().span("route", stage=stage) as route_span:
+            return run_in_background_loop(
+                self.__generate_hedged(
+                    route_span, messages, response_format, stage, **kwargs
+                )
+            )
+
+    def stream_structured_response(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Type[M],
+        stage: str = "chat",
+        **kwargs,
+    ) -> Iterator[Union[Dict[str, Any], M]]:
+        """
+        Stream a structured output response from the best deployment for it,
+        like AzureOpenAIClient.stream_structured_response.
+        """
+        errors = []
+        last_error: Optional[BaseException] = None
+        for deployment in self.candidates(
+            stage, vision=needs_vision(messages), streamed=True
+        ):
+            started_at = time.monotonic()
+            started = False
+            try:
+                for partial in self.client_for(deployment).stream_structured_response(
+                    messages=messages,
+                    response_format=response_format,
+                    stage=stage,
+                    **kwargs,
+                ):
+                    if not started:
+                        started = True
+                        self.record_latency(
+                            deployment, stage, True, time.monotonic() - started_at
+                        )
+                    yield partial
+                return
+            except Exception as e:
+                self.record_failure(deployment)
+                # what was already yielded cannot be taken back
+                if started:
+                    raise
+                errors.append(f"{deployment.name}: {e}")
+                last_error = e
+        raise RuntimeError(
+            f"Failed to generate response: {'; '.join(errors)}"
+        ) from last_error
+
+    def __generate_stream(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        stage: str,
+        **kwargs,
+    ) -> Iterator[Any]:
+        errors = []
+        last_error: Optional[BaseException] = None
+        for deployment in self.candidates(
+            stage, vision=needs_vision(messages), streamed=True
+        ):
+            started_at = time.monotonic()
+            try:
+                stream = self.client_for(deployment).generate_response(
+                    messages=messages,
+                    response_format=response_format,
+                    stage=stage,
+                    **kwargs,
+                )
+            except Exception as e:
+                self.record_failure(deployment)
+                errors.append(f"{deployment.name}: {e}")
+                last_error = e
+                continue
+            return self.__time_first_chunk(stream, deployment, stage, started_at)
+        raise RuntimeError(
+            f"Failed to generate response: {'; '.join(errors)}"
+        ) from last_error
+
+    def __time_first_chunk(
+        self,
+        stream: Iterator[Any],
+        deployment: Deployment,
+        stage: str,
+        started_at: float,
+    ) -> Iterator[Any]:
+        first = True
+        try:
+            for chunk in stream:
+                if first:
+                    first = False
+                    self.record_latency(
+                        deployment, stage, True, time.monotonic() - started_at
+                    )
+                yield chunk
+        except Exception:
+            self.record_failure(deployment)
+            raise
+
+    async def __generate_hedged(
+        self,
+        route_span: Span,
+        messages: List[Dict[str, Any]],
+        response_format: Any,
+        stage: str,
+        **kwargs,
+    ) -> Any:
+        candidates = self.candidates(stage, vision=needs_vision(messages))
+        attempts: Dict[asyncio.Task, Tuple[Deployment, float]] = {}
+        errors: List[str] = []
+        last_error: Optional[BaseException] = None
+        hedged = False
+
+        def start_next() -> Optional[float]:
+            deployment = candidates.pop(0)
+            attempts[
+                asyncio.ensure_future(
+                    self.async_client_for(deployment).generate_response(
+                        messages=messages,
+                        response_format=response_format,
+                        stage=stage,
+                        **kwargs,
+                    )
+                )
+            ] = (deployment, time.monotonic())
+            if self.hedge and not hedged and candidates:
+                return self.hedge_delay(deployment, stage)
+            return None
+
+        hedge_after = start_next()
+        try:
+            while attempts:
+                done, _ = await asyncio.wait(
+                    attempts, timeout=hedge_after, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # slower than usual for its deployment, race it on the next one
+                    hedged = True
+                    route_span.set(hedged=True)
+                    hedge_after = start_next()
+                    continue
+                for task in done:
+                    deployment, started_at = attempts.pop(task)
+                    if task.exception() is None:
+                        self.record_latency(
+                            deployment, stage, False, time.monotonic() - started_at
+                        )
+                        route_span.set(deployment=deployment.name)
+                        return task.result()
+                    self.record_failure(deployment)
+                    errors.append(f"{deployment.name}: {task.exception()}")
+                    last_error = task.exception()
+                    route_span.set(failovers=len(errors))
+                if not attempts and candidates:
+                    hedge_after = start_next()
+        finally:
+            for task, (deployment, started_at) in attempts.items():
+                task.cancel()
+                # the losing side of a hedge was at least this slow, which
+                # steers the next requests away from it
+                self.record_latency(
+                    deployment, stage, False, time.monotonic() - started_at
+                )
+        raise RuntimeError(
+            f"Failed to generate response: {'; '.join(errors)}"
+        ) from last_error
+
+    def __quota_left(self, deployment: Deployment) -> float:
+        # as seen by the local rate limiter, which only exists for
+        # deployments with a tokens_per_minute quota
+        limiter = self.async_client_for(deployment).rate_limiter
+        if limiter is None:
+            return 1.0
+        # read only: the buckets belong to the background event loop
+        return max(
+            MIN_QUOTA_FRACTION,
+            min(
+                bucket.available() / bucket.capacity
+                for bucket in (limiter.tokens, limiter.requests)
+            ),
+        )
@@ -0,0 +1,195 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from pricing import UK_REGIONS, PricingCatalogue, normalise_service_name
+from prompt import CostEstimate, IdentifiedService, IdentifiedServices
+
+PROVIDERS = ("GCP", "AWS", "Azure")
+SERVICE_TIERS = ("Standard", "Developer", "Premium")
+QUANTITY_MULTIPLIERS = (0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+class ScenarioEngine:
+    def __init__(self, pricing_catalogue: Optional[PricingCatalogue]) -> None:
+        """
+        Reprice an identified architecture across providers, tiers and quantity
+        multipliers in one vectorised pass over the pricing catalogue.
+        """
+        self.pricing_catalogue = pricing_catalogue
+        self._category_prices = self.__category_prices()
+
+    def reprice(
+        self,
+        services: IdentifiedServices,
+        fallback: Optional[CostEstimate] = None,
+        providers: Sequence[str] = PROVIDERS,
+        service_tiers: Sequence[str] = SERVICE_TIERS,
+        quantity_multipliers: Sequence[float] = QUANTITY_MULTIPLIERS,
+    ) -> pd.DataFrame:
+        """
+        Return one row per provider x tier x quantity multiplier with the total
+        monthly cost and how many services could be priced. Combinations where
+        no service could be priced are left out.
+
+        When the scenario keeps a service's provider it is priced the way the
+        estimate prices it: by PricingCatalogue.lookup, which matches the SKU
+        first, then by its monthly cost in the fallback estimate. Otherwise, or
+        if neither is available, the cheapest catalogue entry in the same
+        category is used.
+        """
+        if not services.services:
+            return _empty_scenarios()
+
+        service_frame = pd.DataFrame(
+            {
+                "service": range(len(services.services)),
+                "service_provider": [s.provider for s in services.services],
+                "service_key": [
+                    normalise_service_name(s.name) for s in services.services
+                ],
+                "category": [s.category for s in services.services],
+                "quantity": [s.quantity for s in services.services],
+            }
+        )
+        grid = pd.MultiIndex.from_product(
+            [providers, service_tiers], names=["provider", "service_tier"]
+        ).to_frame(index=False)
+        frame = service_frame.merge(grid, how="cross")
+        # a few lookups per service, so the same-provider price is exactly the
+        # one the estimate used
+        exact_prices = pd.DataFrame(
+            [
+                (i, tier, self.__exact_price(service, tier))
+                for i, service in enumerate(services.services)
+                for tier in service_tiers
+            ],
+            columns=["service", "service_tier", "service_price"],
+        ).astype({"service_price": float})
+
+        frame = frame.merge(
+            self._category_prices,
+            on=["provider", "category", "service_tier"],
+            how="left",
+        ).merge(exact_prices, on=["service", "service_tier"], how="left")
+        same_provider = frame["provider"] == frame["service_provider"]
+        unit_cost = frame["service_price"].where(same_provider)
+        if fallback is not None:
+            fallback_prices = {
+                normalise_service_name(item.service_name): item.monthly_units
+                * item.unit_price
+                for item in fallback.line_items
+            }
+            unit_cost = unit_cost.fillna(
+                frame["service_key"].map(fallback_prices).where(same_provider)
+            )
+        unit_cost = unit_cost.fillna(frame["category_price"])
+        frame["monthly_cost"] = unit_cost * frame["quantity"]
+        frame["priced"] = unit_cost.notna()
+
+        totals = frame.groupby(["provider", "service_tier"], sort=False).agg(
+            base_cost=("monthly_cost", "sum"), priced_services=("priced", "sum")
+        )
+        multipliers = np.asarray(quantity_multipliers, dtype=float)
+        # every total scales linearly with quantity, so the multiplier axis is an
+        # outer product rather than another join
+        costs = np.outer(totals["base_cost"].to_numpy(), multipliers)
+        scenarios = pd.DataFrame(
+            {
+                "provider": np.repeat(
+                    totals.index.get_level_values("provider"), len(multipliers)
+                ),
+                "service_tier": np.repeat(
+                    totals.index.get_level_values("service_tier"), len(multipliers)
+                ),
+                "quantity_multiplier": np.tile(multipliers, len(totals)),
+                "monthly_cost": costs.ravel(),
+                "priced_services": np.repeat(
+                    totals["priced_services"].to_numpy(), len(multipliers)
+                ),
+            }
+        )
+        scenarios["unpriced_services"] = (
+            len(services.services) - scenarios["priced_services"]
+        )
+        # a scenario that prices nothing would show up as a misleading £0
+        scenarios = scenarios[scenarios["priced_services"] > 0]
+        return scenarios.sort_values("monthly_cost", ignore_index=True)
+
+    def __exact_price(self, service: IdentifiedService, service_tier: str) -> float:
+        if self.pricing_catalogue is None:
+            return np.nan
+        row = self.pricing_catalogue.lookup(service, service_tier=service_tier)
+        return np.nan if row is None else row["unit_price"] * row["monthly_units"]
+
+    def __category_prices(self) -> pd.DataFrame:
+        # cheapest monthly price per instance by category, restricted to UK
+        # regions, computed once per catalogue
+        if self.pricing_catalogue is None:
+            return _typed_frame(
+                ["provider", "category", "service_tier"], "category_price"
+            )
+        prices = self.pricing_catalogue.prices.reset_index()
+        uk_regions = {
+            (provider, region)
+            for provider, codes in UK_REGIONS.items()
+            for region in codes
+        }
+        prices = prices[
+            [key in uk_regions for key in zip(prices["provider"], prices["region"])]
+        ].rename(columns={"tier": "service_tier"})
+        prices["monthly_price"] = prices["unit_price"] * prices["monthly_units"]
+        return (
+            prices.groupby(["provider", "category", "service_tier"], as_index=False)[
+                "monthly_price"
+            ]
+            .min()
+            .rename(columns={"monthly_price": "category_price"})
+        )
+
+
+def filter_by_price_range(
+    scenarios: pd.DataFrame, low: float, high: float
+) -> pd.DataFrame:
+    """
+    Keep the scenarios whose monthly cost is within [low, high].
+    """
+    return scenarios[scenarios["monthly_cost"].between(low, high)]
+
+
+def _empty_scenarios() -> pd.DataFrame:
+    return pd.DataFrame(
+        columns=[
+            "provider",
+            "service_tier",
+            "quantity_multiplier",
+            "monthly_cost",
+            "priced_services",
+            "unpriced_services",
+        ]
+    )
+
+
+def _typed_frame(key_columns: Sequence[str], price_column: str) -> pd.DataFrame:
+    columns = {column: pd.Series(dtype=object) for column in key_columns}
+    columns[price_column] = pd.Series(dtype=float)
+    return pd.DataFrame(columns)
+
+
+_scenario_engine: Optional[ScenarioEngine] = None
+
+
+def get_scenario_engine(
+    pricing_catalogue: Optional[PricingCatalogue],
+) -> ScenarioEngine:
+    """
+    Return a process-wide engine, rebuilt only when the catalogue changes.
+    """
+    global _scenario_engine
+    if (
+        _scenario_engine is None
+        or _scenario_engine.pricing_catalogue is not pricing_catalogue
+    ):
+        _scenario_engine = ScenarioEngine(pricing_catalogue)
+    return _scenario_engine
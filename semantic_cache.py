@@ -0,0 +1,239 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+
+from analysis import services_fingerprint
+from prompt import PROMPT_VERSION, IdentifiedServices
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL_SECONDS = 24 * 60 * 60
+EMBEDDING_DIMENSIONS = 512
+# words that do not change what a follow-up question asks for
+STOP_WORDS = frozenset(
+    "a an and are as be by can could do does for from how i if in is it me "
+    "my of on or our please should so that the there this to was we what "
+    "which will with would you your".split()
+)
+NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+NUMBER_WORDS = {
+    word: str(i)
+    for i, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve".split()
+    )
+}
+NEGATION = re.compile(r"\b(?:not|no|never|without|none|nor|avoid|stop)\b|n't\b")
+
+
+def normalise_question(question: str) -> str:
+    """
+    Reduce a question to its meaningful words, e.g.
+    "What if we use Reserved Instances?" -> "use reserved instance".
+    """
+    words = re.sub(r"[^a-z0-9]+", " ", question.lower()).split()
+    # a crude plural strip so "instances" and "instance" match
+    return " ".join(
+        word[:-1] if len(word) > 3 and word.endswith("s") else word
+        for word in words
+        if word not in STOP_WORDS
+    )
+
+
+def question_constraints(question: str) -> Tuple[Tuple[str, ...], bool]:
+    """
+    Return the numbers in a question and whether it is negated, which must
+    match exactly before another question's answer is reused.
+
+    Embeddings barely move when only these change, yet "3 VMs" and "30 VMs",
+    or "use" and "do not use", ask for different answers.
+    """
+    text = question.lower().replace("’", "'")
+    numbers = NUMBER.findall(text) + [
+        NUMBER_WORDS[word]
+        for word in re.findall(r"[a-z]+", text)
+        if word in NUMBER_WORDS
+    ]
+    numbers = [number.replace(",", "") for number in numbers]
+    return tuple(sorted(numbers)), bool(NEGATION.search(text))
+
+
+def embed_question(question: str, dimensions: int = EMBEDDING_DIMENSIONS) -> np.ndarray:
+    """
+    Embed a question locally as a unit vector of hashed words and character
+    trigrams, so rewordings and typos still land close to each other.
+    """
+    normalised = normalise_question(question)
+    features = normalised.split()
+    for word in features[:]:
+        padded = f" {word} "
+        features.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature in features:
+        vector[zlib.crc32(feature.encode()) % dimensions] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def architecture_fingerprint(
+    identified_services: IdentifiedServices,
+    provider: str,
+    service_tier: str,
+    deployment: str,
+) -> str:
+    """
+    Identify the architecture and settings a follow-up answer depends on.
+    """
+    payload = ":".join(
+        [
+            services_fingerprint(identified_services),
+            provider,
+            service_tier,
+            deployment,
+            PROMPT_VERSION,
+        ]
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def stream_cached_answer(answer: str) -> Iterator[str]:
+    """
+    Yield a cached answer in word-sized pieces, like a streamed completion.
+    """
+    yield from re.findall(r"\S*\s*", answer)
+
+
+@dataclass
+class CachedAnswer:
+    created_at: float
+    embedding: np.ndarray
+    constraints: Tuple[Tuple[str, ...], bool]
+    question: str
+    answer: str
+
+
+@dataclass
+class SemanticCacheHit:
+    question: str
+    answer: str
+    similarity: float
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    ) -> None:
+        """
+        In-memory LRU of follow-up answers, looked up by question similarity.
+
+        Entries are scoped to an architecture fingerprint, so a question is
+        only answered from the cache for the same identified services and
+        settings, and only when its embedding is at least
+        similarity_threshold (cosine) from a cached question with the same
+        numbers and negation (see question_constraints).
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple[str, str], CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint: str, question: str) -> Optional[SemanticCacheHit]:
+        """
+        Return the cached answer to the most similar question, or None.
+        """
+        query = embed_question(question)
+        constraints = question_constraints(question)
+        best_key, best_similarity = None, self.similarity_threshold
+        with self._lock:
+            self.__evict_expired()
+            for key, entry in self._entries.items():
+                if key[0] != fingerprint or entry.constraints != constraints:
+                    continue
+                similarity = float(entry.embedding @ query)
+                if similarity >= best_similarity:
+                    best_key, best_similarity = key, similarity
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+        return SemanticCacheHit(
+            question=entry.question, answer=entry.answer, similarity=best_similarity
+        )
+
+    def set(self, fingerprint: str, question: str, answer: str) -> None:
+        """
+        Cache the answer to a question about this architecture.
+        """
+        key = (fingerprint, normalise_question(question))
+        entry = CachedAnswer(
+            created_at=time.time(),
+            embedding=embed_question(question),
+            constraints=question_constraints(question),
+            question=question,
+            answer=answer,
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, fingerprint: str) -> int:
+        """
+        Drop every answer about an architecture and return how many were dropped.
+        """
+        with self._lock:
+            keys = [key for key in self._entries if key[0] == fingerprint]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __evict_expired(self) -> None:
+        expired_before = time.time() - self.ttl_seconds
+        for key in [
+            k for k, e in self._entries.items() if e.created_at < expired_before
+        ]:
+            del self._entries[key]
+
+
+_semantic_cache: Optional[SemanticCache] = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """
+    Return the process-wide follow-up cache, shared by every session.
+    """
+    global _semantic_cache
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            _semantic_cache = SemanticCache(
+                similarity_threshold=float(
+                    os.getenv("SEMANTIC_CACHE_THRESHOLD", DEFAULT_SIMILARITY_THRESHOLD)
+                ),
+                max_entries=int(
+                    os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)
+                ),
+                ttl_seconds=float(
+                    os.getenv("SEMANTIC_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)
+                ),
+            )
+        return _semantic_cache
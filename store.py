@@ -0,0 +1,431 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from image_processing import ProcessedImage, hamming_distance
+from pricing import normalise_service_name
+from prompt import (
+    CostEstimate,
+    CostLineItem,
+    IdentifiedService,
+    IdentifiedServices,
+)
+
+DEFAULT_STORE_PATH = ".cache/estimates.sqlite3"
+# diagrams this close in perceptual hash are treated as revisions of each other
+REVISION_MAX_DISTANCE = 10
+REVISION_SEARCH_LIMIT = 200
+DEFAULT_CHUNK_ROWS = 50_000
+LINE_ITEM_DTYPES = {
+    "estimate_id": "int64",
+    "project": "string",
+    "provider": "string",
+    "service_tier": "string",
+    "image_hash": "string",
+    "service_name": "string",
+    "assumptions": "string",
+    "quantity": "float64",
+    "unit": "string",
+    "unit_price": "float64",
+    "monthly_units": "float64",
+    "currency": "string",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS diagrams (
+    image_hash TEXT PRIMARY KEY,
+    perceptual_hash TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS estimates (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    image_hash TEXT NOT NULL REFERENCES diagrams(image_hash),
+    provider TEXT NOT NULL,
+    service_tier TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    total_monthly_cost REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS estimates_by_project
+    ON estimates (project, provider, service_tier, created_at);
+CREATE INDEX IF NOT EXISTS estimates_by_date ON estimates (created_at);
+CREATE INDEX IF NOT EXISTS estimates_by_image ON estimates (image_hash);
+CREATE TABLE IF NOT EXISTS services (
+    estimate_id INTEGER NOT NULL REFERENCES estimates(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    provider TEXT NOT NULL,
+    category TEXT NOT NULL,
+    sku TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    PRIMARY KEY (estimate_id, position)
+);
+CREATE TABLE IF NOT EXISTS line_items (
+    estimate_id INTEGER NOT NULL REFERENCES estimates(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    service_name TEXT NOT NULL,
+    assumptions TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    unit TEXT NOT NULL,
+    unit_price REAL NOT NULL,
+    monthly_units REAL NOT NULL,
+    currency TEXT NOT NULL,
+    PRIMARY KEY (estimate_id, position)
+);
+"""
+
+
+@dataclass
+class StoredEstimate:
+    id: int
+    project: str
+    image_hash: str
+    provider: str
+    service_tier: str
+    created_at: float
+    identified_services: IdentifiedServices
+    cost_estimate: CostEstimate
+
+
+def service_key(service: IdentifiedService) -> Tuple[str, str, str]:
+    """
+    Key identifying a service across revisions, ignoring its quantity.
+    """
+    return (
+        service.provider,
+        normalise_service_name(service.name),
+        service.sku.strip().lower(),
+    )
+
+
+def reusable_line_items(
+    previous: StoredEstimate, services: List[IdentifiedService]
+) -> Tuple[List[CostLineItem], List[IdentifiedService]]:
+    """
+    Split services into line items carried over from the previous revision and
+    the services that still need pricing.
+
+    A service is carried over when the previous revision had the same service
+    (same provider, name and SKU) priced. Its line item is rescaled to the new
+    quantity, since prices are per instance.
+    """
+    previous_items: Dict[str, CostLineItem] = {
+        normalise_service_name(item.service_name): item
+        for item in previous.cost_estimate.line_items
+    }
+    previous_keys = {service_key(s) for s in previous.identified_services.services}
+    reused, changed = [], []
+    for service in services:
+        item = previous_items.get(normalise_service_name(service.name))
+        if item is None or service_key(service) not in previous_keys:
+            changed.append(service)
+            continue
+        reused.append(item.model_copy(update={"quantity": service.quantity}))
+    return reused, changed
+
+
+class EstimateStore:
+    def __init__(self, path: str = DEFAULT_STORE_PATH) -> None:
+        """
+        SQLite store of every estimate, with its diagram, identified services
+        and priced line items, so past results survive the session and later
+        revisions of a diagram only reprice what changed.
+        """
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(SCHEMA)
+
+    def save(
+        self,
+        project: str,
+        image: ProcessedImage,
+        provider: str,
+        service_tier: str,
+        identified_services: IdentifiedServices,
+        cost_estimate: CostEstimate,
+    ) -> int:
+        """
+        Store an estimate and return its id.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR IGNORE INTO diagrams VALUES (?, ?, ?, ?, ?)",
+                (
+                    image.content_hash,
+                    image.perceptual_hash,
+                    image.width,
+                    image.height,
+                    now,
+                ),
+            )
+            estimate_id = self._connection.execute(
+                "INSERT INTO estimates (project, image_hash, provider, service_tier,"
+                " currency, total_monthly_cost, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    project,
+                    image.content_hash,
+                    provider,
+                    service_tier,
+                    cost_estimate.currency,
+                    cost_estimate.total_monthly_cost,
+                    now,
+                ),
+            ).lastrowid
+            self._connection.executemany(
+                "INSERT INTO services VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (estimate_id, i, s.name, s.provider, s.category, s.sku, s.quantity)
+                    for i, s in enumerate(identified_services.services)
+                ],
+            )
+            self._connection.executemany(
+                "INSERT INTO line_items VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        estimate_id,
+                        i,
+                        item.service_name,
+                        json.dumps(item.assumptions),
+                        item.quantity,
+                        item.unit,
+                        item.unit_price,
+                        item.monthly_units,
+                        item.currency,
+                    )
+                    for i, item in enumerate(cost_estimate.line_items)
+                ],
+            )
+        return estimate_id
+
+    def get(self, estimate_id: int) -> Optional[StoredEstimate]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM estimates WHERE id = ?", (estimate_id,)
+            ).fetchone()
+            return self.__load(row) if row else None
+
+    def latest(
+        self, project: str, provider: str, service_tier: str
+    ) -> Optional[StoredEstimate]:
+        """
+        Return the most recent estimate for a project with these settings.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM estimates"
+                " WHERE project = ? AND provider = ? AND service_tier = ?"
+                " ORDER BY created_at DESC, id DESC LIMIT 1",
+                (project, provider, service_tier),
+            ).fetchone()
+            return self.__load(row) if row else None
+
+    def previous_revision(
+        self,
+        image: ProcessedImage,
+        provider: str,
+        service_tier: str,
+        project: str = "",
+    ) -> Optional[StoredEstimate]:
+        """
+        Return the stored estimate that image most likely revises.
+
+        Within a named project that is simply its latest estimate. Without one,
+        it is the most recent estimate of the same diagram, or of a diagram
+        that looks nearly the same.
+        """
+        if project:
+            return self.latest(project, provider, service_tier)
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT e.*, d.perceptual_hash FROM estimates e"
+                " JOIN diagrams d ON d.image_hash = e.image_hash"
+                " WHERE e.provider = ? AND e.service_tier = ?"
+                " ORDER BY e.created_at DESC, e.id DESC LIMIT ?",
+                (provider, service_tier, REVISION_SEARCH_LIMIT),
+            ).fetchall()
+            for row in rows:
+                if row["image_hash"] == image.content_hash:
+                    return self.__load(row)
+            for row in rows:
+                if (
+                    hamming_distance(row["perceptual_hash"], image.perceptual_hash)
+                    <= REVISION_MAX_DISTANCE
+                ):
+                    return self.__load(row)
+        return None
+
+    def history(
+        self,
+        project: Optional[str] = None,
+        provider: Optional[str] = None,
+        since: Optional[float] = None,
+        limit: int = 100,
+    ) -> pd.DataFrame:
+        """
+        Return past estimates, newest first, optionally filtered.
+        """
+        clauses, params = [], []
+        for column, value in (("project", project), ("provider", provider)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            frame = pd.read_sql_query(
+                "SELECT id, project, provider, service_tier, currency,"
+                " total_monthly_cost, image_hash, created_at"
+                f" FROM estimates {where}"
+                " ORDER BY created_at DESC, id DESC LIMIT ?",
+                self._connection,
+                params=params + [limit],
+            )
+        frame["created_at"] = pd.to_datetime(frame["created_at"], unit="s")
+        return frame
+
+    def iter_line_items(
+        self,
+        project: Optional[str] = None,
+        provider: Optional[str] = None,
+        since: Optional[float] = None,
+        chunksize: int = DEFAULT_CHUNK_ROWS,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Yield the priced line items of every matching estimate, with the
+        estimate's project, provider and tier, in frames of at most chunksize
+        rows ordered by estimate.
+
+        Rows are read through a separate read-only connection, so a long
+        export does not hold up estimates being saved meanwhile.
+        """
+        clauses, params = [], []
+        for column, value in (("e.project", project), ("e.provider", provider)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("e.created_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self.__reader() as connection:
+            for chunk in pd.read_sql_query(
+                "SELECT e.id AS estimate_id, e.project, e.provider, e.service_tier,"
+                " e.image_hash, e.created_at, l.service_name, l.assumptions,"
+                " l.quantity, l.unit, l.unit_price, l.monthly_units, l.currency"
+                " FROM line_items l JOIN estimates e ON e.id = l.estimate_id"
+                f" {where} ORDER BY e.id, l.position",
+                connection,
+                params=params,
+                chunksize=chunksize,
+            ):
+                chunk = chunk.astype(LINE_ITEM_DTYPES)
+                chunk["created_at"] = pd.to_datetime(chunk["created_at"], unit="s")
+                # stored as JSON lists
+                chunk["assumptions"] = (
+                    chunk["assumptions"].map(json.loads).str.join("; ").astype("string")
+                )
+                # same as CostLineItem.monthly_cost, for the whole chunk at once
+                chunk["monthly_cost"] = (
+                    chunk["quantity"] * chunk["monthly_units"] * chunk["unit_price"]
+                )
+                yield chunk
+
+    def projects(self) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT DISTINCT project FROM estimates WHERE project != ''"
+                " ORDER BY project"
+            ).fetchall()
+        return [row["project"] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    @contextmanager
+    def __reader(self) -> Iterator[sqlite3.Connection]:
+        if self.path == ":memory:":
+            # an in-memory database only exists on its own connection
+            with self._lock:
+                yield self._connection
+            return
+        connection = sqlite3.connect(
+            f"{Path(self.path).resolve().as_uri()}?mode=ro", uri=True
+        )
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def __load(self, row: sqlite3.Row) -> StoredEstimate:
+        services = self._connection.execute(
+            "SELECT name, provider, category, sku, quantity FROM services"
+            " WHERE estimate_id = ? ORDER BY position",
+            (row["id"],),
+        ).fetchall()
+        line_items = self._connection.execute(
+            "SELECT service_name, assumptions, quantity, unit, unit_price,"
+            " monthly_units, currency FROM line_items"
+            " WHERE estimate_id = ? ORDER BY position",
+            (row["id"],),
+        ).fetchall()
+        return StoredEstimate(
+            id=row["id"],
+            project=row["project"],
+            image_hash=row["image_hash"],
+            provider=row["provider"],
+            service_tier=row["service_tier"],
+            created_at=row["created_at"],
+            identified_services=IdentifiedServices(
+                services=[IdentifiedService(**dict(s)) for s in services]
+            ),
+            cost_estimate=CostEstimate(
+                line_items=[
+                    CostLineItem(
+                        **dict(item) | {"assumptions": json.loads(item["assumptions"])}
+                    )
+                    for item in line_items
+                ]
+            ),
+        )
+
+
+_estimate_store: Optional[EstimateStore] = None
+_estimate_store_loaded = False
+_estimate_store_lock = threading.Lock()
+
+
+def get_estimate_store() -> Optional[EstimateStore]:
+    """
+    Return the process-wide store at ESTIMATE_STORE_PATH, or None if that is
+    set to an empty string.
+    """
+    global _estimate_store, _estimate_store_loaded
+    with _estimate_store_lock:
+        if not _estimate_store_loaded:
+            path = os.getenv("ESTIMATE_STORE_PATH", DEFAULT_STORE_PATH)
+            _estimate_store = EstimateStore(path) if path else None
+            _estimate_store_loaded = True
+        return _estimate_store
@@ -0,0 +1,346 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("telemetry")
+
+METRIC_PREFIX = "cost_estimator"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS_WRITE_INTERVAL_SECONDS = 5.0
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.time)
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def mark_first_token(self) -> None:
+        """
+        Record the time to first token, if it has not been recorded yet.
+        """
+        if "ttft_ms" not in self.attributes:
+            self.attributes["ttft_ms"] = round(self.elapsed_ms(), 2)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS) -> None:
+        """
+        Counters and histograms rendered in the Prometheus text format.
+        """
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}
+        self._help: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels: str) -> None:
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            key = _labels(labels)
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, help: str = "", **labels: str) -> None:
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            # per-bucket counts, then the sum and count of all observations
+            counts = series.setdefault(_labels(labels), [0.0] * (len(self.buckets) + 2))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                metric = f"{METRIC_PREFIX}_{name}"
+                lines += [
+                    f"# HELP {metric} {self._help[name]}",
+                    f"# TYPE {metric} counter",
+                ]
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                metric = f"{METRIC_PREFIX}_{name}"
+                lines += [
+                    f"# HELP {metric} {self._help[name]}",
+                    f"# TYPE {metric} histogram",
+                ]
+                for labels, counts in sorted(series.items()):
+                    cumulative = 0.0
+                    for bound, count in zip(self.buckets + (float("inf"),), counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(
+                            f"{metric}_bucket{_format_labels(labels + (('le', le),))} "
+                            f"{cumulative:g}"
+                        )
+                    lines.append(f"{metric}_sum{_format_labels(labels)} {counts[-2]:g}")
+                    lines.append(
+                        f"{metric}_count{_format_labels(labels)} {counts[-1]:g}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Atomically write the metrics, e.g. for node_exporter's textfile collector.
+        """
+        target = Path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, target)
+
+
+class Tracer:
+    def __init__(
+        self,
+        metrics: MetricsRegistry,
+        max_spans: int = 500,
+        metrics_file: Optional[str] = None,
+    ) -> None:
+        """
+        Record timed spans for each pipeline stage.
+
+        Finished spans are logged as one JSON object per line on the
+        "telemetry" logger, kept for the in-app debug panel and folded into
+        the metrics: durations, time to first token, token counts, cache hits
+        and retries.
+        """
+        self.metrics = metrics
+        self.metrics_file = metrics_file
+        self._spans: Deque[Span] = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def start_span(self, name: str, **attributes: Any) -> Span:
+        """
+        Start a span without making it current, e.g. for one that ends inside
+        a generator. Call finish() when it is done.
+        """
+        parent = _current_span.get()
+        return Span(
+            name=name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            span_id=uuid.uuid4().hex[:16],
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes,
+        )
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        span = self.start_span(name, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = str(e) or type(e).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    def finish(self, span: Span, error: Optional[str] = None) -> None:
+        if span.duration_ms is not None:
+            return
+        span.duration_ms = round(span.elapsed_ms(), 2)
+        span.error = error or span.error
+        with self._lock:
+            self._spans.append(span)
+        logger.debug(json.dumps(span.to_dict(), default=str))
+        self.__update_metrics(span)
+
+    def recent_spans(self) -> List[Span]:
+        with self._lock:
+            return list(self._spans)
+
+    def __update_metrics(self, span: Span) -> None:
+        labels = {"span": span.name}
+        if "stage" in span.attributes:
+            labels["stage"] = str(span.attributes["stage"])
+        self.metrics.observe(
+            "span_duration_seconds",
+            span.duration_ms / 1000,
+            help="Duration of each pipeline span",
+            **labels,
+        )
+        if span.error:
+            self.metrics.inc("span_errors_total", help="Spans that failed", **labels)
+        if "ttft_ms" in span.attributes:
+            self.metrics.observe(
+                "time_to_first_token_seconds",
+                span.attributes["ttft_ms"] / 1000,
+                help="Time from sending a streamed request to its first token",
+                **labels,
+            )
+        for kind in ("prompt", "cached", "completion"):
+            tokens = span.attributes.get(f"{kind}_tokens")
+            if tokens:
+                self.metrics.inc(
+                    "tokens_total",
+                    tokens,
+                    help="Tokens used, by kind",
+                    kind=kind,
+                    **labels,
+                )
+        if "cache_hit" in span.attributes:
+            self.metrics.inc(
+                "cache_lookups_total",
+                help="Result cache lookups, by result",
+                result="hit" if span.attributes["cache_hit"] else "miss",
+                **labels,
+            )
+        if span.attributes.get("retries"):
+            self.metrics.inc(
+                "retries_total",
+                span.attributes["retries"],
+                help="Retried attempts",
+                **labels,
+            )
+        if span.attributes.get("hedged"):
+            self.metrics.inc(
+                "hedged_requests_total",
+                help="Requests sent to a second deployment for being slow",
+                **labels,
+            )
+        if span.attributes.get("failovers"):
+            self.metrics.inc(
+                "failovers_total",
+                span.attributes["failovers"],
+                help="Requests moved to another deployment after a failure",
+                **labels,
+            )
+        if self.metrics_file and time.monotonic() - self._last_write > (
+            METRICS_WRITE_INTERVAL_SECONDS
+        ):
+            self._last_write = time.monotonic()
+            try:
+                self.metrics.write(self.metrics_file)
+            except OSError as e:
+                logger.warning(
+                    "Failed to write metrics to %s: %s", self.metrics_file, e
+                )
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_metrics_server(metrics: MetricsRegistry, port: int) -> ThreadingHTTPServer:
+    """
+    Serve the metrics for Prometheus to scrape on a daemon thread.
+    """
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = metrics.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name="metrics-server", daemon=True
+    ).start()
+    return server
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+_tracer: Optional[Tracer] = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """
+    Return the process-wide tracer, configured from the environment.
+
+    TELEMETRY_LOG_FILE appends the JSON span logs to a file, METRICS_FILE
+    writes the Prometheus metrics to a file and METRICS_PORT serves them over
+    HTTP.
+    """
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            log_file = os.getenv("TELEMETRY_LOG_FILE")
+            if log_file:
+                handler = logging.FileHandler(log_file)
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(handler)
+                logger.setLevel(logging.DEBUG)
+                logger.propagate = False
+            metrics = MetricsRegistry()
+            _tracer = Tracer(metrics, metrics_file=os.getenv("METRICS_FILE") or None)
+            port = os.getenv("METRICS_PORT")
+            if port:
+                start_metrics_server(metrics, int(port))
+        return _tracer
+
+
+def span(name: str, **attributes: Any):
+    """
+    Shorthand for get_tracer().span(...).
+    """
+    return get_tracer().span(name, **attributes)
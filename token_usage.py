@@ -0,0 +1,118 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger("token_usage")
+
+
+@dataclass(frozen=True)
+class UsageRecord:
+    stage: str
+    deployment: str
+    prompt_tokens: int
+    cached_tokens: int
+    completion_tokens: int
+    recorded_at: float
+
+    @property
+    def cached_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+class UsageTracker:
+    def __init__(self, max_records: int = 1000) -> None:
+        """
+        Keep the token usage of the last max_records completions, and running
+        totals per pipeline stage over every completion recorded.
+
+        Cached tokens are the part of the prompt served from the provider's
+        prompt cache, which Azure only uses for prompts of 1024 tokens or
+        more, so short prompts always show a cached ratio of 0.
+        """
+        self._records: Deque[UsageRecord] = deque(maxlen=max_records)
+        self._totals: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, deployment: str, usage: Any) -> Optional[UsageRecord]:
+        """
+        Record the usage block of a completion, if the response had one.
+        """
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        record = UsageRecord(
+            stage=stage,
+            deployment=deployment,
+            prompt_tokens=usage.prompt_tokens or 0,
+            cached_tokens=(getattr(details, "cached_tokens", None) or 0)
+            if details
+            else 0,
+            completion_tokens=usage.completion_tokens or 0,
+            recorded_at=time.time(),
+        )
+        with self._lock:
+            self._records.append(record)
+            totals = self._totals.setdefault(
+                stage,
+                {
+                    "calls": 0,
+                    "prompt_tokens": 0,
+                    "cached_tokens": 0,
+                    "completion_tokens": 0,
+                },
+            )
+            totals["calls"] += 1
+            totals["prompt_tokens"] += record.prompt_tokens
+            totals["cached_tokens"] += record.cached_tokens
+            totals["completion_tokens"] += record.completion_tokens
+        logger.debug(
+            "%s: %d prompt tokens (%d cached), %d completion tokens",
+            stage,
+            record.prompt_tokens,
+            record.cached_tokens,
+            record.completion_tokens,
+        )
+        return record
+
+    def records(self) -> List[UsageRecord]:
+        """
+        Return the most recent completions, oldest first.
+        """
+        with self._lock:
+            return list(self._records)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return call count, token totals and cached ratio for each stage,
+        counting every completion since the tracker was created or cleared.
+        """
+        with self._lock:
+            totals = {
+                stage: dict(stage_totals)
+                for stage, stage_totals in self._totals.items()
+            }
+        for stage in totals.values():
+            stage["cached_ratio"] = (
+                stage["cached_tokens"] / stage["prompt_tokens"]
+                if stage["prompt_tokens"]
+                else 0.0
+            )
+        return totals
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+            self._totals.clear()
+
+
+_usage_tracker = UsageTracker()
+
+
+def get_usage_tracker() -> UsageTracker:
+    """
+    Return the process-wide tracker every client records into.
+    """
+    return _usage_tracker